@@ -0,0 +1,391 @@
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import logging
+import argparse
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+from models.llm import DEFAULT_MODELS
+from models.router import get_provider_router, StubChatModel
+from models.embeddings import get_embedding_metrics
+from models.scheduler import (get_scheduled_llm, get_scheduler_snapshot, request_context,
+                              PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)
+from utils.chat_utils import build_messages, get_system_prompt, chunk_text
+from utils.rag_utils import get_or_create_vector_store, load_vector_store, get_retriever
+from utils.vector_cache import compute_content_hash
+from utils.search_utils import perform_web_search
+from utils.context_utils import pack_context, get_context_token_budget
+from utils.history_utils import ConversationHistory, get_history_token_budget
+from utils.metrics import start_trace, get_metrics_registry
+
+# Headless async API over the same chat / RAG / web search pipeline as the
+# Streamlit app. Run with:
+#   uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+#   python api.py --stub-latency 0.5     # local stub models, for load tests
+# Documents are shared through INDEX_STORE_DIR, so replicas behind a load
+# balancer can serve any document uploaded to one of them if the directory
+# is on shared storage.
+
+logger = logging.getLogger(__name__)
+
+DATA_SOURCES = ("chat", "rag", "web")
+RESPONSE_MODES = ("Concise", "Detailed")
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "background": PRIORITY_BACKGROUND}
+
+class SharedStream:
+    """
+    Text chunks from one upstream call, replayed to every subscriber so
+    coalesced requests all receive the full answer from the start.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.provider = None
+        self.context = {}
+        self._changed = asyncio.Condition()
+
+    async def append(self, text: str):
+        async with self._changed:
+            self.chunks.append(text)
+            self._changed.notify_all()
+
+    async def finish(self, error=None):
+        async with self._changed:
+            self.error = error
+            self.done = True
+            self._changed.notify_all()
+
+    async def subscribe(self):
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.done or len(self.chunks) > sent)
+                new_chunks = self.chunks[sent:]
+                done = self.done
+            for chunk in new_chunks:
+                yield chunk
+            sent += len(new_chunks)
+            if done and sent == len(self.chunks):
+                if self.error:
+                    yield self.error
+                return
+
+def _default_model_factory(provider: str):
+    if provider == "auto":
+        return get_provider_router()
+    return get_scheduled_llm(provider)
+
+def stub_model_factory(latency=0.5, response=None):
+    """
+    Return a model factory serving StubChatModel instances (one per provider),
+    for load tests without provider keys or network access.
+    """
+    models = {}
+    response = response or "This is a stub answer from the local test model."
+
+    def factory(provider):
+        if provider not in models:
+            models[provider] = StubChatModel(response=response, latency=latency)
+        return models[provider]
+
+    factory.models = models
+    return factory
+
+def validate_chat_request(body) -> dict:
+    """
+    Check a chat request body and fill in defaults.
+
+    Raises:
+        ValueError: If the request is malformed
+    """
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+    messages = body.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("'messages' must be a non-empty list")
+    for message in messages:
+        if not isinstance(message, dict) or message.get("role") not in ("user", "assistant") \
+                or not isinstance(message.get("content"), str):
+            raise ValueError("Each message needs a 'role' of 'user' or 'assistant' and a string 'content'")
+    if messages[-1]["role"] != "user":
+        raise ValueError("The last message must be from the user")
+
+    for name in ("provider", "data_source", "response_mode", "priority"):
+        if not isinstance(body.get(name, ""), str):
+            raise ValueError(f"'{name}' must be a string")
+    document_ids = body.get("document_ids")
+    if document_ids is None:
+        document_ids = []
+    if not isinstance(document_ids, list) or not all(isinstance(document_id, str) for document_id in document_ids):
+        raise ValueError("'document_ids' must be a list of strings")
+    if not isinstance(body.get("stream", False), bool):
+        raise ValueError("'stream' must be true or false")
+    if body.get("session_id") is not None and not isinstance(body["session_id"], str):
+        raise ValueError("'session_id' must be a string")
+
+    request = {
+        "provider": body.get("provider", "groq"),
+        "data_source": body.get("data_source", "chat"),
+        "response_mode": body.get("response_mode", "Concise"),
+        "document_ids": sorted(document_ids),
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        "stream": body.get("stream", False),
+        "session_id": body.get("session_id"),
+        "priority": body.get("priority", "interactive"),
+    }
+    if request["provider"] not in DEFAULT_MODELS and request["provider"] != "auto":
+        raise ValueError(f"Unsupported provider: {request['provider']}")
+    if request["data_source"] not in DATA_SOURCES:
+        raise ValueError(f"'data_source' must be one of {', '.join(DATA_SOURCES)}")
+    if request["response_mode"] not in RESPONSE_MODES:
+        raise ValueError(f"'response_mode' must be one of {', '.join(RESPONSE_MODES)}")
+    if request["priority"] not in PRIORITIES:
+        raise ValueError(f"'priority' must be one of {', '.join(PRIORITIES)}")
+    if request["data_source"] == "rag" and not request["document_ids"]:
+        raise ValueError("'document_ids' is required for data_source 'rag'")
+    return request
+
+def request_key(request: dict) -> str:
+    """Identify requests that would produce the same answer"""
+    payload = {name: value for name, value in request.items() if name not in ("stream", "session_id", "priority")}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+class ChatService:
+    """
+    Runs chat requests with bounded per-provider concurrency, coalescing
+    identical in-flight requests onto one upstream call.
+
+    Args:
+        model_factory (callable): provider -> chat model, defaults to get_llm
+            (or the provider router for 'auto')
+        provider_concurrency (int): In-flight LLM calls per provider
+        coalesce (bool): Share identical in-flight requests
+    """
+
+    def __init__(self, model_factory=None, provider_concurrency=None, coalesce=None):
+        self.model_factory = model_factory or _default_model_factory
+        self.provider_concurrency = provider_concurrency or config.API_PROVIDER_CONCURRENCY
+        self.coalesce = config.API_COALESCE_REQUESTS if coalesce is None else coalesce
+        self.requests = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self._semaphores = {}
+        self._inflight = {}
+        # The event loop only keeps weak references to tasks
+        self._tasks = set()
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = self._semaphores[provider] = asyncio.Semaphore(self.provider_concurrency)
+        return semaphore
+
+    async def load_documents(self, document_ids):
+        """
+        Return the vector stores for document_ids.
+
+        Raises:
+            KeyError: If a document was never uploaded
+        """
+        stores = []
+        for document_id in document_ids:
+            vector_store, _ = await asyncio.to_thread(load_vector_store, document_id)
+            if vector_store is None:
+                raise KeyError(document_id)
+            stores.append(vector_store)
+        return stores
+
+    async def _context(self, request: dict, query: str, model_name: str):
+        budget = get_context_token_budget(model_name)
+        if request["data_source"] == "rag":
+            passages = []
+            baseline = []
+            for vector_store in await self.load_documents(request["document_ids"]):
+                retriever = get_retriever(vector_store, k=config.CONTEXT_CANDIDATES)
+                docs = await asyncio.to_thread(retriever.invoke, query)
+                passages.extend(doc.page_content for doc in docs)
+                baseline.extend(doc.page_content for doc in docs[:config.RETRIEVAL_K])
+        elif request["data_source"] == "web":
+            passages = (await asyncio.to_thread(perform_web_search, query)).splitlines()
+            # Snippets change per query; keep them out of the chunk embedding cache
+            return await asyncio.to_thread(pack_context, query, passages, budget, cache_embeddings=False)
+        else:
+            return "", {}
+        return await asyncio.to_thread(pack_context, query, passages, budget, baseline_passages=baseline)
+
+    async def _produce(self, key: str, request: dict, shared: SharedStream):
+        trace = start_trace("api")
+        trace.set(provider=request["provider"], data_source=request["data_source"])
+        try:
+            query = request["messages"][-1]["content"]
+            model_name = DEFAULT_MODELS.get(request["provider"], "")
+            with trace.stage("context"):
+                context, shared.context = await self._context(request, query, model_name)
+            # Clients send the full history; keep the recent turns that fit
+            _, recent = ConversationHistory().prepare(request["messages"], get_history_token_budget(model_name))
+            messages = build_messages(recent, get_system_prompt(request["response_mode"]), context)
+
+            chat_model = self.model_factory(request["provider"])
+            with trace.stage("queue"):
+                semaphore = self._semaphore(request["provider"])
+                await semaphore.acquire()
+            try:
+                self.upstream_calls += 1
+                # The session shares rate-limited provider quota fairly with the others
+                with trace.stage("llm"), request_context(request["session_id"], PRIORITIES[request["priority"]]):
+                    async for chunk in chat_model.astream(messages):
+                        text = chunk_text(chunk)
+                        if text:
+                            await shared.append(text)
+            finally:
+                semaphore.release()
+            shared.provider = getattr(chat_model, "last_provider", None) or request["provider"]
+            await shared.finish()
+        except Exception as e:
+            logger.warning("Chat request failed: %s", e)
+            trace.set(error=True)
+            await shared.finish(error=f"Error getting response: {str(e)}")
+        finally:
+            if self._inflight.get(key) is shared:
+                del self._inflight[key]
+            trace.finish()
+
+    def submit(self, request: dict):
+        """
+        Start a request, or join an identical one already in flight.
+
+        Returns:
+            tuple: (shared_stream, coalesced)
+        """
+        self.requests += 1
+        key = request_key(request)
+        shared = self._inflight.get(key) if self.coalesce else None
+        if shared is not None:
+            self.coalesced += 1
+            return shared, True
+        shared = SharedStream()
+        self._inflight[key] = shared
+        task = asyncio.create_task(self._produce(key, request, shared))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return shared, False
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+def create_app(service: ChatService = None) -> Starlette:
+    """
+    Build the ASGI app. Pass a ChatService (e.g. with stub_model_factory) to
+    serve stub models.
+    """
+    service = service or ChatService()
+
+    async def chat(request: Request):
+        try:
+            chat_request = validate_chat_request(await request.json())
+        except json.JSONDecodeError:
+            return JSONResponse({"error": "Request body must be JSON"}, status_code=400)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        if not chat_request["session_id"] and request.client:
+            chat_request["session_id"] = request.client.host
+        if chat_request["data_source"] == "rag":
+            try:
+                await service.load_documents(chat_request["document_ids"])
+            except KeyError as e:
+                return JSONResponse({"error": f"Unknown document: {e.args[0]}"}, status_code=404)
+
+        shared, coalesced = service.submit(chat_request)
+        if chat_request["stream"]:
+            return StreamingResponse(
+                shared.subscribe(),
+                media_type="text/plain; charset=utf-8",
+                headers={"X-Coalesced": "1" if coalesced else "0"},
+            )
+
+        response = "".join([chunk async for chunk in shared.subscribe()])
+        if shared.error:
+            return JSONResponse({"error": shared.error, "coalesced": coalesced}, status_code=502)
+        return JSONResponse({
+            "response": response,
+            "provider": shared.provider,
+            "coalesced": coalesced,
+            "context": shared.context,
+        })
+
+    async def upload_document(request: Request):
+        file_name = request.query_params.get("filename", "")
+        if not file_name.lower().endswith((".pdf", ".txt")):
+            return JSONResponse({"error": "Pass ?filename= ending in .pdf or .txt"}, status_code=400)
+        data = await request.body()
+        if not data:
+            return JSONResponse({"error": "Empty upload"}, status_code=400)
+        if len(data) > config.API_MAX_UPLOAD_MB * 1024 * 1024:
+            return JSONResponse({"error": f"Upload larger than {config.API_MAX_UPLOAD_MB} MB"}, status_code=413)
+        document_id = compute_content_hash(data)
+        stats = {}
+        try:
+            vector_store, source = await asyncio.to_thread(
+                get_or_create_vector_store, data, file_name, content_hash=document_id, stats=stats
+            )
+        except Exception as e:
+            return JSONResponse({"error": f"Error processing document: {str(e)}"}, status_code=422)
+        return JSONResponse({
+            "document_id": document_id,
+            "source": source,
+            "chunks": len(vector_store.index_to_docstore_id),
+            "stats": stats,
+        })
+
+    async def health(request: Request):
+        return JSONResponse({"status": "ok"})
+
+    async def metrics(request: Request):
+        return JSONResponse({
+            "api": service.stats(),
+            "rate_limits": get_scheduler_snapshot(),
+            "embedding_models": get_embedding_metrics(),
+            **get_metrics_registry().summary(),
+        })
+
+    app = Starlette(routes=[
+        Route("/v1/chat", chat, methods=["POST"]),
+        Route("/v1/documents", upload_document, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ])
+    app.state.service = service
+    return app
+
+app = create_app()
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Headless chat API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stub-latency", type=float, default=None,
+                        help="Serve local stub models with this latency in seconds instead of real providers")
+    args = parser.parse_args()
+
+    service = None
+    if args.stub_latency is not None:
+        service = ChatService(model_factory=stub_model_factory(args.stub_latency))
+    uvicorn.run(create_app(service), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -2,40 +2,97 @@ import streamlit as st
 import os
 import sys
 import shutil
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+import uuid
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
-from models.llm import get_llm
+from models.llm import DEFAULT_MODELS
+from models.router import get_provider_router, get_provider_health_snapshot
+from models.scheduler import get_scheduled_llm, get_scheduler_snapshot, request_context
+from models.embeddings import start_background_warm_up, get_embedding_metrics
 from config import config
-from utils.rag_utils import load_and_split_document, create_vector_store, get_retriever
-from utils.search_utils import perform_web_search
+from utils.rag_utils import get_retriever
+from utils.corpus import DocumentCorpus
+from utils.ingest_worker import get_ingestion_queue, IngestionQueueFull, DONE, FAILED, CANCELLED, QUEUED
+from utils.search_utils import perform_web_search, get_search_cache
+from utils.history_utils import ConversationHistory, get_history_token_budget, message_tokens
+from utils.token_utils import count_tokens
+from utils.chat_utils import get_chat_response, stream_chat_response, get_system_prompt
+from utils.context_utils import pack_context, get_context_token_budget
+from utils.metrics import start_trace, get_metrics_registry, start_metrics_server
+from utils.response_cache import get_response_cache, make_response_scope
+from utils.embedding_cache import get_embedding_cache
+from utils.vector_cache import compute_content_hash
 
-# Ensure temp directory exists
-if not os.path.exists("temp"):
-    os.makedirs("temp")
+def add_document_prompt(corpus):
+    """Proactive assistant prompt once the first document is ready"""
+    if len(corpus) > 0:
+        if "messages" not in st.session_state:
+            st.session_state.messages = []
+        if not st.session_state.messages:
+            st.session_state.messages.append({
+                "role": "assistant", 
+                "content": "I've processed your document. How can I help you with it? You can ask for a summary, specific details, or analysis."
+            })
 
-def get_chat_response(chat_model, messages, system_prompt, context=""):
-    """Get response from the chat model"""
-    try:
-        # Prepare messages for the model
-        final_system_prompt = system_prompt
-        if context:
-            final_system_prompt += f"\n\nCONTEXT FROM DOCUMENTS/SEARCH:\n{context}"
-            
-        formatted_messages = [SystemMessage(content=final_system_prompt)]
-        
-        # Add conversation history
-        for msg in messages:
-            if msg["role"] == "user":
-                formatted_messages.append(HumanMessage(content=msg["content"]))
-            else:
-                formatted_messages.append(AIMessage(content=msg["content"]))
-        
-        # Get response from model
-        response = chat_model.invoke(formatted_messages)
-        return response.content
-    
-    except Exception as e:
-        return f"Error getting response: {str(e)}"
+def process_uploads_in_background(corpus, uploads, new_uploads):
+    """
+    Queue new uploads for background ingestion, add finished ones to the
+    corpus and show progress, so the chat stays usable while documents load.
+    """
+    jobs = st.session_state.setdefault("ingest_jobs", {})
+
+    # Cancel jobs whose files were removed from the uploader
+    for document_id in list(jobs):
+        if document_id not in uploads:
+            jobs.pop(document_id).cancel()
+
+    for document_id, uploaded_file in new_uploads:
+        job = jobs.get(document_id)
+        if job is None:
+            try:
+                jobs[document_id] = get_ingestion_queue().submit(uploaded_file.getvalue(), uploaded_file.name, document_id)
+            except IngestionQueueFull:
+                st.warning(f"Too many documents are being processed right now; {uploaded_file.name} will be retried on your next action.")
+        elif job.status == DONE:
+            # The worker left the vector store in the cache, so this is fast
+            try:
+                corpus.add_document(uploaded_file.getvalue(), uploaded_file.name, document_id)
+                if job.stats:
+                    st.success(
+                        f"Processed {job.file_name} ({job.stats['chunks']} chunks, {job.stats['chunks_per_sec']:.1f} chunks/sec, "
+                        f"{job.stats.get('embedding_cache_hit_rate', 0.0):.0%} reused from embedding cache)"
+                    )
+                else:
+                    st.success(f"Loaded {job.file_name} from cache.")
+                del jobs[document_id]
+            except Exception as e:
+                job.status, job.error = FAILED, str(e)
+    add_document_prompt(corpus)
+
+    if any(not job.finished for job in jobs.values()):
+        ingestion_progress(list(jobs))
+    for job in jobs.values():
+        if job.status == FAILED:
+            st.error(f"Error processing {job.file_name}: {job.error}")
+        elif job.status == CANCELLED:
+            st.caption(f"Cancelled {job.file_name}. Remove and re-add the file to retry.")
+
+@st.fragment(run_every=1.0)
+def ingestion_progress(document_ids):
+    """Live progress of this session's ingestion jobs, refreshed every second"""
+    jobs = st.session_state.get("ingest_jobs", {})
+    for document_id in document_ids:
+        job = jobs.get(document_id)
+        if job is None or job.finished:
+            continue
+        if job.status == QUEUED:
+            st.caption(f"⏳ {job.file_name}: waiting for a worker")
+        else:
+            st.caption(f"⚙️ {job.file_name}: {job.pages_parsed} pages parsed, {job.chunks_embedded} chunks embedded")
+        if st.button("Cancel", key=f"cancel_{document_id}"):
+            job.cancel()
+    if all(jobs.get(document_id) is None or jobs[document_id].finished for document_id in document_ids):
+        # Rerun the whole page so finished documents join the corpus
+        st.rerun()
 
 def instructions_page():
     """Instructions and setup page"""
@@ -120,46 +177,89 @@ def chat_page():
                 st.error("Please enter your OpenAI API Key to proceed.")
                 return
         
+        # Fall back to (or race) other configured providers when this one is slow or failing
+        use_router = st.toggle("Route across providers", value=config.ROUTER_ENABLED)
+        fallback_providers = []
+        if use_router:
+            others = [name for name in DEFAULT_MODELS if name != provider]
+            fallback_providers = st.multiselect(
+                "Fall back to",
+                options=others,
+                default=[name for name in others if name in config.ROUTER_FALLBACK_PROVIDERS],
+                help="Only these providers may answer when the selected one is slow or failing. OpenAI is paid.",
+            )
+
         # Data Source Selection
         data_source = st.radio("Data Source", ["Chat Only", "RAG (Document)", "Web Search"])
         
         # Response Mode
         response_mode = st.radio("Response Mode", ["Concise", "Detailed"])
+
+        # Render tokens as they arrive instead of waiting for the full answer
+        stream_responses = st.toggle("Stream responses", value=config.STREAM_RESPONSES)
+
+        # Reuse earlier answers to near-identical questions in the same scope
+        use_response_cache = st.toggle("Reuse answers to similar questions", value=config.RESPONSE_CACHE_ENABLED)
+        if use_response_cache:
+            cache_stats = get_response_cache().stats()
+            st.caption(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
         
         # RAG File Uploader
         vector_store = None
+        document_hash = ""
+        selected_documents = []
         if data_source == "RAG (Document)":
-            uploaded_file = st.file_uploader("Upload Document (PDF/TXT)", type=["pdf", "txt"])
-            if uploaded_file:
-                with st.spinner("Processing document..."):
-                    # Save file to temp
-                    file_path = os.path.join("temp", uploaded_file.name)
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    # Process
-                    try:
-                        chunks = load_and_split_document(file_path)
-                        vector_store = create_vector_store(chunks)
-                        st.success("Document processed successfully!")
-                        
-                        # Proactive assistant prompt
-                        if "messages" not in st.session_state:
-                            st.session_state.messages = []
-                        if not st.session_state.messages:
-                            st.session_state.messages.append({
-                                "role": "assistant", 
-                                "content": "I've processed your document. How can I help you with it? You can ask for a summary, specific details, or analysis."
-                            })
-                    except Exception as e:
-                        st.error(f"Error processing document: {e}")
+            if "corpus" not in st.session_state:
+                st.session_state.corpus = DocumentCorpus()
+            corpus = st.session_state.corpus
+
+            uploaded_files = st.file_uploader("Upload Documents (PDF/TXT)", type=["pdf", "txt"], accept_multiple_files=True)
+            uploads = {compute_content_hash(f.getvalue()): f for f in uploaded_files or []}
+
+            # Drop documents whose files were removed from the uploader
+            for document_id in list(corpus.documents):
+                if document_id not in uploads:
+                    corpus.remove_document(document_id)
+
+            new_uploads = [(document_id, f) for document_id, f in uploads.items() if document_id not in corpus]
+            if config.BACKGROUND_INGEST:
+                process_uploads_in_background(corpus, uploads, new_uploads)
+            elif new_uploads:
+                with st.spinner("Processing documents..."):
+                    # Process (reuses cached or stored indexes for the same content)
+                    for document_id, uploaded_file in new_uploads:
+                        try:
+                            stats = {}
+                            _, source = corpus.add_document(uploaded_file.getvalue(), uploaded_file.name, document_id,
+                                                            stats=stats)
+                            if source == "built":
+                                st.success(
+                                    f"Processed {uploaded_file.name} ({stats['chunks']} chunks, {stats['chunks_per_sec']:.1f} chunks/sec, "
+                                    f"{stats.get('embedding_cache_hit_rate', 0.0):.0%} reused from embedding cache)"
+                                )
+                            else:
+                                st.success(f"Loaded {uploaded_file.name} from cache.")
+                        except Exception as e:
+                            st.error(f"Error processing {uploaded_file.name}: {e}")
+                add_document_prompt(corpus)
+
+            if len(corpus) > 1:
+                selected_documents = st.multiselect(
+                    "Search in (all documents if empty)",
+                    options=list(corpus.documents),
+                    format_func=lambda document_id: corpus.documents[document_id]["name"],
+                )
+            vector_store = corpus.vector_store
+            document_hash = corpus.corpus_hash(selected_documents or None)
     
     # Initialize Chat Model
     try:
-        if provider == "openai":
-            chat_model = get_llm(provider, openai_api_key=openai_api_key)
+        if use_router:
+            chat_model = get_provider_router(provider, openai_api_key=openai_api_key, fallbacks=fallback_providers)
+        elif provider == "openai":
+            chat_model = get_scheduled_llm(provider, openai_api_key=openai_api_key)
         else:
-            chat_model = get_llm(provider)
+            chat_model = get_scheduled_llm(provider)
     except Exception as e:
         st.error(f"Error initializing {provider} model: {e}")
         if provider == "google":
@@ -169,20 +269,23 @@ def chat_page():
         return
 
     # Define System Prompt based on Mode
-    base_prompt = "You are a Strategic Business Intelligence Analyst."
-    if response_mode == "Concise":
-        system_prompt = f"{base_prompt} Provide short, executive summaries. Focus on key metrics and high-level insights. Be brief and to the point."
-    else:
-        system_prompt = f"{base_prompt} Provide detailed, in-depth analysis. Explain the 'why' and 'how'. Include context, nuance, and comprehensive explanations."
+    system_prompt = get_system_prompt(response_mode)
 
     # Initialize chat history
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "history" not in st.session_state:
+        st.session_state.history = ConversationHistory()
+    if "session_id" not in st.session_state:
+        # Identifies this browser session to the rate-limit scheduler's fair sharing
+        st.session_state.session_id = uuid.uuid4().hex
     
     # Display chat messages
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("answered_by"):
+                st.caption(f"Answered by {message['answered_by']}.")
     
     # Chat input
     if prompt := st.chat_input("Type your message here..."):
@@ -194,28 +297,175 @@ def chat_page():
             st.markdown(prompt)
         
         # Generate and display bot response
-        with st.chat_message("assistant"):
-            with st.spinner("Analyzing..."):
+        trace = start_trace("turn")
+        trace.set(provider=provider, data_source=data_source, response_mode=response_mode, streamed=stream_responses)
+        with st.chat_message("assistant"), request_context(st.session_state.session_id):
+            response_cache = get_response_cache() if use_response_cache else None
+            cached_response = None
+            answered_by = None
+            if response_cache is not None:
+                with trace.stage("response_cache_lookup"):
+                    response_scope = make_response_scope(
+                        provider, DEFAULT_MODELS[provider], response_mode, system_prompt, document_hash or data_source
+                    )
+                    query_embedding = response_cache.embed_query(prompt)
+                    cached_response = response_cache.lookup(prompt, response_scope, query_embedding)
+                trace.set(response_cache_hit=cached_response is not None)
+
+            if cached_response is not None:
+                response = cached_response
+                st.markdown(response)
+                st.caption("Answered from cache of similar questions.")
+            else:
+                with st.spinner("Analyzing..."):
                 
-                context = ""
-                # Handle RAG
-                if data_source == "RAG (Document)" and vector_store:
-                    retriever = get_retriever(vector_store)
-                    docs = retriever.invoke(prompt)
-                    context = "\n".join([doc.page_content for doc in docs])
-                    st.info(f"Retrieved {len(docs)} relevant chunks from document.")
+                    context = ""
+                    # Handle RAG
+                    if data_source == "RAG (Document)" and vector_store:
+                        # Over-fetch candidates when they will be reranked and packed
+                        k = config.CONTEXT_CANDIDATES if config.CONTEXT_PACKING_ENABLED else None
+                        with trace.stage("retrieval"):
+                            retriever = get_retriever(vector_store, k=k, document_ids=selected_documents or None)
+                            docs = retriever.invoke(prompt)
+                        trace.set(retrieved_chunks=len(docs))
+                        sources = sorted({doc.metadata.get("source", "document") for doc in docs})
+                        if config.CONTEXT_PACKING_ENABLED:
+                            with trace.stage("context_packing"):
+                                context, packing = pack_context(
+                                    prompt, [doc.page_content for doc in docs], get_context_token_budget(DEFAULT_MODELS[provider]),
+                                    baseline_passages=[doc.page_content for doc in docs[:config.RETRIEVAL_K]]
+                                )
+                            trace.set(**{f"packing_{name}": value for name, value in packing.items()})
+                            st.info(
+                                f"Using {packing['packed']} of {len(docs)} retrieved chunks from {', '.join(sources) or 'documents'} "
+                                f"({packing['context_tokens']} tokens, {packing['tokens_saved']} fewer than the top {config.RETRIEVAL_K})."
+                            )
+                        else:
+                            context = "\n".join([doc.page_content for doc in docs])
+                            st.info(f"Retrieved {len(docs)} relevant chunks from {', '.join(sources) or 'documents'}.")
                 
-                # Handle Web Search
-                elif data_source == "Web Search":
-                    search_results = perform_web_search(prompt)
-                    context = search_results
-                    st.info("Performed web search.")
+                    # Handle Web Search
+                    elif data_source == "Web Search":
+                        search_cache = get_search_cache()
+                        hits_before = search_cache.hits
+                        with trace.stage("web_search"):
+                            search_results = perform_web_search(prompt)
+                        trace.set(search_cache_hit=search_cache.hits > hits_before)
+                        context = search_results
+                        if config.CONTEXT_PACKING_ENABLED:
+                            with trace.stage("context_packing"):
+                                context, packing = pack_context(
+                                    prompt, search_results.splitlines(), get_context_token_budget(DEFAULT_MODELS[provider]),
+                                    cache_embeddings=False
+                                )
+                            trace.set(**{f"packing_{name}": value for name, value in packing.items()})
+                        st.info("Performed web search.")
                 
-                response = get_chat_response(chat_model, st.session_state.messages, system_prompt, context)
-                st.markdown(response)
+                    # Keep the prompt within the model's budget, folding older turns into a summary
+                    with trace.stage("history"):
+                        summary, history_messages = st.session_state.history.prepare(
+                            st.session_state.messages,
+                            get_history_token_budget(DEFAULT_MODELS[provider]),
+                            chat_model,
+                        )
+                    turn_prompt = system_prompt
+                    if summary:
+                        turn_prompt += f"\n\nSUMMARY OF EARLIER CONVERSATION:\n{summary}"
+                    trace.set(
+                        context_chars=len(context),
+                        context_tokens=count_tokens(context),
+                        history_messages=len(history_messages),
+                        prompt_tokens=count_tokens(turn_prompt) + count_tokens(context)
+                        + sum(message_tokens(m) for m in history_messages),
+                    )
+
+                    if not stream_responses:
+                        with trace.stage("llm"):
+                            response = get_chat_response(chat_model, history_messages, turn_prompt, context)
+                        response_failed = response.startswith("Error getting response:")
+                        st.markdown(response)
+
+                if stream_responses:
+                    turn_stats = {}
+                    with trace.stage("llm"):
+                        response = st.write_stream(
+                            stream_chat_response(chat_model, history_messages, turn_prompt, context, stats=turn_stats)
+                        )
+                    st.session_state.last_turn_stats = turn_stats
+                    # A stream can fail after some text was already shown
+                    response_failed = turn_stats.get("error") is not None
+                    if turn_stats.get("time_to_first_token") is not None:
+                        trace.add_stage("llm_first_token", turn_stats["time_to_first_token"])
+                        trace.set(output_tokens=turn_stats["output_tokens"], tokens_per_sec=turn_stats["tokens_per_sec"])
+                        st.caption(
+                            f"First token in {turn_stats['time_to_first_token']:.2f}s · "
+                            f"{turn_stats['tokens_per_sec']:.1f} tokens/sec"
+                        )
+
+                rate_limit_wait = getattr(chat_model, "last_wait_seconds", 0.0)
+                if rate_limit_wait:
+                    trace.add_stage("rate_limit_wait", rate_limit_wait)
+                provider_used = getattr(chat_model, "last_provider", None) or provider
+                if provider_used != provider:
+                    answered_by = provider_used
+                    st.caption(f"Answered by {provider_used} ({provider} was slow or unavailable).")
+                trace.set(provider_used=provider_used, response_chars=len(response), error=response_failed)
+                if response_cache is not None and not response_failed:
+                    with trace.stage("response_cache_store"):
+                        if provider_used != provider:
+                            # File fallback answers under the model that wrote them
+                            response_scope = make_response_scope(
+                                provider_used, DEFAULT_MODELS[provider_used], response_mode, system_prompt,
+                                document_hash or data_source
+                            )
+                        response_cache.store(prompt, response_scope, response, query_embedding)
+        st.session_state.last_trace = trace.finish().to_dict()
         
         # Add bot response to chat history
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        st.session_state.messages.append({"role": "assistant", "content": response, "answered_by": answered_by})
+
+def debug_panel():
+    """Sidebar breakdown of the last turn and rolling stage percentiles"""
+    with st.sidebar.expander("🔍 Debug: last turn", expanded=False):
+        last_trace = st.session_state.get("last_trace")
+        if last_trace:
+            st.caption(f"Total: {last_trace['total_ms']:.0f} ms")
+            st.table({stage: f"{ms:.1f} ms" for stage, ms in last_trace["stages_ms"].items()})
+            st.json(last_trace["attributes"], expanded=False)
+        else:
+            st.caption("No turns yet.")
+        if config.EMBEDDING_CACHE_ENABLED:
+            cache_stats = get_embedding_cache().stats()
+            st.caption(
+                f"Embedding cache: {cache_stats['hit_rate']:.0%} of {cache_stats['requested']} chunks reused, "
+                f"{cache_stats['entries']} stored"
+            )
+        embedding_models = get_embedding_metrics()
+        if embedding_models:
+            st.caption("Embedding models (this process)")
+            st.table({
+                provider: {
+                    "model": m["model"],
+                    "load s": round(m["load_seconds"], 2),
+                    "warm-up s": None if m["warmup_seconds"] is None else round(m["warmup_seconds"], 2),
+                }
+                for provider, m in embedding_models.items()
+            })
+        provider_health = get_provider_health_snapshot()
+        if provider_health:
+            st.caption("Provider health (this process)")
+            st.table(provider_health)
+        rate_limits = get_scheduler_snapshot()
+        if rate_limits:
+            st.caption("Rate-limit schedulers (this process)")
+            st.table(rate_limits)
+        st.caption("Rolling percentiles (this process)")
+        stages = get_metrics_registry().summary()["stages"]
+        if stages:
+            st.table({
+                name: {"count": s["count"], "p50 ms": round(s["p50_ms"], 1), "p95 ms": round(s["p95_ms"], 1), "p99 ms": round(s["p99_ms"], 1)}
+                for name, s in stages.items()
+            })
 
 def main():
     st.set_page_config(
@@ -224,6 +474,18 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+
+    # Local JSON metrics endpoint for scraping stage latencies
+    if config.METRICS_PORT:
+        try:
+            start_metrics_server(config.METRICS_PORT)
+        except OSError as e:
+            st.sidebar.warning(f"Metrics endpoint not started: {e}")
+
+    # Load the shared embedding model in the background so the first upload is
+    # fast without holding up the first page render (importing torch is slow)
+    if config.WARM_UP_EMBEDDINGS:
+        start_background_warm_up()
     
     # Navigation
     with st.sidebar:
@@ -237,8 +499,10 @@ def main():
         # Add clear chat button in sidebar for chat page
         if page == "Chat":
             st.divider()
+            show_debug = st.toggle("Show debug panel", value=config.SHOW_DEBUG_PANEL)
             if st.button("🗑️ Clear Chat History", use_container_width=True):
                 st.session_state.messages = []
+                st.session_state.pop("history", None)
                 st.rerun()
     
     # Route to appropriate page
@@ -246,6 +510,8 @@ def main():
         instructions_page()
     if page == "Chat":
         chat_page()
+        if show_debug:
+            debug_panel()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,108 @@
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+# Import-time profile of the app's startup path, using python -X importtime.
+# Run from the project root:
+#   python -m benchmarks.import_profile
+#   python -m benchmarks.import_profile --module utils.rag_utils --top 30
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Packages that should only be imported once a feature actually needs them
+HEAVY_MODULES = (
+    "torch", "transformers", "sentence_transformers", "langchain_huggingface",
+    "langchain_groq", "groq", "langchain_openai", "openai", "langchain_google_genai",
+    "google.generativeai", "google.ai.generativelanguage", "langchain_text_splitters",
+    "tiktoken", "httpx", "faiss",
+)
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+def profile_imports(module: str, python=sys.executable) -> dict:
+    """
+    Import module in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: total import time, per-module importtime entries, peak RSS,
+            which HEAVY_MODULES were loaded, and any import error
+    """
+    code = (
+        "import resource, sys, time; start = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - start)\n"
+        "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+        "print(' '.join(sorted(sys.modules)))\n"
+    )
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", code],
+        cwd=PROJECT_ROOT, capture_output=True, text=True,
+    )
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append({
+                "module": name,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                # importtime indents nested imports by two spaces per level
+                "depth": (len(indent) - 1) // 2,
+            })
+
+    report = {"module": module, "imports": entries, "error": None}
+    if result.returncode != 0:
+        report["error"] = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed"
+        return report
+
+    lines = result.stdout.strip().splitlines()
+    loaded = set(lines[-1].split())
+    maxrss_kb = int(lines[-2])
+    report.update(
+        seconds=float(lines[-3]),
+        peak_rss_mb=maxrss_kb / (1024 * 1024) if sys.platform == "darwin" else maxrss_kb / 1024,
+        heavy_loaded=[name for name in HEAVY_MODULES if name in loaded],
+    )
+    return report
+
+def top_level_packages(entries, top):
+    """
+    Return the slowest top-level packages by cumulative import time. Nested
+    packages are counted inside whichever package imported them first.
+    """
+    totals = {}
+    for entry in entries:
+        if "." not in entry["module"] and not entry["module"].startswith("_"):
+            totals[entry["module"]] = max(totals.get(entry["module"], 0.0), entry["cumulative_ms"])
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of the app startup path")
+    parser.add_argument("--module", default="app", help="Module to import (default: app)")
+    parser.add_argument("--top", type=int, default=15, help="Packages to list")
+    parser.add_argument("--json", help="Also write the full report here")
+    args = parser.parse_args()
+
+    report = profile_imports(args.module)
+    if report["error"]:
+        print(f"import {args.module} failed: {report['error']}")
+    else:
+        print(f"import {args.module}: {report['seconds'] * 1000:.0f} ms, peak RSS {report['peak_rss_mb']:.0f} MB")
+        print(f"Heavy modules loaded at startup: {', '.join(report['heavy_loaded']) or 'none'}")
+    print(f"\n{'package':<32} {'cumulative ms':>14}")
+    for package, ms in top_level_packages(report["imports"], args.top):
+        print(f"{package:<32} {ms:>14.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if report["error"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
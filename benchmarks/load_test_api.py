@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import httpx
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from api import create_app, ChatService, stub_model_factory
+from benchmarks.run_benchmarks import WORDS, _percentile
+
+# Load test of the headless chat API. Run from the project root:
+#   python -m benchmarks.load_test_api                          # in-process, stub models
+#   python -m benchmarks.load_test_api --url http://host:8000   # against a running server
+# In-process runs serve StubChatModel with --latency seconds per call, so the
+# numbers show the API's own overhead, concurrency limit and coalescing.
+
+def _prompts(count, seed=2):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 8))) + "?" for _ in range(count)]
+
+async def _send(client, prompt, args, latencies, failures):
+    body = {
+        "provider": args.provider,
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": args.stream,
+    }
+    start = time.perf_counter()
+    try:
+        if args.stream:
+            async with client.stream("POST", "/v1/chat", json=body) as response:
+                async for _ in response.aiter_text():
+                    pass
+                ok = response.status_code == 200
+        else:
+            response = await client.post("/v1/chat", json=body)
+            ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    latencies.append(time.perf_counter() - start)
+    if not ok:
+        failures.append(prompt)
+
+async def run(args):
+    service = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        service = ChatService(
+            model_factory=stub_model_factory(args.latency),
+            provider_concurrency=args.provider_concurrency,
+            coalesce=not args.no_coalesce,
+        )
+        transport = httpx.ASGITransport(app=create_app(service))
+        client = httpx.AsyncClient(transport=transport, base_url="http://api", timeout=args.timeout)
+
+    rng = random.Random(3)
+    prompts = _prompts(args.distinct)
+    requests = [rng.choice(prompts) for _ in range(args.requests)]
+    latencies, failures = [], []
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def worker(prompt):
+        async with limit:
+            await _send(client, prompt, args, latencies, failures)
+
+    start = time.perf_counter()
+    async with client:
+        await asyncio.gather(*(worker(prompt) for prompt in requests))
+        elapsed = time.perf_counter() - start
+        stats = service.stats() if service else (await client.get("/metrics")).json().get("api", {})
+
+    print(f"{len(requests)} requests ({args.distinct} distinct prompts), concurrency {args.concurrency}")
+    print(f"  p50 {_percentile(latencies, 0.50) * 1000:.0f} ms  p95 {_percentile(latencies, 0.95) * 1000:.0f} ms  "
+          f"p99 {_percentile(latencies, 0.99) * 1000:.0f} ms")
+    print(f"  throughput {len(requests) / elapsed:.1f} req/s, failures {len(failures)}")
+    print(f"  upstream calls {stats.get('upstream_calls')}, coalesced {stats.get('coalesced')}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the headless chat API")
+    parser.add_argument("--url", help="Base URL of a running API; default runs it in-process with stub models")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100, help="Requests in flight at once")
+    parser.add_argument("--distinct", type=int, default=50, help="Distinct prompts the requests are drawn from")
+    parser.add_argument("--provider", default="groq")
+    parser.add_argument("--stream", action="store_true", help="Use streaming responses")
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub model latency in seconds")
+    parser.add_argument("--provider-concurrency", type=int, default=None)
+    parser.add_argument("--no-coalesce", action="store_true", help="Send every request upstream")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import argparse
+import threading
+from collections import Counter
+from langchain_core.messages import HumanMessage
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from models.scheduler import ProviderScheduler, ScheduledChatModel, RateLimitedStubModel, request_context
+from utils.token_utils import count_tokens
+
+# Simulates a rate-limited provider and compares calling it directly with
+# calling it through the scheduler. Run from the project root:
+#   python -m benchmarks.rate_limit_sim
+#   python -m benchmarks.rate_limit_sim --scheduler-rpm 120   # quotas set too high
+# The quota window is shortened (--window) so a run takes seconds, not minutes.
+# A heavy session fills the queue first and light sessions join one window
+# later; with fair sharing they are served right away instead of queueing
+# behind the heavy session's backlog.
+
+def simulate(args, scheduled: bool) -> dict:
+    stub = RateLimitedStubModel(rpm=args.rpm, tpm=args.tpm, window_seconds=args.window, latency=args.latency)
+    model = stub
+    scheduler = None
+    if scheduled:
+        scheduler = ProviderScheduler(
+            "stub", rpm=args.scheduler_rpm or args.rpm, tpm=args.scheduler_tpm or args.tpm,
+            period_seconds=args.window, backoff_seconds=args.window / 20,
+            max_backoff_seconds=args.window, max_wait_seconds=args.window * 20,
+        )
+        model = ScheduledChatModel(stub, scheduler)
+
+    sessions = {"heavy": args.heavy_requests}
+    sessions.update({f"light-{i}": args.light_requests for i in range(args.light_sessions)})
+    finished = []
+    failures = Counter()
+    lock = threading.Lock()
+
+    def session(name, count):
+        if name != "heavy":
+            time.sleep(args.window)
+        with request_context(name):
+            for i in range(count):
+                prompt = [HumanMessage(content=f"Question {i} from {name} about quarterly revenue")]
+                try:
+                    model.invoke(prompt)
+                except Exception:
+                    with lock:
+                        failures[name] += 1
+                    continue
+                with lock:
+                    finished.append((time.perf_counter(), name))
+
+    threads = []
+    for name, count in sessions.items():
+        # Each session keeps --parallel requests in flight
+        per_thread = [count // args.parallel + (1 if i < count % args.parallel else 0) for i in range(args.parallel)]
+        threads.extend(threading.Thread(target=session, args=(name, n)) for n in per_thread if n)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    light_done = [t - start - args.window for t, name in finished if name != "heavy"]
+    result = {
+        "completed": len(finished),
+        "failed": sum(failures.values()),
+        "rejected_429": stub.rejected,
+        "elapsed_s": elapsed,
+        "throughput": len(finished) / elapsed,
+        "ceiling": args.rpm / args.window,
+        "light_sessions_done_s": max(light_done) if light_done else None,
+    }
+    if scheduler is not None:
+        result["scheduler"] = scheduler.snapshot()
+    return result
+
+def print_result(name, result):
+    print(f"{name}: {result['completed']} completed, {result['failed']} failed, "
+          f"{result['rejected_429']} provider 429s in {result['elapsed_s']:.1f}s")
+    print(f"  throughput {result['throughput']:.1f} req/s (quota ceiling {result['ceiling']:.1f} req/s)")
+    if result["light_sessions_done_s"] is not None:
+        print(f"  light sessions finished {result['light_sessions_done_s']:.1f}s after joining")
+    if "scheduler" in result:
+        print(f"  scheduler: {result['scheduler']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a rate-limited provider with and without the scheduler")
+    parser.add_argument("--rpm", type=int, default=60, help="Provider requests per window")
+    parser.add_argument("--tpm", type=int, default=100000, help="Provider tokens per window")
+    parser.add_argument("--window", type=float, default=3.0, help="Quota window in seconds (60 for real quotas)")
+    parser.add_argument("--scheduler-rpm", type=int, default=None, help="Quota the scheduler is configured with")
+    parser.add_argument("--scheduler-tpm", type=int, default=None)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub call latency in seconds")
+    parser.add_argument("--heavy-requests", type=int, default=200)
+    parser.add_argument("--light-sessions", type=int, default=4)
+    parser.add_argument("--light-requests", type=int, default=10)
+    parser.add_argument("--parallel", type=int, default=8, help="Requests in flight per session")
+    args = parser.parse_args()
+
+    count_tokens("warm up")
+    print_result("direct", simulate(args, scheduled=False))
+    print_result("scheduled", simulate(args, scheduled=True))
+
+if __name__ == "__main__":
+    main()
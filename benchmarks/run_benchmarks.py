@@ -0,0 +1,301 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+from langchain_core.language_models import FakeListChatModel
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+from utils.chat_utils import get_chat_response, stream_chat_response
+from utils.rag_utils import load_and_split_document, create_vector_store, get_retriever
+from utils.search_utils import StaticSearchBackend, set_search_backend, get_search_cache, perform_web_search
+
+# Offline, reproducible benchmarks of the ingest, retrieval and chat paths.
+# Run from the project root:
+#   python -m benchmarks.run_benchmarks                   # compare with baseline
+#   python -m benchmarks.run_benchmarks --save-baseline   # record a new baseline
+# Embeddings default to the deterministic 'fake' provider and the chat model
+# and web search are local stand-ins, so no network access is needed.
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+SAMPLE_PDF = os.path.join(BENCHMARK_DIR, "..", "temp", "NeoStats AI Engineer Case Study.pdf")
+
+WORDS = (
+    "model data retrieval vector index chunk embedding latency throughput query document page "
+    "search provider response token context prompt cache memory batch worker cluster revenue "
+    "customer forecast pipeline report metric analysis quarter growth risk policy engineer "
+    "deployment service request budget summary evaluation accuracy feature training dataset "
+    "inference network storage region market product strategy portfolio compliance audit"
+).split()
+
+# Regressions are checked in these directions; throughput may only go up
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "peak_rss_mb")
+HIGHER_IS_BETTER = ("throughput",)
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_synthetic_pdf(path: str, num_pages: int, lines_per_page=45, seed=0):
+    """
+    Write a text PDF of num_pages pages of pseudo-random sentences. The same
+    seed always produces the same file, so chunk counts are stable.
+    """
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for _ in range(num_pages):
+        lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 14))).capitalize() + "."
+                 for _ in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_ref = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>")
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {num_pages} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_at = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def _summarize(latencies, units, unit_name):
+    """Latency percentiles in ms and throughput in units per second of measured time"""
+    total = sum(latencies)
+    return {
+        "ops": len(latencies),
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "throughput": units / total if total > 0 else 0.0,
+        "throughput_unit": unit_name,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def _random_queries(count, seed=1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 6))) for _ in range(count)]
+
+def benchmark_document(name, path, args, results):
+    """Benchmark splitting, indexing and retrieval for one PDF"""
+    latencies = []
+    for _ in range(args.repeat):
+        chunks, seconds = _timed(load_and_split_document, path)
+        latencies.append(seconds)
+    num_pages = len({chunk.metadata.get("page") for chunk in chunks})
+    results[f"load_and_split[{name}]"] = _summarize(latencies, len(chunks) * args.repeat, "chunks/s")
+    results[f"load_and_split[{name}]"].update(pages=num_pages, chunks=len(chunks))
+
+    # Cold: every chunk goes to the embedding model
+    config.EMBEDDING_CACHE_ENABLED = False
+    latencies = []
+    for _ in range(args.repeat):
+        vector_store, seconds = _timed(create_vector_store, chunks, embedding_provider=args.embeddings)
+        latencies.append(seconds)
+    results[f"create_vector_store[{name}]"] = _summarize(latencies, len(chunks) * args.repeat, "chunks/s")
+
+    # Warm: re-ingest with every chunk in the embedding cache
+    config.EMBEDDING_CACHE_ENABLED = True
+    create_vector_store(chunks, embedding_provider=args.embeddings)
+    latencies = []
+    for _ in range(args.repeat):
+        vector_store, seconds = _timed(create_vector_store, chunks, embedding_provider=args.embeddings)
+        latencies.append(seconds)
+    results[f"create_vector_store_cached[{name}]"] = _summarize(latencies, len(chunks) * args.repeat, "chunks/s")
+
+    retriever = get_retriever(vector_store)
+    retriever.invoke("warm up")
+    latencies = []
+    for query in _random_queries(args.queries):
+        _, seconds = _timed(retriever.invoke, query)
+        latencies.append(seconds)
+    results[f"retrieve[{name}]"] = _summarize(latencies, len(latencies), "queries/s")
+    return chunks
+
+def benchmark_chat(context_chunks, args, results):
+    """Benchmark prompt assembly and response handling with a fake chat model"""
+    answer = " ".join(WORDS[:60])
+    chat_model = FakeListChatModel(responses=[answer])
+    context = "\n".join(chunk.page_content for chunk in context_chunks[:config.RETRIEVAL_K])
+    history = []
+    for i in range(10):
+        history.append({"role": "user", "content": f"Question {i} about the {WORDS[i]}?"})
+        history.append({"role": "assistant", "content": answer})
+    system_prompt = "You are a helpful assistant. Answer from the context."
+
+    latencies = []
+    for query in _random_queries(args.chat_calls, seed=2):
+        messages = history + [{"role": "user", "content": query}]
+        _, seconds = _timed(get_chat_response, chat_model, messages, system_prompt, context)
+        latencies.append(seconds)
+    results["chat_response"] = _summarize(latencies, len(latencies), "responses/s")
+
+    latencies = []
+    first_tokens = []
+    for query in _random_queries(args.chat_calls, seed=3):
+        stats = {}
+        messages = history + [{"role": "user", "content": query}]
+        _, seconds = _timed(lambda: "".join(stream_chat_response(chat_model, messages, system_prompt, context, stats)))
+        latencies.append(seconds)
+        first_tokens.append(stats["time_to_first_token"] or 0.0)
+    results["chat_stream"] = _summarize(latencies, len(latencies), "responses/s")
+    results["chat_stream"]["ttft_p50_ms"] = _percentile(first_tokens, 0.50) * 1000
+
+def benchmark_web_search(args, results):
+    """Benchmark web search formatting and multi-query merging against a local backend"""
+    rng = random.Random(4)
+    results_per_query = [
+        {"title": f"Result {i}", "snippet": " ".join(rng.choice(WORDS) for _ in range(30)), "link": f"https://example.com/{i}"}
+        for i in range(10)
+    ]
+    set_search_backend(StaticSearchBackend(default=results_per_query))
+    latencies = []
+    for query in _random_queries(args.queries, seed=5):
+        get_search_cache().clear()
+        _, seconds = _timed(perform_web_search, query)
+        latencies.append(seconds)
+    results["web_search"] = _summarize(latencies, len(latencies), "searches/s")
+
+def run(args) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Keep benchmark embeddings out of the app's chunk embedding cache
+        config.EMBEDDING_CACHE_PATH = os.path.join(tmp_dir, "embeddings.sqlite3")
+        documents = [
+            (f"synthetic-{pages}p", write_synthetic_pdf(os.path.join(tmp_dir, f"synthetic_{pages}.pdf"), pages, seed=pages))
+            for pages in args.pages
+        ]
+        if os.path.exists(SAMPLE_PDF) and not args.skip_sample:
+            documents.insert(0, ("case-study", SAMPLE_PDF))
+        chunks = []
+        for name, path in documents:
+            print(f"Benchmarking {name}...", file=sys.stderr)
+            chunks = benchmark_document(name, path, args, results)
+
+    benchmark_chat(chunks, args, results)
+    benchmark_web_search(args, results)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embeddings": args.embeddings,
+            "faiss_index_type": config.FAISS_INDEX_TYPE,
+            "retrieval_mode": config.RETRIEVAL_MODE,
+            "chunk_size": config.CHUNK_SIZE,
+            "chunk_overlap": config.CHUNK_OVERLAP,
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "benchmarks": results,
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float, min_delta_ms: float):
+    """
+    Return a list of regression messages: latencies or peak RSS more than
+    tolerance above the baseline, or throughput more than tolerance below it.
+    Latency changes under min_delta_ms are treated as noise.
+    """
+    regressions = []
+    for name, metrics in current["benchmarks"].items():
+        expected = baseline.get("benchmarks", {}).get(name)
+        if expected is None:
+            continue
+        for key in LOWER_IS_BETTER:
+            old, new = expected.get(key), metrics.get(key)
+            if old is None or new is None:
+                continue
+            if key.endswith("_ms") and new - old < min_delta_ms:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append(f"{name}: {key} {old:.2f} -> {new:.2f}")
+        for key in HIGHER_IS_BETTER:
+            old, new = expected.get(key), metrics.get(key)
+            if old and new is not None and new < old * (1 - tolerance):
+                regressions.append(f"{name}: {key} {old:.1f} -> {new:.1f} {metrics['throughput_unit']}")
+    return regressions
+
+def print_report(report: dict, baseline=None):
+    print(f"{'benchmark':<36} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'throughput':>20} {'rss MB':>8} {'vs base':>8}")
+    for name, metrics in report["benchmarks"].items():
+        throughput = f"{metrics['throughput']:.1f} {metrics['throughput_unit']}"
+        change = ""
+        expected = (baseline or {}).get("benchmarks", {}).get(name)
+        if expected and expected.get("p50_ms"):
+            change = f"{(metrics['p50_ms'] / expected['p50_ms'] - 1) * 100:+.0f}%"
+        print(f"{name:<36} {metrics['p50_ms']:>9.2f} {metrics['p95_ms']:>9.2f} {metrics['p99_ms']:>9.2f} "
+              f"{throughput:>20} {metrics['peak_rss_mb']:>8.0f} {change:>8}")
+    print(f"Peak RSS: {report['peak_rss_mb']:.0f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of ingest, retrieval and chat")
+    parser.add_argument("--pages", type=lambda value: [int(p) for p in value.split(",")], default=[5, 50, 200],
+                        help="Comma-separated page counts of the synthetic PDFs")
+    parser.add_argument("--skip-sample", action="store_true", help="Don't benchmark the case-study PDF in temp/")
+    parser.add_argument("--embeddings", default="fake", help="Embedding provider ('fake' needs no model download)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each ingest step per document")
+    parser.add_argument("--queries", type=int, default=200, help="Retrieval and search queries per benchmark")
+    parser.add_argument("--chat-calls", type=int, default=200)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write results to the baseline file")
+    parser.add_argument("--output", help="Also write the results JSON here")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore latency changes smaller than this")
+    args = parser.parse_args()
+
+    report = run(args)
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if baseline is None:
+        print("No baseline found; run with --save-baseline to record one")
+        return
+
+    regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print("Regressions against baseline:")
+        for message in regressions:
+            print(f"  {message}")
+        sys.exit(1)
+    print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
@@ -16,8 +16,135 @@ TAVILY_API_KEY = os.getenv("TAVILY_API_KEY", "")
 APP_TITLE = "Strategic Business Intelligence Analyst"
 APP_ICON = "📊"
 
+# Chat Settings
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20")) # Per provider, shared across sessions
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+
+# Provider Routing (fastest healthy provider, fallback and optional hedging)
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "false").lower() == "true"
+# Providers a router may fall back to besides the selected one; OpenAI is paid, so it is opt-in
+ROUTER_FALLBACK_PROVIDERS = [name.strip() for name in os.getenv("ROUTER_FALLBACK_PROVIDERS", "groq,google").split(",") if name.strip()]
+ROUTER_HEDGE = os.getenv("ROUTER_HEDGE", "false").lower() == "true" # Race a second provider when the first is slow
+ROUTER_HEDGE_DELAY_SECONDS = float(os.getenv("ROUTER_HEDGE_DELAY_SECONDS", "3")) # Until the provider has a p95
+ROUTER_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("ROUTER_HEDGE_MIN_DELAY_SECONDS", "0.5"))
+ROUTER_WINDOW_SIZE = int(os.getenv("ROUTER_WINDOW_SIZE", "50")) # Recent calls kept per provider
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "5")) # Before p95 is trusted for hedging
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5")) # Above this a provider is ranked last
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3")) # Consecutive failures that open the breaker
+ROUTER_RESET_SECONDS = float(os.getenv("ROUTER_RESET_SECONDS", "30")) # Open breaker cool-down before a trial call
+ROUTER_MAX_QUOTA_WAIT_SECONDS = float(os.getenv("ROUTER_MAX_QUOTA_WAIT_SECONDS", "1")) # Rate-limit queueing before failing over
+
+# Rate Limiting (per-provider request/token quotas per minute, 0 disables a limit)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMITS = {
+    "groq": {"rpm": int(os.getenv("GROQ_RPM", "30")), "tpm": int(os.getenv("GROQ_TPM", "12000"))},
+    "openai": {"rpm": int(os.getenv("OPENAI_RPM", "500")), "tpm": int(os.getenv("OPENAI_TPM", "200000"))},
+    "google": {"rpm": int(os.getenv("GOOGLE_RPM", "10")), "tpm": int(os.getenv("GOOGLE_TPM", "250000"))},
+}
+RATE_LIMIT_OUTPUT_TOKENS = int(os.getenv("RATE_LIMIT_OUTPUT_TOKENS", "512")) # Completion tokens reserved before sending
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3")) # Retries of a rate-limited call after backoff
+RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv("RATE_LIMIT_BACKOFF_SECONDS", "2")) # First backoff without Retry-After, doubles
+RATE_LIMIT_MAX_BACKOFF_SECONDS = float(os.getenv("RATE_LIMIT_MAX_BACKOFF_SECONDS", "60"))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "120")) # Queue wait before a call fails
+RATE_LIMIT_RECOVERY_STEP = float(os.getenv("RATE_LIMIT_RECOVERY_STEP", "0.05")) # Rate regained per success after a 429
+
+# Conversation History (token budget for summary + recent turns, per model)
+HISTORY_TOKEN_BUDGETS = {
+    "llama-3.3-70b-versatile": 6000,
+    "gpt-4o-mini": 8000,
+    "gemini-2.5-flash": 8000,
+}
+HISTORY_TOKEN_BUDGET_DEFAULT = int(os.getenv("HISTORY_TOKEN_BUDGET_DEFAULT", "4000"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "400"))
+HISTORY_LOW_WATERMARK = float(os.getenv("HISTORY_LOW_WATERMARK", "0.6")) # Trim to this share of the budget
+
 # RAG Settings
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2" # Free local model
 # EMBEDDING_MODEL = "text-embedding-3-small" # OpenAI model (requires key)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid") # 'hybrid' (BM25 + vector) or 'vector'
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20")) # Candidates per ranking before fusion
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_BM25_WEIGHT = float(os.getenv("HYBRID_BM25_WEIGHT", "1.0"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+# Context Packing (rerank over-fetched chunks, strip overlaps, fit a token budget per model)
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING_ENABLED", "true").lower() == "true"
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "12")) # Chunks retrieved before reranking
+CONTEXT_RERANKER = os.getenv("CONTEXT_RERANKER", "mmr") # 'mmr', 'cross-encoder' or 'none'
+CONTEXT_CROSS_ENCODER_MODEL = os.getenv("CONTEXT_CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7")) # 1.0 = relevance only
+CONTEXT_MIN_OVERLAP_CHARS = int(os.getenv("CONTEXT_MIN_OVERLAP_CHARS", "20")) # Shorter shared text is kept
+# Upper bounds; a packed context is also never larger than the top RETRIEVAL_K chunks it replaces
+CONTEXT_TOKEN_BUDGETS = {
+    "llama-3.3-70b-versatile": 600,
+    "gpt-4o-mini": 750,
+    "gemini-2.5-flash": 750,
+}
+CONTEXT_TOKEN_BUDGET_DEFAULT = int(os.getenv("CONTEXT_TOKEN_BUDGET_DEFAULT", "600"))
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_NUM_THREADS = int(os.getenv("EMBEDDING_NUM_THREADS", "0")) # 0 keeps the torch default
+EMBEDDING_NORMALIZE = os.getenv("EMBEDDING_NORMALIZE", "false").lower() == "true"
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64")) # Chunks per embedding batch
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+BACKGROUND_INGEST = os.getenv("BACKGROUND_INGEST", "true").lower() == "true" # Process uploads off the UI thread
+INGEST_QUEUE_WORKERS = int(os.getenv("INGEST_QUEUE_WORKERS", "2")) # Documents ingested at once per process
+INGEST_QUEUE_MAX_SIZE = int(os.getenv("INGEST_QUEUE_MAX_SIZE", "16")) # Waiting jobs before uploads are refused
+STREAMING_INGEST = os.getenv("STREAMING_INGEST", "true").lower() == "true" # Load and split pages lazily
+WARM_UP_EMBEDDINGS = os.getenv("WARM_UP_EMBEDDINGS", "true").lower() == "true" # Load the model in the background at app start
+
+# Cache Settings
+VECTOR_CACHE_MAX_MB = int(os.getenv("VECTOR_CACHE_MAX_MB", "512")) # Memory budget for processed uploads
+
+# Chunk Embedding Cache (content-addressed, shared across documents and processes)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000")) # ~1.5 KB each at 384 dims
+
+# Persistent Index Store
+INDEX_STORE_DIR = os.getenv("INDEX_STORE_DIR", "index_store") # Shared across sessions and processes
+INDEX_STORE_MAX_MB = int(os.getenv("INDEX_STORE_MAX_MB", "2048"))
+INDEX_STORE_MMAP = os.getenv("INDEX_STORE_MMAP", "true").lower() == "true"
+
+# Semantic Response Cache
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join("cache", "responses.sqlite3"))
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92")) # Cosine similarity
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+
+# Web Search Settings
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "5"))
+SEARCH_MAX_QUERIES = int(os.getenv("SEARCH_MAX_QUERIES", "1")) # >1 runs query reformulations concurrently
+SEARCH_MAX_WORKERS = int(os.getenv("SEARCH_MAX_WORKERS", "4"))
+SEARCH_DEADLINE_SECONDS = float(os.getenv("SEARCH_DEADLINE_SECONDS", "8"))
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "900"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "512"))
+
+# Vector Index Settings (flat, ivf, ivfpq, ivfsq8, hnsw or sq8)
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+FAISS_MIN_VECTORS_FOR_ANN = int(os.getenv("FAISS_MIN_VECTORS_FOR_ANN", "10000")) # Smaller stores stay flat
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0")) # IVF lists, 0 = 4 * sqrt(n)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "48")) # PQ sub-quantizers, must divide the embedding dimension
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_EF_CONSTRUCTION = int(os.getenv("FAISS_EF_CONSTRUCTION", "80"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+FAISS_TRAIN_SAMPLE = int(os.getenv("FAISS_TRAIN_SAMPLE", "50000"))
+
+# Headless API (uvicorn api:app)
+API_PROVIDER_CONCURRENCY = int(os.getenv("API_PROVIDER_CONCURRENCY", "8")) # In-flight LLM calls per provider, per process
+API_COALESCE_REQUESTS = os.getenv("API_COALESCE_REQUESTS", "true").lower() == "true" # Share identical in-flight requests
+API_MAX_UPLOAD_MB = int(os.getenv("API_MAX_UPLOAD_MB", "50"))
+
+# Metrics & Tracing
+METRICS_WINDOW_SIZE = int(os.getenv("METRICS_WINDOW_SIZE", "1000")) # Samples kept per stage for percentiles
+METRICS_TRACE_FILE = os.getenv("METRICS_TRACE_FILE", "") # e.g. logs/traces.jsonl; empty disables
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # Serve /metrics on this port; 0 disables
+SHOW_DEBUG_PANEL = os.getenv("SHOW_DEBUG_PANEL", "false").lower() == "true"
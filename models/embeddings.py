@@ -1,47 +1,148 @@
 import os
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_openai import OpenAIEmbeddings
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import time
+import logging
+import threading
 import sys
 
 # Add project root to path to import config
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 from config import config
 
+# Process-wide registry so model weights are loaded once and shared by every
+# session. Loads are serialized by the lock, which also stops two reruns from
+# loading the same model concurrently. Each backend's SDK (and for
+# HuggingFace, torch and sentence-transformers) is imported on first use.
+_embedding_models = {}
+_embedding_metrics = {}
+_registry_lock = threading.Lock()
+# Separate lock, so starting a warm-up never waits for a load in progress
+_warm_up_lock = threading.Lock()
+_warm_up_threads = {}
+
+logger = logging.getLogger(__name__)
+
+def _create_embedding_model(provider):
+    if provider == "huggingface":
+        # Uses local model, no API key needed for this specific one usually,
+        # but good to have for consistency.
+        from langchain_huggingface import HuggingFaceEmbeddings
+        if config.EMBEDDING_NUM_THREADS > 0:
+            import torch
+            torch.set_num_threads(config.EMBEDDING_NUM_THREADS)
+        return HuggingFaceEmbeddings(
+            model_name=config.EMBEDDING_MODEL,
+            model_kwargs={"device": config.EMBEDDING_DEVICE},
+            encode_kwargs={
+                "batch_size": config.EMBEDDING_BATCH_SIZE,
+                "normalize_embeddings": config.EMBEDDING_NORMALIZE,
+            },
+        )
+
+    elif provider == "openai":
+        if not config.OPENAI_API_KEY:
+            raise ValueError("OpenAI API Key is missing in config")
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(
+            api_key=config.OPENAI_API_KEY,
+            model="text-embedding-3-small"
+        )
+
+    elif provider == "google":
+        if not config.GOOGLE_API_KEY:
+            raise ValueError("Google API Key is missing in config")
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(
+            google_api_key=config.GOOGLE_API_KEY,
+            model="models/embedding-001"
+        )
+
+    elif provider == "fake":
+        # Deterministic hash-seeded vectors for benchmarks and offline runs;
+        # same dimension as all-MiniLM-L6-v2
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        return DeterministicFakeEmbedding(size=384)
+    else:
+        # Fallback to huggingface
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
 def get_embedding_model(provider="huggingface"):
     """
-    Get the embedding model based on the provider.
-    
+    Get the embedding model based on the provider. Models are created once per
+    process and reused on later calls.
+
     Args:
-        provider (str): 'huggingface', 'openai', or 'google'
-        
+        provider (str): 'huggingface', 'openai', 'google', or 'fake' (offline benchmarks)
+
     Returns:
         Embeddings: The LangChain embeddings model
     """
+    model = _embedding_models.get(provider)
+    if model is not None:
+        return model
+
     try:
-        if provider == "huggingface":
-            # Uses local model, no API key needed for this specific one usually, 
-            # but good to have for consistency.
-            return HuggingFaceEmbeddings(model_name=config.EMBEDDING_MODEL)
-            
-        elif provider == "openai":
-            if not config.OPENAI_API_KEY:
-                raise ValueError("OpenAI API Key is missing in config")
-            return OpenAIEmbeddings(
-                api_key=config.OPENAI_API_KEY,
-                model="text-embedding-3-small"
-            )
-            
-        elif provider == "google":
-            if not config.GOOGLE_API_KEY:
-                raise ValueError("Google API Key is missing in config")
-            return GoogleGenerativeAIEmbeddings(
-                google_api_key=config.GOOGLE_API_KEY,
-                model="models/embedding-001"
-            )          
-        else:
-            # Fallback to huggingface
-            return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-            
+        with _registry_lock:
+            model = _embedding_models.get(provider)
+            if model is None:
+                start = time.perf_counter()
+                model = _create_embedding_model(provider)
+                _embedding_models[provider] = model
+                _embedding_metrics[provider] = {
+                    "model": getattr(model, "model_name", None) or getattr(model, "model", None),
+                    "load_seconds": time.perf_counter() - start,
+                    "loaded_at": time.time(),
+                    "warmup_seconds": None,
+                }
+            return model
+
     except Exception as e:
         raise RuntimeError(f"Failed to initialize embedding model: {str(e)}")
+
+def warm_up_embedding_model(provider="huggingface"):
+    """
+    Load the embedding model and run one query through it so the first real
+    ingest doesn't pay the cold-start cost. Safe to call on every rerun.
+    """
+    model = get_embedding_model(provider)
+    metrics = _embedding_metrics[provider]
+    if metrics["warmup_seconds"] is None:
+        start = time.perf_counter()
+        model.embed_query("warm up")
+        metrics["warmup_seconds"] = time.perf_counter() - start
+    return model
+
+def start_background_warm_up(provider="huggingface"):
+    """
+    Warm up the embedding model on a daemon thread, so process startup isn't
+    blocked by importing the ML stack and loading weights. Only the first call
+    per provider starts a thread; failures are logged and the model is loaded
+    again on first use.
+    """
+    def warm_up():
+        try:
+            warm_up_embedding_model(provider)
+        except Exception as e:
+            logger.warning("Embedding model warm-up failed: %s", e)
+
+    with _warm_up_lock:
+        thread = _warm_up_threads.get(provider)
+        if thread is None:
+            thread = threading.Thread(target=warm_up, name=f"embedding-warm-up-{provider}", daemon=True)
+            _warm_up_threads[provider] = thread
+            thread.start()
+    return thread
+
+def get_embedding_metrics():
+    """
+    Return load and warm-up timings for every embedding model loaded in this process.
+    """
+    return {provider: dict(metrics) for provider, metrics in _embedding_metrics.items()}
+
+def clear_embedding_models():
+    """
+    Drop all loaded embedding models, e.g. after changing embedding settings.
+    """
+    with _registry_lock:
+        _embedding_models.clear()
+        _embedding_metrics.clear()
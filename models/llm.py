@@ -1,56 +1,150 @@
 import os
 import sys
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+import hashlib
+import threading
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 from config import config
 
-def get_llm(provider="groq", model_name=None, openai_api_key=None):
+# Clients are pooled per (provider, model, API-key fingerprint) and shared by
+# every session in the process, so steady-state turns reuse warm HTTP
+# connections instead of repeating TLS handshakes on every rerun.
+#
+# Provider SDKs are imported inside _create_llm, so startup only pays for the
+# provider that is actually selected (langchain_openai alone takes over a
+# second to import).
+_llm_pool = {}
+_http_clients = {}
+_pool_lock = threading.Lock()
+
+DEFAULT_MODELS = {
+    "groq": "llama-3.3-70b-versatile",
+    "openai": "gpt-4o-mini",
+    "google": "gemini-2.5-flash",
+}
+
+def _key_fingerprint(api_key: str) -> str:
+    # Never keep raw keys in pool keys
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+def _get_http_clients(provider):
+    """Return the shared keep-alive (sync, async) httpx clients for a provider"""
+    clients = _http_clients.get(provider)
+    if clients is None:
+        import httpx
+        limits = httpx.Limits(
+            max_connections=config.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=config.LLM_MAX_CONNECTIONS,
+            keepalive_expiry=config.LLM_KEEPALIVE_SECONDS,
+        )
+        timeout = httpx.Timeout(config.LLM_TIMEOUT_SECONDS)
+        clients = (
+            httpx.Client(limits=limits, timeout=timeout),
+            httpx.AsyncClient(limits=limits, timeout=timeout),
+        )
+        _http_clients[provider] = clients
+    return clients
+
+def _create_llm(provider, model_name, api_key, max_retries):
+    if provider == "groq":
+        from langchain_groq import ChatGroq
+        http_client, http_async_client = _get_http_clients(provider)
+        return ChatGroq(
+            api_key=api_key,
+            model=model_name,
+            timeout=config.LLM_TIMEOUT_SECONDS,
+            max_retries=max_retries,
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+
+    elif provider == "openai":
+        from langchain_openai import ChatOpenAI
+        http_client, http_async_client = _get_http_clients(provider)
+        return ChatOpenAI(
+            api_key=api_key,
+            model=model_name,
+            timeout=config.LLM_TIMEOUT_SECONDS,
+            max_retries=max_retries,
+            http_client=http_client,
+            http_async_client=http_async_client,
+            stream_usage=True,
+        )
+
+    elif provider == "google":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # The Gemini SDK manages its own transport; the pooled client keeps it alive.
+        return ChatGoogleGenerativeAI(
+            google_api_key=api_key,
+            model=model_name,
+            timeout=config.LLM_TIMEOUT_SECONDS,
+            max_retries=max_retries,
+        )
+
+    else:
+        raise ValueError(f"Unsupported provider: {provider}")
+
+def get_llm(provider="groq", model_name=None, openai_api_key=None, max_retries=None):
     """
-    Initialize and return the chat model based on provider.
-    
+    Initialize and return the chat model based on provider. Models are pooled,
+    so repeated calls with the same provider, model and key return the same client.
+
     Args:
         provider (str): 'groq', 'openai', or 'google'
         model_name (str): Optional specific model name
         openai_api_key (str): Optional API key for OpenAI
-        
+        max_retries (int): SDK retries, defaults to config.LLM_MAX_RETRIES; 0
+            for clients behind the rate-limit scheduler, which retries itself
+
     Returns:
         BaseChatModel: The LangChain chat model
     """
     try:
         if provider == "groq":
-            if not config.GROQ_API_KEY:
+            api_key = config.GROQ_API_KEY
+            if not api_key:
                 raise ValueError("Groq API Key is missing")
-            return ChatGroq(
-                api_key=config.GROQ_API_KEY,
-                model=model_name or "llama-3.3-70b-versatile"
-            )
-            
+
         elif provider == "openai":
             api_key = openai_api_key or config.OPENAI_API_KEY
             if not api_key:
                 raise ValueError("OpenAI API Key is missing")
-            return ChatOpenAI(
-                api_key=api_key,
-                model=model_name or "gpt-4o-mini"
-            )
-            
+
         elif provider == "google":
-            if not config.GOOGLE_API_KEY:
+            api_key = config.GOOGLE_API_KEY
+            if not api_key:
                 raise ValueError("Google API Key is missing")
-            return ChatGoogleGenerativeAI(
-                google_api_key=config.GOOGLE_API_KEY,
-                model=model_name or "gemini-2.5-flash"
-            )
-            
+
         else:
             raise ValueError(f"Unsupported provider: {provider}")
 
+        model_name = model_name or DEFAULT_MODELS[provider]
+        max_retries = config.LLM_MAX_RETRIES if max_retries is None else max_retries
+        pool_key = (provider, model_name, _key_fingerprint(api_key), max_retries)
+        llm = _llm_pool.get(pool_key)
+        if llm is None:
+            with _pool_lock:
+                llm = _llm_pool.get(pool_key)
+                if llm is None:
+                    llm = _create_llm(provider, model_name, api_key, max_retries)
+                    _llm_pool[pool_key] = llm
+        return llm
+
     except Exception as e:
         raise RuntimeError(f"Failed to initialize {provider} model: {str(e)}")
 
+def clear_llm_pool():
+    """
+    Drop all pooled chat models and close their HTTP connections.
+    """
+    with _pool_lock:
+        _llm_pool.clear()
+        for http_client, _ in _http_clients.values():
+            http_client.close()
+        # Async clients are left to the garbage collector; closing them needs
+        # the event loop they were used on.
+        _http_clients.clear()
+
 # Keep for backward compatibility if needed, but redirect to new function
 def get_chatgroq_model():
-    return get_llm("groq")
\ No newline at end of file
+    return get_llm("groq")
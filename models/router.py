@@ -0,0 +1,487 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from typing import Dict, List
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+from models.llm import DEFAULT_MODELS
+from models.scheduler import get_scheduled_llm, is_rate_limit_error, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class AllProvidersFailed(RuntimeError):
+    """Raised when no provider could answer; errors holds (provider, exception) pairs"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        details = "; ".join(f"{name}: {error}" for name, error in errors) or "no provider available"
+        super().__init__(f"All providers failed ({details})")
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    Opens after failure_threshold consecutive failures, or at once on a rate
+    limit (for the provider's Retry-After when it sends one). After
+    reset_seconds one trial call is let through (half-open); its success
+    closes the breaker and its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+
+    def available(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() >= self._open_until
+        return not self._trial_in_flight
+
+    def on_attempt(self):
+        if self.state == OPEN and time.monotonic() >= self._open_until:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def abandon(self):
+        """An attempt ended without an outcome (cancelled or closed early)"""
+        if self.state == HALF_OPEN:
+            self._trial_in_flight = False
+
+    def record_failure(self, rate_limited=False, retry_after=None):
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == HALF_OPEN or rate_limited or self.consecutive_failures >= self.failure_threshold:
+            self.state = OPEN
+            self._open_until = time.monotonic() + (retry_after or self.reset_seconds)
+
+class ProviderHealth:
+    """
+    Rolling latency and error rate of one provider plus its circuit breaker.
+    Shared by every router in the process, so all sessions learn together.
+    """
+
+    def __init__(self, name: str, window_size: int, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.latencies = deque(maxlen=window_size)
+        self.outcomes = deque(maxlen=window_size)
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.rate_limited = 0
+        self.last_failure_at = None
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        with self._lock:
+            return self.breaker.available()
+
+    def on_attempt(self):
+        with self._lock:
+            self.breaker.on_attempt()
+
+    def abandon(self):
+        """Release a half-open trial whose call was cancelled, so it can be retried"""
+        with self._lock:
+            self.breaker.abandon()
+
+    def record_success(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.outcomes.append(True)
+            self.breaker.record_success()
+
+    def record_failure(self, error: Exception):
+        rate_limited = is_rate_limit_error(error)
+        with self._lock:
+            self.outcomes.append(False)
+            self.last_failure_at = time.monotonic()
+            if rate_limited:
+                self.rate_limited += 1
+            self.breaker.record_failure(rate_limited, retry_after_seconds(error) if rate_limited else None)
+        logger.warning("Provider %s failed%s: %s", self.name, " (rate limited)" if rate_limited else "", error)
+
+    def latency(self, fraction: float, min_samples=1):
+        """Latency percentile in seconds, or None with fewer than min_samples calls"""
+        with self._lock:
+            values = sorted(self.latencies)
+        if len(values) < max(1, min_samples):
+            return None
+        return _percentile(values, fraction)
+
+    def degraded(self, max_error_rate: float) -> bool:
+        """
+        True while the error rate is above max_error_rate and the last failure
+        is recent, so a provider that stopped being called can recover.
+        """
+        with self._lock:
+            recent = self.last_failure_at is not None and time.monotonic() - self.last_failure_at < self.breaker.reset_seconds
+        return recent and self.error_rate() > max_error_rate
+
+    def error_rate(self) -> float:
+        with self._lock:
+            outcomes = list(self.outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def snapshot(self) -> dict:
+        p50 = self.latency(0.50)
+        p95 = self.latency(0.95)
+        return {
+            "state": self.breaker.state,
+            "calls": len(self.outcomes),
+            "p50_ms": p50 * 1000 if p50 is not None else None,
+            "p95_ms": p95 * 1000 if p95 is not None else None,
+            "error_rate": self.error_rate(),
+            "rate_limited": self.rate_limited,
+        }
+
+_provider_health = {}
+_provider_health_lock = threading.Lock()
+
+def get_provider_health(name: str) -> ProviderHealth:
+    """
+    Return the process-wide health record for a provider.
+    """
+    with _provider_health_lock:
+        health = _provider_health.get(name)
+        if health is None:
+            health = ProviderHealth(
+                name,
+                window_size=config.ROUTER_WINDOW_SIZE,
+                failure_threshold=config.ROUTER_FAILURE_THRESHOLD,
+                reset_seconds=config.ROUTER_RESET_SECONDS,
+            )
+            _provider_health[name] = health
+        return health
+
+def get_provider_health_snapshot() -> Dict[str, dict]:
+    with _provider_health_lock:
+        providers = dict(_provider_health)
+    return {name: health.snapshot() for name, health in providers.items()}
+
+def reset_provider_health():
+    with _provider_health_lock:
+        _provider_health.clear()
+
+class ProviderRouter:
+    """
+    Routes chat requests across several providers.
+
+    Each request goes to the fastest healthy provider (lowest rolling p50;
+    providers are tried once each, in the given order, before latency
+    history decides). Failed calls fall back
+    to the next provider, rate limits open that provider's circuit breaker so
+    later requests skip it, and with hedge=True a second provider is started
+    once the first has run longer than its p95 latency, taking whichever
+    answers first.
+
+    Exposes invoke, ainvoke, stream and astream like a LangChain chat model,
+    so it can be passed anywhere a chat model is used. last_provider is the
+    provider that produced the most recent answer.
+
+    Args:
+        models (dict): Provider name -> chat model, in order of preference
+        hedge (bool): Race a second provider on slow requests, defaults to config.ROUTER_HEDGE
+    """
+
+    def __init__(self, models: Dict[str, object], hedge=None):
+        if not models:
+            raise ValueError("ProviderRouter needs at least one model")
+        self.models = dict(models)
+        self.hedge = config.ROUTER_HEDGE if hedge is None else hedge
+        self.last_provider = None
+
+    def candidates(self) -> List[str]:
+        """
+        Return providers whose breaker allows a call, fastest first. Providers
+        without latency history rank first so each gets measured, and those
+        recently above ROUTER_MAX_ERROR_RATE go last.
+        """
+        ranked = []
+        for index, name in enumerate(self.models):
+            health = get_provider_health(name)
+            if not health.available():
+                continue
+            p50 = health.latency(0.50)
+            ranked.append(((health.degraded(config.ROUTER_MAX_ERROR_RATE), p50 or 0.0, index), name))
+        return [name for _, name in sorted(ranked)]
+
+    def _hedge_delay(self, name: str) -> float:
+        p95 = get_provider_health(name).latency(0.95, min_samples=config.ROUTER_MIN_SAMPLES)
+        delay = p95 if p95 is not None else config.ROUTER_HEDGE_DELAY_SECONDS
+        return max(config.ROUTER_HEDGE_MIN_DELAY_SECONDS, delay)
+
+    async def _attempt(self, name, messages):
+        health = get_provider_health(name)
+        health.on_attempt()
+        start = time.perf_counter()
+        try:
+            response = await self.models[name].ainvoke(messages)
+        except Exception as e:
+            health.record_failure(e)
+            raise
+        except BaseException:
+            # Cancelled as the losing side of a hedge
+            health.abandon()
+            raise
+        health.record_success(time.perf_counter() - start)
+        return response
+
+    async def ainvoke(self, messages):
+        candidates = self.candidates()
+        errors = []
+        pending = {}
+        launched = 0
+        hedged = False
+
+        def launch():
+            nonlocal launched
+            name = candidates[launched]
+            launched += 1
+            pending[asyncio.ensure_future(self._attempt(name, messages))] = name
+
+        if not candidates:
+            raise AllProvidersFailed(errors)
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and len(pending) == 1 and launched < len(candidates):
+                    timeout = self._hedge_delay(next(iter(pending.values())))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The first provider is slower than usual; race the next one
+                    hedged = True
+                    launch()
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        self.last_provider = name
+                        return task.result()
+                    errors.append((name, task.exception()))
+                if not pending and launched < len(candidates):
+                    launch()
+            raise AllProvidersFailed(errors)
+        finally:
+            # Cancelled losers are not counted against their provider
+            for task in pending:
+                task.cancel()
+
+    def _attempt_sync(self, name, messages):
+        health = get_provider_health(name)
+        health.on_attempt()
+        start = time.perf_counter()
+        try:
+            response = self.models[name].invoke(messages)
+        except Exception as e:
+            health.record_failure(e)
+            raise
+        health.record_success(time.perf_counter() - start)
+        return response
+
+    def invoke(self, messages):
+        """
+        Synchronous counterpart of ainvoke. Uses each model's own invoke, so
+        the pooled async HTTP clients are never driven from a throwaway event
+        loop; hedged attempts run on threads.
+        """
+        candidates = self.candidates()
+        errors = []
+        if not candidates:
+            raise AllProvidersFailed(errors)
+        if not self.hedge:
+            for name in candidates:
+                try:
+                    response = self._attempt_sync(name, messages)
+                except Exception as e:
+                    errors.append((name, e))
+                    continue
+                self.last_provider = name
+                return response
+            raise AllProvidersFailed(errors)
+
+        executor = ThreadPoolExecutor(max_workers=len(candidates))
+        pending = {}
+        launched = 0
+        hedged = False
+
+        def launch():
+            nonlocal launched
+            name = candidates[launched]
+            launched += 1
+            # Threads don't inherit context variables (the scheduler's session)
+            context = contextvars.copy_context()
+            pending[executor.submit(context.run, self._attempt_sync, name, messages)] = name
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if not hedged and len(pending) == 1 and launched < len(candidates):
+                    timeout = self._hedge_delay(next(iter(pending.values())))
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+                for future in done:
+                    name = pending.pop(future)
+                    if future.exception() is None:
+                        self.last_provider = name
+                        return future.result()
+                    errors.append((name, future.exception()))
+                if not pending and launched < len(candidates):
+                    launch()
+            raise AllProvidersFailed(errors)
+        finally:
+            # A thread can't be cancelled; a losing call finishes in the background
+            executor.shutdown(wait=False)
+
+    def stream(self, messages):
+        """
+        Stream from the fastest healthy provider. Falls back to the next
+        provider only if one fails before its first chunk; hedging does not
+        apply to streams.
+        """
+        errors = []
+        for name in self.candidates():
+            health = get_provider_health(name)
+            health.on_attempt()
+            start = time.perf_counter()
+            started = False
+            try:
+                for chunk in self.models[name].stream(messages):
+                    if not started:
+                        started = True
+                        self.last_provider = name
+                    yield chunk
+            except Exception as e:
+                health.record_failure(e)
+                if started:
+                    raise
+                errors.append((name, e))
+                continue
+            except BaseException:
+                # The consumer stopped reading (closed the generator or disconnected)
+                health.abandon()
+                raise
+            health.record_success(time.perf_counter() - start)
+            return
+        raise AllProvidersFailed(errors)
+
+    async def astream(self, messages):
+        errors = []
+        for name in self.candidates():
+            health = get_provider_health(name)
+            health.on_attempt()
+            start = time.perf_counter()
+            started = False
+            try:
+                async for chunk in self.models[name].astream(messages):
+                    if not started:
+                        started = True
+                        self.last_provider = name
+                    yield chunk
+            except Exception as e:
+                health.record_failure(e)
+                if started:
+                    raise
+                errors.append((name, e))
+                continue
+            except BaseException:
+                # The consumer stopped reading (closed the generator or disconnected)
+                health.abandon()
+                raise
+            health.record_success(time.perf_counter() - start)
+            return
+        raise AllProvidersFailed(errors)
+
+def get_provider_router(preferred="groq", openai_api_key=None, hedge=None, fallbacks=None) -> ProviderRouter:
+    """
+    Build a router over the preferred provider and the fallback providers
+    that have an API key, preferred first. Fallbacks default to
+    config.ROUTER_FALLBACK_PROVIDERS, so a session never silently moves to a
+    paid provider it didn't opt into. Routers are cheap; provider health,
+    rate-limit schedulers and the underlying clients are shared process-wide.
+
+    With a fallback available, rate-limited providers fail over at once
+    instead of retrying and queueing in their scheduler.
+    """
+    fallbacks = config.ROUTER_FALLBACK_PROVIDERS if fallbacks is None else fallbacks
+    models = {}
+    for provider in [preferred] + [name for name in DEFAULT_MODELS if name != preferred and name in fallbacks]:
+        try:
+            models[provider] = get_scheduled_llm(provider, openai_api_key=openai_api_key, fail_fast=True)
+        except Exception as e:
+            if provider == preferred:
+                raise
+            logger.info("Provider %s not available for routing: %s", provider, e)
+    if len(models) == 1:
+        # Nothing to fall back to, so waiting out the rate limit is the best option
+        models[preferred] = get_scheduled_llm(preferred, openai_api_key=openai_api_key)
+    return ProviderRouter(models, hedge=hedge)
+
+class StubChatModel:
+    """
+    Local stand-in chat model for exercising the router without network access.
+
+    Args:
+        response (str): Text of every answer
+        latency (float): Seconds each call takes
+        error (Exception): If given, raised by every call instead of answering
+    """
+
+    def __init__(self, response="ok", latency=0.0, error=None):
+        self.response = response
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+
+    def _answer(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return AIMessage(content=self.response)
+
+    def invoke(self, messages):
+        time.sleep(self.latency)
+        return self._answer()
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.latency)
+        return self._answer()
+
+    def _chunks(self, message):
+        for i, word in enumerate(message.content.split(" ")):
+            yield AIMessageChunk(content=(" " if i else "") + word)
+
+    def stream(self, messages):
+        yield from self._chunks(self.invoke(messages))
+
+    async def astream(self, messages):
+        for chunk in self._chunks(await self.ainvoke(messages)):
+            yield chunk
@@ -0,0 +1,598 @@
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import logging
+import itertools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+from models.llm import get_llm
+from utils.token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Lower numbers are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# "429" as a status code, not as digits inside a token count like 14290
+RATE_LIMIT_MESSAGE = re.compile(r"\b429\b|rate limit")
+
+# Rough per-message framing overhead in chat prompts
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_request_context = contextvars.ContextVar("scheduler_request_context", default=(None, PRIORITY_INTERACTIVE))
+
+class RateLimitExceeded(RuntimeError):
+    """A provider rejected a call for exceeding its rate limit (HTTP 429)"""
+
+    status_code = 429
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class SchedulerTimeout(RuntimeError):
+    """Raised when a call waited longer than RATE_LIMIT_MAX_WAIT_SECONDS for quota"""
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Return True if a provider error is a rate limit (HTTP 429 or an SDK
+    RateLimitError / ResourceExhausted).
+    """
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    name = type(error).__name__
+    if "RateLimit" in name or "ResourceExhausted" in name:
+        return True
+    return RATE_LIMIT_MESSAGE.search(str(error).lower()) is not None
+
+def retry_after_seconds(error: Exception):
+    """Seconds the provider asked us to wait (Retry-After), if it said"""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def _message_text(message) -> str:
+    content = getattr(message, "content", message)
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+def estimate_request_tokens(messages, output_tokens=None) -> int:
+    """
+    Estimate the tokens a chat call will count against a TPM quota: the
+    prompt plus the expected completion (config.RATE_LIMIT_OUTPUT_TOKENS).
+    """
+    output_tokens = config.RATE_LIMIT_OUTPUT_TOKENS if output_tokens is None else output_tokens
+    prompt = sum(count_tokens(_message_text(message)) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+    return prompt + output_tokens
+
+def _usage_tokens(message):
+    usage = getattr(message, "usage_metadata", None)
+    if usage and usage.get("total_tokens"):
+        return usage["total_tokens"]
+    return None
+
+@contextmanager
+def request_context(session_id=None, priority=PRIORITY_INTERACTIVE):
+    """
+    Attribute the scheduled calls made inside this block to a session and
+    priority, for fair sharing across sessions.
+    """
+    token = _request_context.set((session_id, priority))
+    try:
+        yield
+    finally:
+        _request_context.reset(token)
+
+class TokenBucket:
+    """
+    Token bucket holding up to capacity units, refilled continuously at
+    capacity per period_seconds. The level may go negative when a call turns
+    out to cost more than estimated; later calls then wait for the debt.
+    """
+
+    def __init__(self, capacity: float, period_seconds: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period_seconds
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float, scale: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate * scale)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float, scale: float = 1.0) -> float:
+        """Seconds until amount units are available at scale times the refill rate"""
+        self._refill(now, scale)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.rate * scale)
+
+    def consume(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """Return (positive) or charge (negative) units after the fact"""
+        self.level = min(self.capacity, self.level + amount)
+
+    def drain(self):
+        self.level = min(self.level, 0.0)
+
+class _Waiter:
+    def __init__(self, session_id, priority, cost, start_tag, seq, loop=None):
+        self.session_id = session_id
+        self.priority = priority
+        self.cost = cost
+        self.start_tag = start_tag
+        self.seq = seq
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else None
+
+    def order(self):
+        return (self.priority, self.start_tag, self.seq)
+
+class ProviderScheduler:
+    """
+    Admits calls to one provider within its requests-per-minute and
+    tokens-per-minute quotas.
+
+    Each call reserves one request and its estimated tokens from token
+    buckets before it is sent; the token estimate is corrected with the
+    provider's reported usage afterwards. Waiting calls are served by priority,
+    then by start-time fair queueing across sessions: a session's tag advances
+    by the tokens it uses, so one busy session cannot starve the others.
+
+    A rate-limit response pauses the provider for its Retry-After (or an
+    exponential backoff with jitter) and halves the refill rate; each success
+    then restores it by RATE_LIMIT_RECOVERY_STEP, so throughput settles just
+    under the real ceiling when the configured quotas are too generous.
+
+    Args:
+        name (str): Provider name
+        rpm (int): Requests per period, 0 for no limit
+        tpm (int): Tokens per period, 0 for no limit
+        period_seconds (float): Quota window, 60 for per-minute quotas
+    """
+
+    MIN_RATE_SCALE = 0.1
+
+    def __init__(self, name: str, rpm: int, tpm: int, period_seconds: float = 60.0, max_retries=None,
+                 backoff_seconds=None, max_backoff_seconds=None, max_wait_seconds=None):
+        self.name = name
+        self.requests = TokenBucket(rpm, period_seconds) if rpm else None
+        self.tokens = TokenBucket(tpm, period_seconds) if tpm else None
+        self.max_retries = config.RATE_LIMIT_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = config.RATE_LIMIT_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.max_backoff_seconds = config.RATE_LIMIT_MAX_BACKOFF_SECONDS if max_backoff_seconds is None else max_backoff_seconds
+        self.max_wait_seconds = config.RATE_LIMIT_MAX_WAIT_SECONDS if max_wait_seconds is None else max_wait_seconds
+        self.rate_scale = 1.0
+        self.granted = 0
+        self.rate_limited = 0
+        self.timed_out = 0
+        self.tokens_granted = 0
+        self.wait_seconds = deque(maxlen=config.METRICS_WINDOW_SIZE)
+        self._backoff = 0.0
+        self._paused_until = 0.0
+        self._waiters = []
+        self._virtual_time = 0.0
+        self._session_finish = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _enqueue(self, cost, session_id, priority, loop=None) -> _Waiter:
+        # Start-time fair queueing: a session's next call starts where its
+        # previous one finished, or at the current virtual time if it was idle
+        start_tag = max(self._virtual_time, self._session_finish.get(session_id, 0.0))
+        self._session_finish[session_id] = start_tag + cost
+        waiter = _Waiter(session_id, priority, cost, start_tag, next(self._seq), loop)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _wake_all(self):
+        self._changed.notify_all()
+        for waiter in self._waiters:
+            if waiter.loop is not None:
+                waiter.loop.call_soon_threadsafe(waiter.event.set)
+
+    def _discard(self, waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            self._wake_all()
+
+    def _poll(self, waiter, now: float) -> float:
+        """Grant waiter if it is next in line and quota allows; else return seconds to wait"""
+        if min(self._waiters, key=_Waiter.order) is not waiter:
+            return float("inf")
+        wait = max(0.0, self._paused_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now, self.rate_scale))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(waiter.cost, now, self.rate_scale))
+        if wait > 0:
+            return wait
+
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None:
+            self.tokens.consume(waiter.cost)
+        self._waiters.remove(waiter)
+        self._virtual_time = waiter.start_tag
+        self.granted += 1
+        self.tokens_granted += waiter.cost
+        if len(self._session_finish) > 1024:
+            # Idle sessions would restart at the virtual time anyway
+            self._session_finish = {session: tag for session, tag in self._session_finish.items()
+                                    if tag > self._virtual_time}
+        self._wake_all()
+        return 0.0
+
+    def _check_timeout(self, waiter, started: float, max_wait_seconds: float):
+        if time.monotonic() - started > max_wait_seconds:
+            self._discard(waiter)
+            self.timed_out += 1
+            raise SchedulerTimeout(
+                f"Waited over {max_wait_seconds:.1f}s for {self.name} rate limit capacity"
+            )
+
+    def acquire(self, cost: int, session_id=None, priority=PRIORITY_INTERACTIVE, max_wait_seconds=None) -> float:
+        """
+        Block until the call may be sent, for at most max_wait_seconds
+        (default: the scheduler's RATE_LIMIT_MAX_WAIT_SECONDS).
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        max_wait_seconds = self.max_wait_seconds if max_wait_seconds is None else max_wait_seconds
+        started = time.monotonic()
+        with self._changed:
+            waiter = self._enqueue(cost, session_id, priority)
+            try:
+                while True:
+                    wait = self._poll(waiter, time.monotonic())
+                    if wait == 0:
+                        break
+                    self._check_timeout(waiter, started, max_wait_seconds)
+                    # Re-check at least every second in case quota was refunded
+                    self._changed.wait(timeout=min(wait, 1.0))
+            except BaseException:
+                self._discard(waiter)
+                raise
+            waited = time.monotonic() - started
+            self.wait_seconds.append(waited)
+            return waited
+
+    async def aacquire(self, cost: int, session_id=None, priority=PRIORITY_INTERACTIVE, max_wait_seconds=None) -> float:
+        """Async acquire: waits without blocking the event loop"""
+        max_wait_seconds = self.max_wait_seconds if max_wait_seconds is None else max_wait_seconds
+        started = time.monotonic()
+        with self._lock:
+            waiter = self._enqueue(cost, session_id, priority, asyncio.get_running_loop())
+        try:
+            while True:
+                with self._lock:
+                    waiter.event.clear()
+                    wait = self._poll(waiter, time.monotonic())
+                    if wait == 0:
+                        break
+                    self._check_timeout(waiter, started, max_wait_seconds)
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout=min(wait, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._lock:
+                self._discard(waiter)
+            raise
+        waited = time.monotonic() - started
+        with self._lock:
+            self.wait_seconds.append(waited)
+        return waited
+
+    def on_success(self, estimated_tokens: int, actual_tokens=None):
+        """Record a completed call and correct the token reservation with actual usage"""
+        with self._lock:
+            self._backoff = 0.0
+            self.rate_scale = min(1.0, self.rate_scale + config.RATE_LIMIT_RECOVERY_STEP)
+            if self.tokens is not None and actual_tokens is not None:
+                self.tokens.adjust(estimated_tokens - actual_tokens)
+            self._wake_all()
+
+    def release(self, estimated_tokens: int, used_tokens: int):
+        """Settle the token reservation of a call that failed or was cut short"""
+        with self._lock:
+            if self.tokens is not None:
+                self.tokens.adjust(estimated_tokens - used_tokens)
+            self._wake_all()
+
+    def on_rate_limited(self, retry_after=None) -> float:
+        """
+        Back off after a 429: pause the provider, drain its buckets and halve
+        the refill rate.
+
+        Returns:
+            float: Seconds the provider is paused for
+        """
+        with self._lock:
+            self.rate_limited += 1
+            self._backoff = min(self.max_backoff_seconds, self._backoff * 2 if self._backoff else self.backoff_seconds)
+            delay = retry_after if retry_after is not None else self._backoff * random.uniform(0.5, 1.0)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.rate_scale = max(self.MIN_RATE_SCALE, self.rate_scale / 2)
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.drain()
+        logger.warning("Provider %s rate limited; pausing %.1fs at %.0f%% of configured rate",
+                       self.name, delay, self.rate_scale * 100)
+        return delay
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self.wait_seconds)
+            return {
+                "queued": len(self._waiters),
+                "granted": self.granted,
+                "rate_limited": self.rate_limited,
+                "timed_out": self.timed_out,
+                "rate_scale": round(self.rate_scale, 2),
+                "paused_s": round(max(0.0, self._paused_until - time.monotonic()), 1),
+                "wait_p50_ms": waits[len(waits) // 2] * 1000 if waits else None,
+                "wait_max_ms": waits[-1] * 1000 if waits else None,
+            }
+
+class ScheduledChatModel:
+    """
+    Chat model wrapper that sends every call through a ProviderScheduler and
+    retries rate-limited calls after the scheduler's backoff, instead of
+    returning the 429 to the user. Streams are only retried before their
+    first chunk. Calls that fail, are cancelled or whose stream is closed
+    early settle their token reservation, so they don't hold TPM budget.
+
+    The session and priority of each call come from request_context().
+    Other attributes are read from the wrapped model.
+
+    Args:
+        model: The chat model to wrap
+        scheduler (ProviderScheduler): The provider's scheduler
+        max_retries (int): Rate-limit retries, defaults to the scheduler's
+        max_wait_seconds (float): Longest quota wait, defaults to the scheduler's
+    """
+
+    def __init__(self, model, scheduler: ProviderScheduler, max_retries=None, max_wait_seconds=None):
+        self.model = model
+        self.scheduler = scheduler
+        self.max_retries = scheduler.max_retries if max_retries is None else max_retries
+        self.max_wait_seconds = max_wait_seconds
+        self.last_wait_seconds = 0.0
+
+    def __getattr__(self, name):
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _should_retry(self, error, attempt, cost) -> bool:
+        """Settle a call that failed before any output; True if it should be retried"""
+        if not is_rate_limit_error(error):
+            # Rejected or failed before generating: give the reservation back
+            self.scheduler.release(cost, 0)
+            return False
+        # The pause drains the buckets, so there is nothing to give back
+        self.scheduler.on_rate_limited(retry_after_seconds(error))
+        return attempt < self.max_retries
+
+    def invoke(self, messages):
+        session_id, priority = _request_context.get()
+        cost = estimate_request_tokens(messages)
+        prompt_tokens = cost - config.RATE_LIMIT_OUTPUT_TOKENS
+        self.last_wait_seconds = 0.0
+        for attempt in itertools.count():
+            self.last_wait_seconds += self.scheduler.acquire(cost, session_id, priority, self.max_wait_seconds)
+            try:
+                response = self.model.invoke(messages)
+            except Exception as e:
+                if self._should_retry(e, attempt, cost):
+                    continue
+                raise
+            except BaseException:
+                # Interrupted mid-call: the prompt was sent, the completion is unknown
+                self.scheduler.release(cost, prompt_tokens)
+                raise
+            self.scheduler.on_success(cost, _usage_tokens(response))
+            return response
+
+    async def ainvoke(self, messages):
+        session_id, priority = _request_context.get()
+        cost = estimate_request_tokens(messages)
+        prompt_tokens = cost - config.RATE_LIMIT_OUTPUT_TOKENS
+        self.last_wait_seconds = 0.0
+        for attempt in itertools.count():
+            self.last_wait_seconds += await self.scheduler.aacquire(cost, session_id, priority, self.max_wait_seconds)
+            try:
+                response = await self.model.ainvoke(messages)
+            except Exception as e:
+                if self._should_retry(e, attempt, cost):
+                    continue
+                raise
+            except BaseException:
+                # Cancelled mid-call, e.g. the losing side of a hedge
+                self.scheduler.release(cost, prompt_tokens)
+                raise
+            self.scheduler.on_success(cost, _usage_tokens(response))
+            return response
+
+    def stream(self, messages):
+        session_id, priority = _request_context.get()
+        cost = estimate_request_tokens(messages)
+        prompt_tokens = cost - config.RATE_LIMIT_OUTPUT_TOKENS
+        self.last_wait_seconds = 0.0
+        for attempt in itertools.count():
+            self.last_wait_seconds += self.scheduler.acquire(cost, session_id, priority, self.max_wait_seconds)
+            started = False
+            usage = None
+            try:
+                for chunk in self.model.stream(messages):
+                    started = True
+                    usage = _usage_tokens(chunk) or usage
+                    yield chunk
+            except Exception as e:
+                if not started and self._should_retry(e, attempt, cost):
+                    continue
+                if started:
+                    self.scheduler.release(cost, usage or prompt_tokens)
+                raise
+            except BaseException:
+                # The consumer closed the stream early
+                self.scheduler.release(cost, usage or prompt_tokens)
+                raise
+            self.scheduler.on_success(cost, usage)
+            return
+
+    async def astream(self, messages):
+        session_id, priority = _request_context.get()
+        cost = estimate_request_tokens(messages)
+        prompt_tokens = cost - config.RATE_LIMIT_OUTPUT_TOKENS
+        self.last_wait_seconds = 0.0
+        for attempt in itertools.count():
+            self.last_wait_seconds += await self.scheduler.aacquire(cost, session_id, priority, self.max_wait_seconds)
+            started = False
+            usage = None
+            try:
+                async for chunk in self.model.astream(messages):
+                    started = True
+                    usage = _usage_tokens(chunk) or usage
+                    yield chunk
+            except Exception as e:
+                if not started and self._should_retry(e, attempt, cost):
+                    continue
+                if started:
+                    self.scheduler.release(cost, usage or prompt_tokens)
+                raise
+            except BaseException:
+                # The consumer closed the stream early or the task was cancelled
+                self.scheduler.release(cost, usage or prompt_tokens)
+                raise
+            self.scheduler.on_success(cost, usage)
+            return
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(provider: str) -> ProviderScheduler:
+    """
+    Return the process-wide scheduler for a provider, with quotas from
+    config.RATE_LIMITS.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(provider)
+        if scheduler is None:
+            limits = config.RATE_LIMITS.get(provider, {})
+            scheduler = ProviderScheduler(provider, rpm=limits.get("rpm", 0), tpm=limits.get("tpm", 0))
+            _schedulers[provider] = scheduler
+        return scheduler
+
+def get_scheduler_snapshot() -> Dict[str, dict]:
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {name: scheduler.snapshot() for name, scheduler in schedulers.items()}
+
+def reset_schedulers():
+    with _schedulers_lock:
+        _schedulers.clear()
+
+def get_scheduled_llm(provider="groq", model_name=None, openai_api_key=None, fail_fast=False):
+    """
+    Return get_llm()'s chat model behind the provider's rate-limit scheduler,
+    or the bare model if config.RATE_LIMIT_ENABLED is off.
+
+    With fail_fast (for models behind a router that can fall back), a 429 is
+    raised at once instead of retried, and quota waits are capped at
+    config.ROUTER_MAX_QUOTA_WAIT_SECONDS.
+    """
+    if not config.RATE_LIMIT_ENABLED:
+        return get_llm(provider, model_name=model_name, openai_api_key=openai_api_key)
+    # SDK retries would resend 429s outside the token buckets
+    llm = get_llm(provider, model_name=model_name, openai_api_key=openai_api_key, max_retries=0)
+    if fail_fast:
+        return ScheduledChatModel(llm, get_scheduler(provider), max_retries=0,
+                                  max_wait_seconds=config.ROUTER_MAX_QUOTA_WAIT_SECONDS)
+    return ScheduledChatModel(llm, get_scheduler(provider))
+
+class RateLimitedStubModel:
+    """
+    Local stand-in provider that enforces RPM/TPM quotas over a sliding
+    window and answers over-quota calls with RateLimitExceeded (a 429 with
+    Retry-After), for exercising the scheduler without network access.
+
+    Args:
+        rpm (int): Requests allowed per window
+        tpm (int): Tokens (prompt plus response) allowed per window
+        window_seconds (float): Quota window; shorten it to speed up tests
+        response (str): Text of every answer
+        latency (float): Seconds each call takes
+    """
+
+    def __init__(self, rpm, tpm, window_seconds=60.0, response="ok", latency=0.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window_seconds = window_seconds
+        self.response = response
+        self.latency = latency
+        self.calls = 0
+        self.rejected = 0
+        self._history = deque()
+        self._lock = threading.Lock()
+
+    def _admit(self, messages):
+        tokens = estimate_request_tokens(messages, output_tokens=count_tokens(self.response))
+        now = time.monotonic()
+        with self._lock:
+            while self._history and now - self._history[0][0] >= self.window_seconds:
+                self._history.popleft()
+            used = sum(cost for _, cost in self._history)
+            if len(self._history) >= self.rpm or (self._history and used + tokens > self.tpm):
+                self.rejected += 1
+                retry_after = self.window_seconds - (now - self._history[0][0])
+                raise RateLimitExceeded(f"Error code: 429 - rate limit reached, retry in {retry_after:.2f}s",
+                                        retry_after=retry_after)
+            self._history.append((now, tokens))
+            self.calls += 1
+        return AIMessage(content=self.response,
+                         usage_metadata={"input_tokens": tokens - count_tokens(self.response),
+                                         "output_tokens": count_tokens(self.response),
+                                         "total_tokens": tokens})
+
+    def invoke(self, messages):
+        response = self._admit(messages)
+        time.sleep(self.latency)
+        return response
+
+    async def ainvoke(self, messages):
+        response = self._admit(messages)
+        await asyncio.sleep(self.latency)
+        return response
+
+    def stream(self, messages):
+        response = self.invoke(messages)
+        yield AIMessageChunk(content=response.content, usage_metadata=response.usage_metadata)
+
+    async def astream(self, messages):
+        response = await self.ainvoke(messages)
+        yield AIMessageChunk(content=response.content, usage_metadata=response.usage_metadata)
@@ -0,0 +1,35 @@
+import os
+import sys
+import pytest
+from starlette.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api import ChatService, create_app, stub_model_factory, validate_chat_request
+
+MESSAGES = [{"role": "user", "content": "What was revenue last quarter?"}]
+
+@pytest.mark.parametrize("fields", [
+    {"document_ids": "abc"},
+    {"document_ids": [1, "a"]},
+    {"provider": ["groq"]},
+    {"stream": "false"},
+    {"session_id": 42},
+])
+def test_invalid_field_types_are_rejected(fields):
+    with pytest.raises(ValueError):
+        validate_chat_request({"messages": MESSAGES, **fields})
+    client = TestClient(create_app(ChatService(model_factory=stub_model_factory(latency=0))))
+    assert client.post("/v1/chat", json={"messages": MESSAGES, **fields}).status_code == 400
+
+def test_valid_request_gets_defaults():
+    request = validate_chat_request({"messages": MESSAGES, "document_ids": ["b", "a"], "stream": True})
+    assert request["document_ids"] == ["a", "b"]
+    assert request["stream"] is True
+    assert request["provider"] == "groq"
+
+def test_background_tasks_are_kept_until_done():
+    service = ChatService(model_factory=stub_model_factory(latency=0))
+    client = TestClient(create_app(service))
+    response = client.post("/v1/chat", json={"messages": MESSAGES})
+    assert response.status_code == 200
+    assert not service._tasks
@@ -0,0 +1,23 @@
+import os
+import sys
+from langchain_core.messages import AIMessageChunk
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.router import StubChatModel
+from utils.chat_utils import stream_chat_response
+
+class BrokenStream:
+    def stream(self, messages):
+        yield AIMessageChunk(content="Revenue grew")
+        raise RuntimeError("connection reset")
+
+def test_stream_reports_errors_after_partial_output():
+    stats = {}
+    text = "".join(stream_chat_response(BrokenStream(), [], "system", stats=stats))
+    assert text.startswith("Revenue grew")
+    assert stats["error"] == "connection reset"
+
+def test_successful_stream_has_no_error():
+    stats = {}
+    assert "".join(stream_chat_response(StubChatModel("all good"), [], "system", stats=stats)) == "all good"
+    assert stats["error"] is None
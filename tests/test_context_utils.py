@@ -0,0 +1,43 @@
+import os
+import sys
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from config import config
+from utils import context_utils
+from utils.context_utils import pack_context, strip_overlap
+from utils.token_utils import count_tokens
+
+FIRST = "The quick brown fox jumps over the lazy dog and keeps running far away."
+SECOND = "lazy dog and keeps running far away. Then it sleeps under a tree."
+
+def test_strip_overlap_removes_shared_chunk_boundaries():
+    assert strip_overlap(SECOND, [FIRST]) == "Then it sleeps under a tree."
+    assert strip_overlap(FIRST, [SECOND]) == "The quick brown fox jumps over the"
+    assert strip_overlap(FIRST, [f"Intro. {FIRST} Outro."]) == ""
+    assert strip_overlap("Short overlap here", ["here we go"], min_chars=20) == "Short overlap here"
+
+def test_pack_context_strips_overlap_and_duplicates():
+    context, stats = pack_context("fox", [FIRST, SECOND, FIRST], token_budget=1000, method="none")
+    assert context == f"{FIRST}\n\nThen it sleeps under a tree."
+    assert stats["packed"] == 2
+    assert stats["overlap_tokens_removed"] > count_tokens(FIRST)
+
+def test_pack_context_never_exceeds_the_unpacked_baseline():
+    passages = [f"Passage {i}: " + "revenue and margin detail " * 10 for i in range(8)]
+    context, stats = pack_context("revenue", passages, token_budget=10000, method="none",
+                                  baseline_passages=passages[:3])
+    assert stats["baseline_tokens"] == sum(count_tokens(p) for p in passages[:3])
+    assert stats["context_tokens"] <= stats["baseline_tokens"]
+    assert stats["tokens_saved"] == stats["baseline_tokens"] - stats["context_tokens"]
+
+def test_mmr_skips_the_embedding_cache_when_asked(monkeypatch):
+    used = []
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_ENABLED", True)
+    monkeypatch.setattr(context_utils, "get_embedding_model", lambda provider: DeterministicFakeEmbedding(size=8))
+    # Reranking falls back to retrieval order on errors, so record instead of raising
+    monkeypatch.setattr(context_utils, "get_embedding_cache", lambda: used.append(True))
+    context, stats = pack_context("fox", [FIRST, SECOND, "Unrelated note"], token_budget=1000, method="mmr",
+                                  cache_embeddings=False)
+    assert stats["packed"] == 3
+    assert not used
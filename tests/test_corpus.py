@@ -0,0 +1,66 @@
+import os
+import sys
+import faiss
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from config import config
+from utils import corpus as corpus_module
+from utils.corpus import DocumentCorpus
+from utils.rag_utils import BM25Index, get_bm25_index, get_retriever
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+def _document(name, chunks):
+    return "\n".join(f"{name} filing section {i} on revenue and freight" for i in range(chunks)).encode("utf-8")
+
+@pytest.fixture
+def corpus(monkeypatch):
+    monkeypatch.setattr(config, "RETRIEVAL_MODE", "hybrid")
+    monkeypatch.setattr(config, "FAISS_INDEX_TYPE", "ivf")
+    monkeypatch.setattr(config, "FAISS_MIN_VECTORS_FOR_ANN", 100)
+    monkeypatch.setattr(corpus_module, "get_embedding_model", lambda provider: EMBEDDINGS)
+    # Each "upload" is embedded on its own, as get_or_create_vector_store would
+    monkeypatch.setattr(corpus_module, "get_or_create_vector_store",
+                        lambda data, file_name, document_id, stats=None: (FAISS.from_texts(data.decode("utf-8").split("\n"), EMBEDDINGS), "built"))
+    return DocumentCorpus(embedding_provider="fake")
+
+def _check_consistent(corpus):
+    vector_store = corpus.vector_store
+    texts = [vector_store.docstore.search(vector_store.index_to_docstore_id[i]).page_content
+             for i in range(vector_store.index.ntotal)]
+    assert sorted(vector_store.index_to_docstore_id) == list(range(len(texts)))
+    faiss.extract_index_ivf(vector_store.index).make_direct_map()
+    stored = vector_store.index.reconstruct_n(0, len(texts))
+    np.testing.assert_allclose(stored, np.asarray(EMBEDDINGS.embed_documents(texts), dtype=np.float32), rtol=1e-5)
+    rebuilt = BM25Index(texts)
+    bm25 = get_bm25_index(vector_store)
+    for query in ("revenue", "alpha section 3", "gamma filing", "freight section 42"):
+        assert bm25.search(query, 20) == rebuilt.search(query, 20)
+    return texts
+
+def test_remove_document_from_ivf_corpus(corpus):
+    corpus.add_document(_document("alpha", 120), "alpha.txt", "alpha")
+    corpus.add_document(_document("beta", 20), "beta.txt", "beta")
+    assert not isinstance(corpus.vector_store.index, faiss.IndexFlat)
+    corpus.add_document(_document("gamma", 30), "gamma.txt", "gamma")
+
+    corpus.remove_document("beta")
+    texts = _check_consistent(corpus)
+    assert len(texts) == 150
+    assert not any(text.startswith("beta") for text in texts)
+
+    docs = get_retriever(corpus.vector_store, k=5, document_ids=["gamma"]).invoke("gamma filing revenue")
+    assert len(docs) == 5
+    assert all(doc.metadata["document_id"] == "gamma" for doc in docs)
+
+def test_add_after_remove_keeps_positions_in_sync(corpus):
+    corpus.add_document(_document("alpha", 120), "alpha.txt", "alpha")
+    corpus.add_document(_document("beta", 20), "beta.txt", "beta")
+    corpus.remove_document("alpha")
+    corpus.add_document(_document("gamma", 30), "gamma.txt", "gamma")
+    texts = _check_consistent(corpus)
+    assert len(texts) == 50
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import threading
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.embedding_cache import EmbeddingCache
+
+MODEL_KEY = "fake:test"
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Records every text sent to the model; optionally slow or failing"""
+
+    calls: list = []
+    latency: float = 0.0
+    fail: bool = False
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("embedding backend unavailable")
+        return super().embed_documents(texts)
+
+def _cache(tmp_path, max_entries=100):
+    return EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_entries=max_entries)
+
+def test_repeated_chunks_are_embedded_once(tmp_path):
+    cache = _cache(tmp_path)
+    embeddings = CountingEmbeddings(size=8, calls=[])
+    vectors, counts = cache.embed_documents(embeddings, MODEL_KEY, ["footer", "body", "footer"])
+    assert embeddings.calls == [["footer", "body"]]
+    assert counts == {"hits": 0, "deduplicated": 1, "embedded": 2}
+    assert (vectors[0] == vectors[2]).all()
+
+    _, counts = cache.embed_documents(embeddings, MODEL_KEY, ["body", "new"])
+    assert embeddings.calls[-1] == ["new"]
+    assert counts == {"hits": 1, "deduplicated": 0, "embedded": 1}
+
+def test_concurrent_callers_share_in_flight_chunks(tmp_path):
+    cache = _cache(tmp_path)
+    embeddings = CountingEmbeddings(size=8, calls=[], latency=0.3)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.embed_documents(embeddings, MODEL_KEY, ["shared"])))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    assert embeddings.calls == [["shared"]]
+    assert sorted(counts["embedded"] for _, counts in results) == [0, 0, 1]
+
+def test_waiter_embeds_itself_when_the_owner_fails(tmp_path):
+    cache = _cache(tmp_path)
+    failing = CountingEmbeddings(size=8, calls=[], latency=0.3, fail=True)
+    healthy = CountingEmbeddings(size=8, calls=[])
+    errors = []
+
+    def owner():
+        try:
+            cache.embed_documents(failing, MODEL_KEY, ["chunk"])
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=owner)
+    thread.start()
+    time.sleep(0.05)
+    vectors, counts = cache.embed_documents(healthy, MODEL_KEY, ["chunk"])
+    thread.join()
+    assert errors and healthy.calls == [["chunk"]]
+    assert counts["embedded"] == 1 and len(vectors) == 1
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = _cache(tmp_path, max_entries=2)
+    embeddings = CountingEmbeddings(size=8, calls=[])
+    cache.embed_documents(embeddings, MODEL_KEY, ["a"])
+    time.sleep(0.01)
+    cache.embed_documents(embeddings, MODEL_KEY, ["b"])
+    time.sleep(0.01)
+    cache.embed_documents(embeddings, MODEL_KEY, ["a"])  # Touch a, so b is now the oldest
+    time.sleep(0.01)
+    cache.embed_documents(embeddings, MODEL_KEY, ["c"])
+    assert cache.stats()["entries"] == 2
+
+    embeddings.calls.clear()
+    cache.embed_documents(embeddings, MODEL_KEY, ["a", "b", "c"])
+    assert embeddings.calls == [["b"]]
@@ -0,0 +1,25 @@
+import os
+import sys
+import time
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models import embeddings
+
+def test_warm_up_start_does_not_wait_for_a_load(monkeypatch):
+    def slow_load(provider):
+        time.sleep(0.5)
+        return DeterministicFakeEmbedding(size=8)
+
+    monkeypatch.setattr(embeddings, "_create_embedding_model", slow_load)
+    monkeypatch.setattr(embeddings, "_embedding_models", {})
+    monkeypatch.setattr(embeddings, "_embedding_metrics", {})
+    monkeypatch.setattr(embeddings, "_warm_up_threads", {})
+
+    thread = embeddings.start_background_warm_up("slow")
+    time.sleep(0.05)
+    start = time.perf_counter()
+    assert embeddings.start_background_warm_up("slow") is thread
+    assert time.perf_counter() - start < 0.1
+    thread.join()
+    assert embeddings.get_embedding_metrics()["slow"]["warmup_seconds"] is not None
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import hashlib
+import multiprocessing
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.index_store import IndexStore, STALE_TMP_SECONDS, fcntl
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+def _content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _store(text):
+    return FAISS.from_texts([f"{text} part {i}" for i in range(5)], EMBEDDINGS)
+
+def test_save_and_load_round_trip(tmp_path):
+    store = IndexStore(str(tmp_path), max_bytes=10 * 1024 * 1024, use_mmap=False)
+    content_hash = _content_hash("report")
+    store.save(content_hash, _store("report"), source_name="report.pdf")
+    loaded = store.load(content_hash, EMBEDDINGS)
+    assert loaded.index.ntotal == 5
+    assert store.load(_content_hash("missing"), EMBEDDINGS) is None
+
+def test_garbage_collection_only_touches_store_directories(tmp_path):
+    store = IndexStore(str(tmp_path), max_bytes=10 * 1024 * 1024, use_mmap=False)
+    kept = _content_hash("kept")
+    store.save(kept, _store("kept"))
+
+    orphan = tmp_path / _content_hash("orphan")
+    orphan.mkdir()
+    stale_tmp = tmp_path / f"{_content_hash('crashed')}.123.456.tmp"
+    stale_tmp.mkdir()
+    old = time.time() - STALE_TMP_SECONDS - 1
+    os.utime(stale_tmp, (old, old))
+    fresh_tmp = tmp_path / f"{_content_hash('saving')}.123.456.tmp"
+    fresh_tmp.mkdir()
+    unrelated = tmp_path / "src"
+    unrelated.mkdir()
+    (unrelated / "app.py").write_text("print('hello')")
+
+    removed = store.collect_garbage()
+    assert sorted(removed) == sorted([orphan.name, stale_tmp.name])
+    assert (tmp_path / kept).is_dir()
+    assert fresh_tmp.is_dir()
+    assert (unrelated / "app.py").exists()
+
+def test_garbage_collection_evicts_least_recently_used(tmp_path):
+    store = IndexStore(str(tmp_path), max_bytes=10 * 1024 * 1024, use_mmap=False)
+    first, second = _content_hash("first"), _content_hash("second")
+    store.save(first, _store("first"))
+    store.save(second, _store("second"))
+    store.max_bytes = store.total_bytes() - 1
+    assert store.collect_garbage() == [first]
+    assert store.load(second, EMBEDDINGS) is not None
+
+def _save_many(root_dir, worker, count):
+    store = IndexStore(root_dir, max_bytes=1024 * 1024 * 1024, use_mmap=False)
+    for i in range(count):
+        store.save(_content_hash(f"{worker}-{i}"), _store(f"{worker}-{i}"))
+
+@pytest.mark.skipif(fcntl is None or "fork" not in multiprocessing.get_all_start_methods(),
+                    reason="needs fcntl locks and fork")
+def test_concurrent_processes_keep_every_manifest_entry(tmp_path):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_save_many, args=(str(tmp_path), worker, 8)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    store = IndexStore(str(tmp_path), max_bytes=1024 * 1024 * 1024, use_mmap=False)
+    manifest = store._read_manifest()
+    assert len(manifest) == 32
+    assert store.collect_garbage() == []
+    assert store.load(_content_hash("3-7"), EMBEDDINGS) is not None
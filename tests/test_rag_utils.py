@@ -0,0 +1,88 @@
+import os
+import sys
+import threading
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from config import config
+from utils.ann_index import convert_vector_store_index
+from utils.rag_utils import BM25Index, create_vector_store, get_retriever
+
+def _unbalanced_store():
+    """One 301-chunk document and one single-chunk document"""
+    texts = [f"Quarterly revenue growth report, section {i}" for i in range(301)]
+    metadatas = [{"document_id": "large"} for _ in texts]
+    texts.append("Employee handbook: vacation policy and revenue sharing")
+    metadatas.append({"document_id": "small"})
+    return FAISS.from_texts(texts, DeterministicFakeEmbedding(size=32), metadatas=metadatas)
+
+@pytest.mark.parametrize("mode", ["hybrid", "vector"])
+@pytest.mark.parametrize("index_type", ["flat", "ivf"])
+def test_small_document_is_not_crowded_out(monkeypatch, mode, index_type):
+    monkeypatch.setattr(config, "RETRIEVAL_MODE", mode)
+    monkeypatch.setattr(config, "FAISS_MIN_VECTORS_FOR_ANN", 0)
+    monkeypatch.setattr(config, "FAISS_NPROBE", 1)
+    vector_store = convert_vector_store_index(_unbalanced_store(), index_type)
+
+    docs = get_retriever(vector_store, k=3, document_ids=["small"]).invoke("quarterly revenue growth")
+    assert [doc.metadata["document_id"] for doc in docs] == ["small"]
+
+    docs = get_retriever(vector_store, k=3, document_ids=["large"]).invoke("quarterly revenue growth")
+    assert len(docs) == 3
+    assert all(doc.metadata["document_id"] == "large" for doc in docs)
+
+def test_unknown_document_returns_nothing():
+    assert get_retriever(_unbalanced_store(), document_ids=["missing"]).invoke("revenue") == []
+
+DOCUMENT_TEXTS = [
+    "Revenue grew 12.5% in the third quarter",
+    "Operating margin fell on higher freight costs",
+    "The board approved a share buyback of $2bn",
+    "Revenue guidance for fiscal 2025 was raised",
+    "Freight costs are expected to ease next year",
+    "Clause 3.2.1 covers early termination of the lease",
+]
+QUERIES = ["revenue guidance", "freight costs", "clause 3.2.1 termination", "share buyback", "margin"]
+
+def _same_ranking(left, right):
+    for query in QUERIES:
+        assert left.search(query, 10) == right.search(query, 10), query
+
+def test_bm25_extend_matches_a_full_build():
+    combined = BM25Index(DOCUMENT_TEXTS[:2])
+    combined.extend(BM25Index(DOCUMENT_TEXTS[2:4]))
+    combined.extend(BM25Index(DOCUMENT_TEXTS[4:]))
+    assert combined.size == len(DOCUMENT_TEXTS)
+    _same_ranking(combined, BM25Index(DOCUMENT_TEXTS))
+
+def test_bm25_remove_compacts_positions():
+    bm25 = BM25Index(DOCUMENT_TEXTS)
+    bm25.search("revenue", 3)  # Cache weights before the change
+    bm25.remove([1, 3])
+    remaining = [text for i, text in enumerate(DOCUMENT_TEXTS) if i not in (1, 3)]
+    assert bm25.size == len(remaining)
+    _same_ranking(bm25, BM25Index(remaining))
+    assert bm25.search("revenue", 10) == [0]
+    assert bm25.search("freight", 10) == [remaining.index(DOCUMENT_TEXTS[4])]
+
+def test_bm25_search_restricted_to_positions():
+    bm25 = BM25Index(DOCUMENT_TEXTS)
+    assert bm25.search("revenue", 10, positions=[3, 4]) == [3]
+
+def test_concurrent_ingests_report_their_own_stats(monkeypatch):
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_ENABLED", False)
+    stats = {10: {}, 200: {}}
+
+    def ingest(chunks):
+        docs = [Document(page_content=f"Document of {chunks} chunks, part {i}") for i in range(chunks)]
+        create_vector_store(docs, embedding_provider="fake", batch_size=8, stats=stats[chunks])
+
+    threads = [threading.Thread(target=ingest, args=(chunks,)) for chunks in stats]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {chunks: result["chunks"] for chunks, result in stats.items()} == {10: 10, 200: 200}
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from config import config
+from models import router as router_module
+from models.router import (ProviderRouter, StubChatModel, AllProvidersFailed, get_provider_health,
+                           reset_provider_health, get_provider_router)
+from models.scheduler import RateLimitExceeded, ProviderScheduler, ScheduledChatModel, RateLimitedStubModel
+
+RESET_SECONDS = 0.1
+
+@pytest.fixture(autouse=True)
+def router_config(monkeypatch):
+    monkeypatch.setattr(config, "ROUTER_RESET_SECONDS", RESET_SECONDS)
+    monkeypatch.setattr(config, "ROUTER_HEDGE_DELAY_SECONDS", 0.05)
+    monkeypatch.setattr(config, "ROUTER_HEDGE_MIN_DELAY_SECONDS", 0.05)
+    reset_provider_health()
+    yield
+    reset_provider_health()
+
+class SyncOnlyStub(StubChatModel):
+    """Fails if the router drives it through an event loop"""
+
+    async def ainvoke(self, messages):
+        raise AssertionError("invoke must not use ainvoke")
+
+def _half_open(name):
+    """Rate-limit a provider, then wait until its breaker allows a trial call"""
+    router = ProviderRouter({name: StubChatModel(error=RateLimitExceeded("429", retry_after=RESET_SECONDS))})
+    with pytest.raises(AllProvidersFailed):
+        router.invoke([])
+    assert not get_provider_health(name).available()
+    time.sleep(RESET_SECONDS * 1.5)
+    assert get_provider_health(name).available()
+
+def test_invoke_uses_sync_model_calls():
+    router = ProviderRouter({"a": SyncOnlyStub("A")})
+    assert [router.invoke([]).content for _ in range(3)] == ["A", "A", "A"]
+    assert router.last_provider == "a"
+
+def test_invoke_falls_back_to_next_provider():
+    failing = StubChatModel(error=RuntimeError("boom"))
+    router = ProviderRouter({"a": failing, "b": StubChatModel("B")})
+    assert router.invoke([]).content == "B"
+    assert router.last_provider == "b"
+    assert failing.calls == 1
+
+def test_sync_hedge_takes_faster_provider():
+    router = ProviderRouter({"a": StubChatModel("A", latency=0.5), "b": StubChatModel("B")}, hedge=True)
+    start = time.perf_counter()
+    assert router.invoke([]).content == "B"
+    assert time.perf_counter() - start < 0.4
+
+def test_cancelled_hedge_releases_half_open_trial():
+    _half_open("a")
+    router = ProviderRouter({"a": StubChatModel("A", latency=0.5), "b": StubChatModel("B")}, hedge=True)
+    assert asyncio.run(router.ainvoke([])).content == "B"
+    assert get_provider_health("a").available()
+    assert "a" in router.candidates()
+
+def test_stream_closed_early_releases_half_open_trial():
+    _half_open("a")
+    router = ProviderRouter({"a": StubChatModel("one two three")})
+    stream = router.stream([])
+    assert next(stream).content == "one"
+    stream.close()
+    assert get_provider_health("a").available()
+
+def test_astream_closed_early_releases_half_open_trial():
+    _half_open("a")
+    router = ProviderRouter({"a": StubChatModel("one two three")})
+
+    async def read_first():
+        stream = router.astream([])
+        chunk = await stream.__anext__()
+        await stream.aclose()
+        return chunk
+
+    assert asyncio.run(read_first()).content == "one"
+    assert get_provider_health("a").available()
+
+def test_rate_limited_provider_fails_over_without_retrying():
+    limited = RateLimitedStubModel(rpm=1, tpm=100000, window_seconds=30)
+    limited.invoke([])
+    scheduled = ScheduledChatModel(limited, ProviderScheduler("a", rpm=0, tpm=0, backoff_seconds=5), max_retries=0)
+    router = ProviderRouter({"a": scheduled, "b": StubChatModel("B")})
+    start = time.perf_counter()
+    assert router.invoke([]).content == "B"
+    assert time.perf_counter() - start < 0.5
+    assert limited.rejected == 1
+    assert get_provider_health("a").rate_limited == 1
+
+def test_router_only_falls_back_to_opted_in_providers(monkeypatch):
+    monkeypatch.setattr(router_module, "get_scheduled_llm", lambda provider, **kwargs: StubChatModel(provider))
+    monkeypatch.setattr(config, "ROUTER_FALLBACK_PROVIDERS", ["groq", "google"])
+    assert list(get_provider_router("groq").models) == ["groq", "google"]
+    assert list(get_provider_router("openai").models) == ["openai", "groq", "google"]
+    assert list(get_provider_router("groq", fallbacks=["openai"]).models) == ["groq", "openai"]
+    assert list(get_provider_router("groq", fallbacks=[]).models) == ["groq"]
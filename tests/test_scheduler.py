@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import pytest
+from langchain_core.messages import HumanMessage
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from config import config
+from models import llm
+from models.scheduler import (RateLimitExceeded, SchedulerTimeout, ProviderScheduler, ScheduledChatModel,
+                              RateLimitedStubModel, is_rate_limit_error, get_scheduled_llm,
+                              estimate_request_tokens)
+
+PROMPT = [HumanMessage(content="What was revenue last quarter?")]
+
+class StatusError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+def test_rate_limit_errors_are_detected():
+    assert is_rate_limit_error(RateLimitExceeded("slow down"))
+    assert is_rate_limit_error(StatusError("too many requests", 429))
+    assert is_rate_limit_error(RuntimeError("Error code: 429 - quota exceeded"))
+    assert is_rate_limit_error(RuntimeError("Rate limit reached for model"))
+
+def test_token_counts_containing_429_are_not_rate_limits():
+    error = StatusError("Request too large: Requested 14290 tokens, limit 6000", 413)
+    assert not is_rate_limit_error(error)
+    assert not is_rate_limit_error(RuntimeError("context length 4290 exceeded"))
+
+def test_fail_fast_model_raises_the_first_429():
+    stub = RateLimitedStubModel(rpm=1, tpm=100000, window_seconds=30)
+    model = ScheduledChatModel(stub, ProviderScheduler("stub", rpm=0, tpm=0, backoff_seconds=5), max_retries=0)
+    model.invoke(PROMPT)
+    start = time.perf_counter()
+    with pytest.raises(RateLimitExceeded):
+        model.invoke(PROMPT)
+    assert time.perf_counter() - start < 0.5
+    assert stub.rejected == 1
+
+def test_quota_wait_is_bounded():
+    scheduler = ProviderScheduler("stub", rpm=1, tpm=0, period_seconds=30)
+    model = ScheduledChatModel(RateLimitedStubModel(rpm=10, tpm=100000), scheduler, max_wait_seconds=0.1)
+    model.invoke(PROMPT)
+    start = time.perf_counter()
+    with pytest.raises(SchedulerTimeout):
+        model.invoke(PROMPT)
+    assert time.perf_counter() - start < 1.5
+
+def test_scheduled_clients_leave_retries_to_the_scheduler(monkeypatch):
+    created = []
+    monkeypatch.setattr(config, "GROQ_API_KEY", "test-key")
+    monkeypatch.setattr(config, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(llm, "_llm_pool", {})
+    monkeypatch.setattr(llm, "_create_llm", lambda provider, model_name, api_key, max_retries: created.append(max_retries) or object())
+    get_scheduled_llm("groq")
+    llm.get_llm("groq")
+    assert created == [0, config.LLM_MAX_RETRIES]
+
+class FailingModel:
+    def invoke(self, messages):
+        raise RuntimeError("400 bad request")
+
+    def stream(self, messages):
+        yield from ()
+        raise RuntimeError("400 bad request")
+
+def test_failed_call_returns_its_token_reservation():
+    scheduler = ProviderScheduler("stub", rpm=0, tpm=10000, period_seconds=3600)
+    model = ScheduledChatModel(FailingModel(), scheduler)
+    with pytest.raises(RuntimeError):
+        model.invoke(PROMPT)
+    with pytest.raises(RuntimeError):
+        list(model.stream(PROMPT))
+    assert scheduler.tokens.level == pytest.approx(10000, abs=1)
+
+def test_stream_closed_early_keeps_only_the_prompt_reserved():
+    scheduler = ProviderScheduler("stub", rpm=0, tpm=10000, period_seconds=3600)
+    model = ScheduledChatModel(RateLimitedStubModel(rpm=10, tpm=100000), scheduler)
+    stream = model.stream(PROMPT)
+    next(stream)
+    stream.close()
+    prompt_tokens = estimate_request_tokens(PROMPT, output_tokens=0)
+    assert scheduler.tokens.level == pytest.approx(10000 - prompt_tokens, abs=1)
@@ -0,0 +1,202 @@
+import os
+import sys
+import math
+import time
+import argparse
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "ivfsq8", "hnsw", "sq8")
+
+def _nlist_for(num_vectors: int) -> int:
+    if config.FAISS_NLIST > 0:
+        return config.FAISS_NLIST
+    # Common rule of thumb: about 4 * sqrt(n) inverted lists, capped so k-means
+    # gets the 39 training points per centroid faiss asks for
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+def index_factory_string(index_type: str, num_vectors: int) -> str:
+    """
+    Return the faiss index_factory description for one of INDEX_TYPES.
+    """
+    nlist = _nlist_for(num_vectors)
+    specs = {
+        "flat": "Flat",
+        "ivf": f"IVF{nlist},Flat",
+        "ivfpq": f"IVF{nlist},PQ{config.FAISS_PQ_M}",
+        "ivfsq8": f"IVF{nlist},SQ8",
+        "hnsw": f"HNSW{config.FAISS_HNSW_M}",
+        "sq8": "SQ8",
+    }
+    if index_type not in specs:
+        raise ValueError(f"Unsupported index type: {index_type}. Choose from {', '.join(INDEX_TYPES)}")
+    return specs[index_type]
+
+def apply_search_params(index, nprobe=None, ef_search=None):
+    """
+    Set query-time parameters (nprobe for IVF indexes, efSearch for HNSW)
+    on an index; parameters that don't apply to the index are ignored.
+    """
+    nprobe = nprobe or config.FAISS_NPROBE
+    ef_search = ef_search or config.FAISS_EF_SEARCH
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except Exception:
+        pass
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+    return index
+
+def restricted_search_params(index, ids):
+    """
+    Return faiss search parameters limiting a search to the given ids
+    (positions). IVF indexes probe every list under a selector, so a small
+    selection isn't missed because its vectors sit outside the usual nprobe
+    lists; only selected vectors are compared, so this stays cheap.
+    """
+    selector = faiss.IDSelectorBatch(np.asarray(ids, dtype=np.int64))
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except Exception:
+        ivf = None
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nlist)
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(hnsw.efSearch, len(ids)))
+    return faiss.SearchParameters(sel=selector)
+
+def build_index(vectors: np.ndarray, index_type: str, train_sample=None):
+    """
+    Build a faiss index of the given type over vectors (L2 metric, same as the
+    default flat index). Trainable indexes are trained on a random sample.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dim = vectors.shape
+    index = faiss.index_factory(dim, index_factory_string(index_type, num_vectors))
+    if index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = config.FAISS_EF_CONSTRUCTION
+
+    if not index.is_trained:
+        train_sample = train_sample or config.FAISS_TRAIN_SAMPLE
+        if num_vectors > train_sample:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(num_vectors, train_sample, replace=False)]
+        else:
+            sample = vectors
+        index.train(sample)
+
+    index.add(vectors)
+    return apply_search_params(index)
+
+def vector_store_vectors(vector_store) -> np.ndarray:
+    """
+    Return all vectors of a vector store's faiss index, in index order.
+    """
+    return vector_store.index.reconstruct_n(0, vector_store.index.ntotal)
+
+def convert_vector_store_index(vector_store, index_type=None):
+    """
+    Replace a vector store's flat index with one of the configured ANN types.
+
+    Positions are preserved, so the docstore mapping and BM25 index stay
+    valid. Small stores are left flat: below FAISS_MIN_VECTORS_FOR_ANN
+    exhaustive search is already fast and there is too little data to train on.
+
+    Returns:
+        FAISS: The same vector store
+    """
+    index_type = index_type or config.FAISS_INDEX_TYPE
+    if index_type == "flat" or vector_store.index.ntotal < config.FAISS_MIN_VECTORS_FOR_ANN:
+        return vector_store
+    vector_store.index = build_index(vector_store_vectors(vector_store), index_type)
+    return vector_store
+
+def index_memory_bytes(index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+def recall_latency_report(vectors: np.ndarray, queries: np.ndarray, k=10, index_types=INDEX_TYPES,
+                          nprobe_values=(1, 4, 16, 64), ef_search_values=(16, 64, 256)):
+    """
+    Compare index types against exact flat search.
+
+    Returns:
+        list: One dict per (index type, search setting) with recall@k, mean
+            and p95 query latency in ms, index size and build time
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, truth = flat.search(queries, k)
+
+    def measure(index):
+        latencies = []
+        found = []
+        for query in queries:
+            start = time.perf_counter()
+            _, ids = index.search(query[None, :], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(ids[0])
+        hits = sum(len(set(row) & set(expected)) for row, expected in zip(found, truth))
+        return hits / truth.size, float(np.mean(latencies)), float(np.percentile(latencies, 95))
+
+    report = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_index(vectors, index_type)
+        build_seconds = time.perf_counter() - start
+        if index_type.startswith("ivf"):
+            settings = [{"nprobe": n} for n in nprobe_values]
+        elif index_type == "hnsw":
+            settings = [{"ef_search": ef} for ef in ef_search_values]
+        else:
+            settings = [{}]
+        for params in settings:
+            apply_search_params(index, **params)
+            recall, mean_ms, p95_ms = measure(index)
+            report.append({
+                "index_type": index_type,
+                "params": params,
+                "recall_at_k": recall,
+                "mean_ms": mean_ms,
+                "p95_ms": p95_ms,
+                "memory_bytes": index_memory_bytes(index),
+                "build_seconds": build_seconds,
+            })
+    return report
+
+def _synthetic_vectors(num_vectors, dim, num_clusters=256, seed=0):
+    # Clustered data looks more like real embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, num_clusters, size=num_vectors)
+    vectors = centers[labels] + 0.3 * rng.normal(size=(num_vectors, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def main():
+    # Run from the project root: python -m utils.ann_index --vectors 1000000
+    parser = argparse.ArgumentParser(description="Recall vs latency of faiss index types against flat search")
+    parser.add_argument("--vectors", type=int, default=100000, help="Synthetic vectors to index")
+    parser.add_argument("--dim", type=int, default=384, help="Vector dimension (384 for all-MiniLM-L6-v2)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", default=",".join(INDEX_TYPES))
+    args = parser.parse_args()
+
+    data = _synthetic_vectors(args.vectors + args.queries, args.dim)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+    report = recall_latency_report(vectors, queries, k=args.k, index_types=args.types.split(","))
+
+    print(f"{'index':<8} {'params':<18} {'recall@k':>9} {'mean ms':>9} {'p95 ms':>9} {'size MB':>9} {'build s':>8}")
+    for row in report:
+        params = ",".join(f"{key}={value}" for key, value in row["params"].items()) or "-"
+        print(f"{row['index_type']:<8} {params:<18} {row['recall_at_k']:>9.3f} {row['mean_ms']:>9.3f} "
+              f"{row['p95_ms']:>9.3f} {row['memory_bytes'] / 1e6:>9.1f} {row['build_seconds']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
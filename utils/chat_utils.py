@@ -0,0 +1,92 @@
+import time
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+BASE_PROMPT = "You are a Strategic Business Intelligence Analyst."
+
+def get_system_prompt(response_mode: str) -> str:
+    """Return the system prompt for a response mode ('Concise' or 'Detailed')"""
+    if response_mode == "Concise":
+        return f"{BASE_PROMPT} Provide short, executive summaries. Focus on key metrics and high-level insights. Be brief and to the point."
+    return f"{BASE_PROMPT} Provide detailed, in-depth analysis. Explain the 'why' and 'how'. Include context, nuance, and comprehensive explanations."
+
+def build_messages(messages, system_prompt, context=""):
+    """Build the LangChain message list sent to the chat model"""
+    # Prepare messages for the model
+    final_system_prompt = system_prompt
+    if context:
+        final_system_prompt += f"\n\nCONTEXT FROM DOCUMENTS/SEARCH:\n{context}"
+        
+    formatted_messages = [SystemMessage(content=final_system_prompt)]
+    
+    # Add conversation history
+    for msg in messages:
+        if msg["role"] == "user":
+            formatted_messages.append(HumanMessage(content=msg["content"]))
+        else:
+            formatted_messages.append(AIMessage(content=msg["content"]))
+    return formatted_messages
+
+def get_chat_response(chat_model, messages, system_prompt, context=""):
+    """Get response from the chat model"""
+    try:
+        formatted_messages = build_messages(messages, system_prompt, context)
+        
+        # Get response from model
+        response = chat_model.invoke(formatted_messages)
+        return response.content
+    
+    except Exception as e:
+        return f"Error getting response: {str(e)}"
+
+def chunk_text(chunk):
+    """Extract text from a streamed message chunk (some providers send content parts)"""
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+def stream_chat_response(chat_model, messages, system_prompt, context="", stats=None):
+    """
+    Stream the response from the chat model, yielding text as it arrives.
+
+    If a stats dict is passed it is filled with time-to-first-token, output
+    tokens and tokens/sec for the turn. Output tokens come from the provider's
+    usage metadata when available, otherwise each streamed chunk counts as one.
+    stats['error'] is the error message if the stream failed (possibly after
+    some text was yielded), else None.
+    """
+    start = time.perf_counter()
+    first_token_at = None
+    chunk_count = 0
+    usage_tokens = None
+    error = None
+    try:
+        formatted_messages = build_messages(messages, system_prompt, context)
+        for chunk in chat_model.stream(formatted_messages):
+            text = chunk_text(chunk)
+            usage = getattr(chunk, "usage_metadata", None)
+            if usage and usage.get("output_tokens"):
+                usage_tokens = (usage_tokens or 0) + usage["output_tokens"]
+            if not text:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunk_count += 1
+            yield text
+
+    except Exception as e:
+        error = str(e)
+        yield f"Error getting response: {error}"
+
+    finally:
+        if stats is not None:
+            total = time.perf_counter() - start
+            tokens = usage_tokens or chunk_count
+            generation = total - (first_token_at - start) if first_token_at else 0.0
+            stats.update({
+                "time_to_first_token": (first_token_at - start) if first_token_at else None,
+                "total_seconds": total,
+                "output_tokens": tokens,
+                "tokens_per_sec": tokens / generation if generation > 0 else 0.0,
+                "error": error,
+            })
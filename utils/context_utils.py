@@ -0,0 +1,176 @@
+import os
+import sys
+import logging
+import threading
+from typing import List
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+from models.embeddings import get_embedding_model
+from utils.embedding_cache import get_embedding_cache, embedding_model_key
+from utils.token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+def get_context_token_budget(model_name: str) -> int:
+    """
+    Return the retrieved-context token budget for a model.
+    """
+    return config.CONTEXT_TOKEN_BUDGETS.get(model_name, config.CONTEXT_TOKEN_BUDGET_DEFAULT)
+
+def _embed_passages(query: str, passages: List[str], embedding_provider="huggingface", cache_embeddings=True):
+    embeddings = get_embedding_model(embedding_provider)
+    query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    if cache_embeddings and config.EMBEDDING_CACHE_ENABLED:
+        # Retrieved chunks were embedded at ingest, so these are cache hits
+        vectors, _ = get_embedding_cache().embed_documents(
+            embeddings, embedding_model_key(embedding_provider, embeddings), passages
+        )
+    else:
+        vectors = embeddings.embed_documents(passages)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+    return query_vector, matrix
+
+def mmr_order(query: str, passages: List[str], mmr_lambda=None, embedding_provider="huggingface",
+              cache_embeddings=True) -> List[int]:
+    """
+    Order passages by maximal marginal relevance: each pick maximizes
+    mmr_lambda * similarity to the query minus (1 - mmr_lambda) * its highest
+    similarity to passages already picked, so near-duplicates sink.
+    Set cache_embeddings=False for one-off passages such as web-search
+    snippets, so they don't fill the persistent embedding cache.
+    """
+    mmr_lambda = config.CONTEXT_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    query_vector, matrix = _embed_passages(query, passages, embedding_provider, cache_embeddings)
+    relevance = matrix @ query_vector
+    similarity = matrix @ matrix.T
+
+    order = []
+    remaining = list(range(len(passages)))
+    redundancy = np.full(len(passages), -1.0, dtype=np.float32)
+    while remaining:
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * np.maximum(redundancy[remaining], 0.0)
+        best = remaining.pop(int(np.argmax(scores)))
+        order.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return order
+
+def _get_cross_encoder():
+    global _cross_encoder
+    with _cross_encoder_lock:
+        if _cross_encoder is None:
+            from sentence_transformers import CrossEncoder
+            _cross_encoder = CrossEncoder(config.CONTEXT_CROSS_ENCODER_MODEL, device=config.EMBEDDING_DEVICE)
+        return _cross_encoder
+
+def cross_encoder_order(query: str, passages: List[str]) -> List[int]:
+    """
+    Order passages by a local cross-encoder's relevance score, best first.
+    """
+    scores = _get_cross_encoder().predict([(query, passage) for passage in passages])
+    return [int(i) for i in np.argsort(-np.asarray(scores))]
+
+def rerank(query: str, passages: List[str], method=None, cache_embeddings=True) -> List[int]:
+    """
+    Return passage indexes best first using 'mmr', 'cross-encoder' or 'none'
+    (keep the given order). Falls back to the given order if reranking fails.
+    """
+    method = method or config.CONTEXT_RERANKER
+    if method == "none" or len(passages) < 2:
+        return list(range(len(passages)))
+    try:
+        if method == "cross-encoder":
+            return cross_encoder_order(query, passages)
+        return mmr_order(query, passages, cache_embeddings=cache_embeddings)
+    except Exception as e:
+        logger.warning("Reranking with %s failed, keeping retrieval order: %s", method, e)
+        return list(range(len(passages)))
+
+def _overlap(left: str, right: str, min_chars: int) -> int:
+    """Length of the longest suffix of left that is a prefix of right"""
+    longest = min(len(left), len(right), max(config.CHUNK_OVERLAP * 2, min_chars))
+    for size in range(longest, min_chars - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def strip_overlap(text: str, packed: List[str], min_chars=None) -> str:
+    """
+    Remove text already present in packed passages: exact repeats, and the
+    leading or trailing span a chunk shares with its neighbour through the
+    splitter's chunk overlap.
+    """
+    min_chars = config.CONTEXT_MIN_OVERLAP_CHARS if min_chars is None else min_chars
+    for other in packed:
+        if text in other:
+            return ""
+        head = _overlap(other, text, min_chars)
+        if head:
+            text = text[head:]
+        tail = _overlap(text, other, min_chars)
+        if tail:
+            text = text[:-tail]
+    return text.strip()
+
+def pack_context(query: str, passages: List[str], token_budget: int, method=None, cache_embeddings=True,
+                 baseline_passages=None):
+    """
+    Assemble retrieved passages into a context string within token_budget.
+
+    Passages are reranked, stripped of text overlapping passages already
+    packed, and added best first while they fit; a passage that doesn't fit
+    is skipped so a smaller one further down can still be used. Pass
+    cache_embeddings=False for passages that aren't stored chunks (web search).
+
+    baseline_passages are what would be sent without packing (e.g. the top
+    RETRIEVAL_K chunks; defaults to all passages). The budget is capped at
+    their size, so packing never makes the prompt larger, and tokens saved
+    are measured against them.
+
+    Returns:
+        tuple: (context, stats) where stats has candidate and packed passage
+            and token counts, overlap tokens removed and tokens saved
+    """
+    passages = [passage for passage in passages if passage and passage.strip()]
+    candidate_tokens = sum(count_tokens(passage) for passage in passages)
+    if baseline_passages is None:
+        baseline_tokens = candidate_tokens
+    else:
+        baseline_tokens = sum(count_tokens(passage) for passage in baseline_passages if passage and passage.strip())
+    token_budget = min(token_budget, baseline_tokens)
+    packed = []
+    used = 0
+    overlap_tokens = 0
+    for index in rerank(query, passages, method, cache_embeddings):
+        passage = passages[index]
+        text = strip_overlap(passage, packed)
+        if not text:
+            overlap_tokens += count_tokens(passage)
+            continue
+        tokens = count_tokens(text)
+        if used + tokens > token_budget:
+            continue
+        overlap_tokens += count_tokens(passage) - tokens
+        packed.append(text)
+        used += tokens
+
+    stats = {
+        "candidates": len(passages),
+        "packed": len(packed),
+        "candidate_tokens": candidate_tokens,
+        "baseline_tokens": baseline_tokens,
+        "context_tokens": used,
+        "overlap_tokens_removed": max(0, overlap_tokens),
+        "tokens_saved": baseline_tokens - used,
+        "token_budget": token_budget,
+    }
+    logger.info("Packed %d of %d passages into %d tokens (budget %d, saved %d, %d overlapping)",
+                stats["packed"], stats["candidates"], used, token_budget,
+                stats["tokens_saved"], stats["overlap_tokens_removed"])
+    return "\n\n".join(packed), stats
@@ -0,0 +1,150 @@
+import os
+import sys
+import uuid
+import threading
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+from models.embeddings import get_embedding_model
+from utils.ann_index import convert_vector_store_index, apply_search_params
+from utils.rag_utils import get_or_create_vector_store, get_bm25_index, extend_bm25_index, remove_from_bm25_index
+from utils.vector_cache import compute_content_hash
+
+def _document_vectors(vector_store):
+    """Return (documents, vectors) of a vector store in index order"""
+    index = vector_store.index
+    ivf = None
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except Exception:
+        pass
+    if ivf is not None:
+        # IVF indexes need a direct map before vectors can be reconstructed
+        ivf.make_direct_map()
+    vectors = index.reconstruct_n(0, index.ntotal)
+    docstore_ids = vector_store.index_to_docstore_id
+    documents = [vector_store.docstore.search(docstore_ids[i]) for i in range(index.ntotal)]
+    return documents, vectors
+
+def _delete_positions(vector_store, positions):
+    """
+    Delete chunks from a store with a non-flat (IVF) index. IVF remove_ids
+    keeps the remaining vectors' original ids, which FAISS.delete assumes are
+    compacted, so the index is refilled from the remaining vectors instead,
+    reusing the trained quantizer (nothing is re-embedded or retrained).
+    """
+    index = vector_store.index
+    faiss.extract_index_ivf(index).make_direct_map()
+    keep = np.ones(index.ntotal, dtype=bool)
+    keep[positions] = False
+    vectors = index.reconstruct_n(0, index.ntotal)[keep]
+
+    rebuilt = faiss.clone_index(index)
+    rebuilt.reset()
+    rebuilt.add(vectors)
+    vector_store.index = apply_search_params(rebuilt)
+
+    docstore_ids = vector_store.index_to_docstore_id
+    vector_store.docstore.delete([docstore_ids[position] for position in positions])
+    remaining = [docstore_ids[position] for position in range(len(keep)) if keep[position]]
+    vector_store.index_to_docstore_id = dict(enumerate(remaining))
+
+class DocumentCorpus:
+    """
+    Per-session corpus of uploaded documents sharing one FAISS index.
+
+    Each document is embedded on its own (reusing the upload cache and the
+    persistent index store), then its vectors are appended to the corpus
+    index, so adding a document never re-embeds the others. Removing a
+    document deletes only its vectors. Chunks carry 'document_id' and
+    'source' metadata for filtered retrieval.
+
+    The corpus index is mutable and never shares memory with cached or
+    memory-mapped per-document stores. It starts flat and becomes an IVF index
+    once large enough if FAISS_INDEX_TYPE is one of the IVF types; HNSW cannot
+    delete vectors, so corpora stay flat in that case.
+    """
+
+    def __init__(self, embedding_provider="huggingface"):
+        self.embedding_provider = embedding_provider
+        self.vector_store = None
+        self.documents = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, document_id):
+        return document_id in self.documents
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add_document(self, data: bytes, file_name: str, document_id: str = None, stats=None):
+        """
+        Add an uploaded document to the corpus. If a stats dict is passed it
+        is filled with ingest stats when the document had to be built.
+
+        Returns:
+            tuple: (document_id, source) where source is 'memory', 'disk',
+                'built' or 'existing' if the document was already in the corpus
+        """
+        document_id = document_id or compute_content_hash(data)
+        if document_id in self.documents:
+            return document_id, "existing"
+
+        document_store, source = get_or_create_vector_store(data, file_name, document_id, stats=stats)
+        documents, vectors = _document_vectors(document_store)
+
+        texts = [doc.page_content for doc in documents]
+        metadatas = [{**doc.metadata, "document_id": document_id, "source": file_name} for doc in documents]
+        ids = [str(uuid.uuid4()) for _ in documents]
+        text_embeddings = list(zip(texts, vectors))
+
+        # Built at ingest (or cached), and in the same order as the vectors
+        document_bm25 = get_bm25_index(document_store) if config.RETRIEVAL_MODE == "hybrid" else None
+
+        with self._lock:
+            if self.vector_store is None:
+                self.vector_store = FAISS.from_embeddings(
+                    text_embeddings, get_embedding_model(self.embedding_provider), metadatas=metadatas, ids=ids
+                )
+            else:
+                self.vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+            if document_bm25 is not None:
+                extend_bm25_index(self.vector_store, document_bm25)
+            if config.FAISS_INDEX_TYPE.startswith("ivf") and isinstance(self.vector_store.index, faiss.IndexFlat):
+                convert_vector_store_index(self.vector_store)
+            self.documents[document_id] = {
+                "name": file_name,
+                "ids": ids,
+                "num_chunks": len(ids),
+            }
+        return document_id, source
+
+    def remove_document(self, document_id: str):
+        """
+        Remove a document's vectors from the corpus.
+        """
+        with self._lock:
+            document = self.documents.pop(document_id, None)
+            if document is None:
+                return
+            if not self.documents:
+                self.vector_store = None
+                return
+            removed = set(document["ids"])
+            positions = [position for position, docstore_id in self.vector_store.index_to_docstore_id.items()
+                         if docstore_id in removed]
+            if isinstance(self.vector_store.index, faiss.IndexFlat):
+                self.vector_store.delete(document["ids"])
+            else:
+                _delete_positions(self.vector_store, positions)
+            remove_from_bm25_index(self.vector_store, positions)
+
+    def corpus_hash(self, document_ids=None) -> str:
+        """
+        Return a stable hash of the selected documents, for cache scoping.
+        """
+        selected = sorted(document_ids if document_ids is not None else self.documents)
+        return compute_content_hash("\n".join(selected).encode("utf-8")) if selected else ""
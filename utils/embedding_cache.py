@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+
+def embedding_model_key(provider: str, embeddings) -> str:
+    """
+    Identify the vectors an embedding model produces: provider, model name and
+    whether embeddings are normalized.
+    """
+    model = getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None) or type(embeddings).__name__
+    return f"{provider}:{model}:normalize={config.EMBEDDING_NORMALIZE}"
+
+def chunk_key(model_key: str, text: str) -> str:
+    return hashlib.sha256(f"{model_key}\x1f{text}".encode("utf-8")).hexdigest()
+
+class _InFlight:
+    """A chunk being embedded by another caller"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.vector = None
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of chunk embeddings, backed by a local SQLite file.
+
+    Vectors are keyed by a hash of the chunk text and the embedding model, so
+    boilerplate shared across documents (disclaimers, footers, repeated
+    tables) and the unchanged pages of a revised report are embedded once.
+    Identical chunks within a call are embedded once, and a chunk already being
+    embedded by a concurrent call (another batch or another document) is
+    waited for rather than embedded twice. The least recently used entries
+    are evicted beyond max_entries.
+    """
+
+    def __init__(self, db_path, max_entries):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.requested = 0
+        self.hits = 0
+        self.deduplicated = 0
+        self.embedded = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._inflight_lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        # WAL lets other processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+
+    def _get_many(self, keys):
+        found = {}
+        now = time.time()
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _put_many(self, model_key, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_access) VALUES (?, ?, ?, ?)",
+                [(key, model_key, vector.tobytes(), now) for key, vector in items],
+            )
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def embed_documents(self, embeddings, model_key: str, texts: List[str]):
+        """
+        Embed texts, using cached vectors where possible and the embedding
+        model only for cache misses.
+
+        Args:
+            embeddings (Embeddings): Model used for misses
+            model_key (str): embedding_model_key for the model
+            texts (list): Chunk texts
+
+        Returns:
+            tuple: (vectors, counts) where vectors are float32 arrays in the
+                order of texts and counts has 'hits', 'deduplicated' and
+                'embedded' chunk counts for this call
+        """
+        keys = [chunk_key(model_key, text) for text in texts]
+        unique = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, text)
+
+        vectors = self._get_many(list(unique))
+        counts = {"hits": sum(1 for key in keys if key in vectors), "deduplicated": 0, "embedded": 0}
+
+        # Claim the misses nobody else is embedding; wait for the rest
+        owned, waiting = [], []
+        with self._inflight_lock:
+            for key in unique:
+                if key in vectors:
+                    continue
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    self._inflight[key] = _InFlight()
+                    owned.append(key)
+                else:
+                    waiting.append((key, inflight))
+
+        try:
+            if owned:
+                new_vectors = embeddings.embed_documents([unique[key] for key in owned])
+                items = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in zip(owned, new_vectors)]
+                self._put_many(model_key, items)
+                vectors.update(items)
+        finally:
+            with self._inflight_lock:
+                for key in owned:
+                    inflight = self._inflight.pop(key)
+                    inflight.vector = vectors.get(key)
+                    inflight.done.set()
+
+        retry = []
+        for key, inflight in waiting:
+            inflight.done.wait()
+            if inflight.vector is None:
+                # The other caller failed; embed it here instead
+                retry.append(key)
+            else:
+                vectors[key] = inflight.vector
+        if retry:
+            new_vectors = embeddings.embed_documents([unique[key] for key in retry])
+            items = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in zip(retry, new_vectors)]
+            self._put_many(model_key, items)
+            vectors.update(items)
+
+        counts["embedded"] = len(owned) + len(retry)
+        counts["deduplicated"] = len(keys) - counts["hits"] - counts["embedded"]
+        with self._inflight_lock:
+            self.requested += len(keys)
+            self.hits += counts["hits"]
+            self.deduplicated += counts["deduplicated"]
+            self.embedded += counts["embedded"]
+        return [vectors[key] for key in keys], counts
+
+    def stats(self) -> dict:
+        """
+        Return chunk counts since startup. hit_rate is the share of requested
+        chunks that did not need the embedding model.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "requested": self.requested,
+            "hits": self.hits,
+            "deduplicated": self.deduplicated,
+            "embedded": self.embedded,
+            "hit_rate": (self.requested - self.embedded) / self.requested if self.requested else 0.0,
+            "entries": entries,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Return the process-wide chunk embedding cache, creating it on first use.
+    """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                db_path=config.EMBEDDING_CACHE_PATH,
+                max_entries=config.EMBEDDING_CACHE_MAX_ENTRIES,
+            )
+        return _embedding_cache
@@ -0,0 +1,107 @@
+import os
+import sys
+import logging
+from langchain_core.messages import HumanMessage, SystemMessage
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+from utils.token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a business "
+    "intelligence analyst. Update the summary with the new messages below. Keep facts, "
+    "figures, decisions and open questions; drop pleasantries. Reply with the updated "
+    "summary only, in at most {max_words} words."
+)
+
+def get_history_token_budget(model_name: str) -> int:
+    """
+    Return the conversation history token budget for a model.
+    """
+    return config.HISTORY_TOKEN_BUDGETS.get(model_name, config.HISTORY_TOKEN_BUDGET_DEFAULT)
+
+def message_tokens(message: dict) -> int:
+    """
+    Return the token count of a chat message, computing it once and caching
+    it on the message itself.
+    """
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = count_tokens(message["content"])
+        message["tokens"] = tokens
+    return tokens
+
+class ConversationHistory:
+    """
+    Keeps the most recent turns within a token budget and folds older turns
+    into a running summary.
+
+    The summary is updated incrementally: only messages that newly fall out of
+    the window are sent to the model together with the previous summary. When
+    the window overflows it is trimmed to a low watermark, so summarization
+    runs every few turns instead of on every one.
+    """
+
+    def __init__(self, summary_max_tokens=None, low_watermark=None):
+        self.summary = ""
+        self.summarized_count = 0
+        self.summary_max_tokens = summary_max_tokens or config.HISTORY_SUMMARY_MAX_TOKENS
+        self.low_watermark = low_watermark or config.HISTORY_LOW_WATERMARK
+
+    def reset(self):
+        self.summary = ""
+        self.summarized_count = 0
+
+    def prepare(self, messages, token_budget, chat_model=None):
+        """
+        Return the messages to send this turn, summarizing older ones if the
+        unsummarized history no longer fits the budget.
+
+        Args:
+            messages (list): Full chat history as role/content dicts
+            token_budget (int): Token budget for summary plus recent messages
+            chat_model: Model used to update the summary; without one, old
+                messages are simply dropped
+
+        Returns:
+            tuple: (summary, recent_messages)
+        """
+        if self.summarized_count > len(messages):
+            # History was cleared or replaced underneath us
+            self.reset()
+
+        recent = messages[self.summarized_count:]
+        total = count_tokens(self.summary) + sum(message_tokens(m) for m in recent)
+        if total <= token_budget or len(recent) <= 1:
+            return self.summary, recent
+
+        # Keep the newest messages that fit under the low watermark, always
+        # including the latest one.
+        target = int(token_budget * self.low_watermark) - self.summary_max_tokens
+        kept_tokens = 0
+        cut = len(recent) - 1
+        while cut > 0 and kept_tokens + message_tokens(recent[cut - 1]) + message_tokens(recent[-1]) <= target:
+            kept_tokens += message_tokens(recent[cut - 1])
+            cut -= 1
+
+        folded = recent[:cut]
+        if chat_model is not None:
+            self.summary = self._update_summary(folded, chat_model)
+        self.summarized_count += len(folded)
+        return self.summary, messages[self.summarized_count:]
+
+    def _update_summary(self, folded, chat_model):
+        transcript = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in folded)
+        previous = self.summary or "(empty)"
+        try:
+            response = chat_model.invoke([
+                SystemMessage(content=SUMMARY_PROMPT.format(max_words=int(self.summary_max_tokens * 0.75))),
+                HumanMessage(content=f"CURRENT SUMMARY:\n{previous}\n\nNEW MESSAGES:\n{transcript}"),
+            ])
+            return response.content
+        except Exception as e:
+            # Keep the old summary; the prompt still stays within budget
+            logger.warning("Failed to update conversation summary: %s", e)
+            return self.summary
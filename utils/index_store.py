@@ -0,0 +1,261 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from langchain_community.vectorstores import FAISS
+
+try:
+    import fcntl
+except ImportError:  # Windows: manifest updates are only serialized within a process
+    fcntl = None
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "manifest.lock"
+# Temporary directories older than this are left over from crashed writers
+STALE_TMP_SECONDS = 3600
+# Loads only rewrite the manifest when the recorded last use is older than this
+ACCESS_UPDATE_SECONDS = 60
+# Index directories (content hashes) and save_local temporaries; garbage
+# collection never touches anything else, in case the store shares a directory
+INDEX_DIR_PATTERN = re.compile(r"[0-9a-f]{64}")
+TMP_DIR_PATTERN = re.compile(r"[0-9a-f]{64}\.\d+\.\d+\.tmp")
+
+def current_index_settings() -> dict:
+    """
+    Return the settings that determine how an index is built. An index on disk
+    is only reused when these match.
+    """
+    return {
+        "embedding_model": config.EMBEDDING_MODEL,
+        "chunk_size": config.CHUNK_SIZE,
+        "chunk_overlap": config.CHUNK_OVERLAP,
+        "normalize_embeddings": config.EMBEDDING_NORMALIZE,
+        "index_type": config.FAISS_INDEX_TYPE,
+    }
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+class IndexStore:
+    """
+    Persistent FAISS index store shared across sessions and processes.
+
+    Each index lives in its own directory named after the document's content
+    hash. A JSON manifest in the store root records the settings that built
+    each index, its size and when it was last used, and drives garbage
+    collection once the store grows past its size budget. Manifest updates
+    hold an exclusive lock file, so processes and replicas sharing the
+    directory don't overwrite each other's entries.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int, use_mmap: bool = True):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.use_mmap = use_mmap
+        self._lock = threading.Lock()
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root_dir, MANIFEST_NAME)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the in-process lock and, where supported, the cross-process lock file"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root_dir, LOCK_NAME), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _index_dir(self, content_hash: str) -> str:
+        return os.path.join(self.root_dir, content_hash)
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_manifest(self, manifest: dict):
+        # Write to a temporary file and rename so other processes never see a
+        # partially written manifest.
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _io_flags(self) -> int:
+        if not self.use_mmap:
+            return 0
+        import faiss
+        # IO_FLAG_MMAP_IFC maps flat indexes too; older faiss builds only have
+        # IO_FLAG_MMAP, which maps inverted lists.
+        return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+    def load(self, content_hash: str, embeddings):
+        """
+        Load the index stored for content_hash, or return None if it is missing
+        or was built with different settings.
+
+        Indexes loaded memory-mapped are read-only; clone the underlying faiss
+        index before adding vectors to it.
+        """
+        with self._locked():
+            entry = self._read_manifest().get(content_hash)
+        index_dir = self._index_dir(content_hash)
+        if entry is None or entry.get("settings") != current_index_settings():
+            return None
+        if not os.path.isdir(index_dir):
+            self._update_entry(content_hash, None)
+            return None
+
+        # Loaded outside the lock; a concurrent save replaces the directory
+        # atomically and garbage collection may delete it mid-load
+        try:
+            vector_store = FAISS.load_local(
+                index_dir,
+                embeddings,
+                allow_dangerous_deserialization=True,  # Only files this store wrote
+                io_flags=self._io_flags(),
+            )
+        except Exception as e:
+            if not os.path.isdir(index_dir):
+                return None
+            raise RuntimeError(f"Error loading stored index {content_hash}: {str(e)}")
+
+        if time.time() - entry.get("last_access", 0) > ACCESS_UPDATE_SECONDS:
+            self._update_entry(content_hash, time.time())
+        return vector_store
+
+    def _update_entry(self, content_hash: str, last_access):
+        """Record a load in the manifest, or drop the entry if last_access is None"""
+        with self._locked():
+            manifest = self._read_manifest()
+            if content_hash not in manifest:
+                return
+            if last_access is None:
+                manifest.pop(content_hash)
+            else:
+                manifest[content_hash]["last_access"] = last_access
+            self._write_manifest(manifest)
+
+    def save(self, content_hash: str, vector_store, source_name: str = ""):
+        """
+        Persist a vector store under content_hash and record it in the manifest.
+        """
+        index_dir = self._index_dir(content_hash)
+        tmp_dir = f"{index_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # Write outside the lock; only the swap and manifest update hold it
+            vector_store.save_local(tmp_dir)
+        except Exception as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise RuntimeError(f"Error saving index {content_hash}: {str(e)}")
+
+        with self._locked():
+            try:
+                if os.path.isdir(index_dir):
+                    shutil.rmtree(index_dir)
+                os.replace(tmp_dir, index_dir)
+            except Exception as e:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise RuntimeError(f"Error saving index {content_hash}: {str(e)}")
+
+            manifest = self._read_manifest()
+            now = time.time()
+            manifest[content_hash] = {
+                "settings": current_index_settings(),
+                "source_name": source_name,
+                "num_vectors": vector_store.index.ntotal,
+                "size_bytes": _dir_size(index_dir),
+                "created": now,
+                "last_access": now,
+            }
+            self._write_manifest(manifest)
+            self._collect_garbage(manifest)
+
+    def collect_garbage(self) -> list:
+        """
+        Delete least recently used indexes until the store fits its size budget.
+
+        Returns:
+            list: Content hashes of the removed indexes
+        """
+        with self._locked():
+            return self._collect_garbage(self._read_manifest())
+
+    def _collect_garbage(self, manifest: dict) -> list:
+        removed = []
+        # Drop manifest entries whose directories were removed out from under us.
+        for content_hash in list(manifest):
+            if not os.path.isdir(self._index_dir(content_hash)):
+                manifest.pop(content_hash)
+                removed.append(content_hash)
+
+        # Index directories missing from the manifest (lost updates, crashed
+        # writers) can never be loaded; delete them so they don't escape the
+        # size budget. Only names this store creates are considered.
+        now = time.time()
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            if name in manifest or not os.path.isdir(path):
+                continue
+            if TMP_DIR_PATTERN.fullmatch(name):
+                if now - os.path.getmtime(path) < STALE_TMP_SECONDS:
+                    continue  # Another writer may still be saving it
+            elif not INDEX_DIR_PATTERN.fullmatch(name):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(name)
+
+        total = sum(entry.get("size_bytes", 0) for entry in manifest.values())
+        by_age = sorted(manifest.items(), key=lambda item: item[1].get("last_access", 0))
+        for content_hash, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._index_dir(content_hash), ignore_errors=True)
+            total -= entry.get("size_bytes", 0)
+            manifest.pop(content_hash)
+            removed.append(content_hash)
+
+        if removed:
+            self._write_manifest(manifest)
+        return removed
+
+    def total_bytes(self) -> int:
+        return sum(entry.get("size_bytes", 0) for entry in self._read_manifest().values())
+
+_index_store = None
+_index_store_lock = threading.Lock()
+
+def get_index_store() -> IndexStore:
+    """
+    Return the process-wide index store, creating it on first use.
+    """
+    global _index_store
+    with _index_store_lock:
+        if _index_store is None:
+            _index_store = IndexStore(
+                root_dir=config.INDEX_STORE_DIR,
+                max_bytes=config.INDEX_STORE_MAX_MB * 1024 * 1024,
+                use_mmap=config.INDEX_STORE_MMAP,
+            )
+        return _index_store
@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+from utils.rag_utils import get_or_create_vector_store, IngestionCancelled
+from utils.vector_cache import compute_content_hash
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+class IngestionQueueFull(Exception):
+    """Raised when the ingestion queue has no room for another job"""
+
+class IngestionJob:
+    """
+    A document waiting for or undergoing background ingestion, with progress
+    the UI can poll.
+    """
+
+    def __init__(self, data: bytes, file_name: str, document_id: str = None):
+        self.document_id = document_id or compute_content_hash(data)
+        self.file_name = file_name
+        self.status = QUEUED
+        self.pages_parsed = 0
+        self.chunks_embedded = 0
+        self.source = None
+        self.stats = {}
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self._data = data
+        self._cancel_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def cancel(self):
+        """
+        Ask the job to stop. Queued jobs are skipped; running jobs stop at the
+        next page or embedded batch.
+        """
+        self._cancel_event.set()
+        if self.status == QUEUED:
+            self.status = CANCELLED
+
+    def _check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise IngestionCancelled(self.file_name)
+
+    def _on_page(self, pages):
+        self.pages_parsed = pages
+        self._check_cancelled()
+
+    def _on_progress(self, chunks):
+        self.chunks_embedded = chunks
+        self._check_cancelled()
+
+    def run(self):
+        if self._cancel_event.is_set():
+            self.status = CANCELLED
+            return
+        self.status = RUNNING
+        try:
+            _, self.source = get_or_create_vector_store(
+                self._data, self.file_name, self.document_id,
+                on_page=self._on_page, on_progress=self._on_progress, stats=self.stats,
+            )
+            self.status = DONE
+        except IngestionCancelled:
+            self.status = CANCELLED
+        except Exception as e:
+            logger.warning("Ingestion of %s failed: %s", self.file_name, e)
+            self.error = str(e)
+            self.status = FAILED
+        finally:
+            self.finished_at = time.time()
+            # The vector store is in the cache and index store; drop the upload bytes
+            self._data = None
+
+class IngestionQueue:
+    """
+    Bounded job queue processed by a fixed pool of background worker threads.
+
+    Workers start on first submit. When max_queued jobs are already waiting,
+    submit raises IngestionQueueFull instead of letting work pile up.
+    """
+
+    def __init__(self, num_workers: int, max_queued: int):
+        self.num_workers = num_workers
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _start_workers(self):
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.run()
+            finally:
+                self._queue.task_done()
+
+    def submit(self, data: bytes, file_name: str, document_id: str = None) -> IngestionJob:
+        """
+        Queue a document for ingestion and return its job.
+        """
+        self._start_workers()
+        job = IngestionJob(data, file_name, document_id)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise IngestionQueueFull(f"Ingestion queue is full ({self._queue.maxsize} jobs waiting)")
+        return job
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+_ingestion_queue = None
+_ingestion_queue_lock = threading.Lock()
+
+def get_ingestion_queue() -> IngestionQueue:
+    """
+    Return the process-wide ingestion queue shared by all sessions.
+    """
+    global _ingestion_queue
+    with _ingestion_queue_lock:
+        if _ingestion_queue is None:
+            _ingestion_queue = IngestionQueue(
+                num_workers=config.INGEST_QUEUE_WORKERS,
+                max_queued=config.INGEST_QUEUE_MAX_SIZE,
+            )
+        return _ingestion_queue
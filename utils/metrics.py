@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class MetricsRegistry:
+    """
+    Rolling per-stage latency histograms over the last window_size samples,
+    plus simple counters, shared by every session in the process.
+    """
+
+    def __init__(self, window_size: int):
+        self.window_size = window_size
+        self._samples = defaultdict(lambda: deque(maxlen=self.window_size))
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def summary(self) -> dict:
+        """
+        Return count and p50/p95/p99 in milliseconds for every stage, plus counters.
+        """
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            counters = dict(self._counters)
+        stages = {}
+        for name, values in sorted(samples.items()):
+            stages[name] = {
+                "count": len(values),
+                "p50_ms": _percentile(values, 0.50) * 1000,
+                "p95_ms": _percentile(values, 0.95) * 1000,
+                "p99_ms": _percentile(values, 0.99) * 1000,
+            }
+        return {"stages": stages, "counters": counters}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counters.clear()
+
+_registry = MetricsRegistry(window_size=config.METRICS_WINDOW_SIZE)
+_trace_file_lock = threading.Lock()
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+class Trace:
+    """
+    Timings and attributes for one chat turn or document ingest.
+
+    Stage timings accumulate, so a stage entered several times reports its
+    total. finish() feeds every stage into the process-wide histograms as
+    '<kind>.<stage>' and appends the trace to the JSONL trace file, if one
+    is configured.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started_at = time.time()
+        self.stages = {}
+        self.attributes = {}
+        self._start = time.perf_counter()
+        self.total_seconds = None
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "started_at": self.started_at,
+            "total_ms": (self.total_seconds or 0.0) * 1000,
+            "stages_ms": {name: seconds * 1000 for name, seconds in self.stages.items()},
+            "attributes": self.attributes,
+        }
+
+    def finish(self):
+        if self.total_seconds is not None:
+            return self
+        self.total_seconds = time.perf_counter() - self._start
+        _registry.observe(f"{self.kind}.total", self.total_seconds)
+        for name, seconds in self.stages.items():
+            _registry.observe(f"{self.kind}.{name}", seconds)
+        for name, value in self.attributes.items():
+            if isinstance(value, bool):
+                _registry.increment(f"{self.kind}.{name}.{str(value).lower()}")
+        if config.METRICS_TRACE_FILE:
+            _append_trace(self.to_dict())
+        return self
+
+def start_trace(kind: str) -> Trace:
+    return Trace(kind)
+
+def _append_trace(record: dict):
+    trace_dir = os.path.dirname(config.METRICS_TRACE_FILE)
+    with _trace_file_lock:
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+        with open(config.METRICS_TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = json.dumps(_registry.summary(), indent=2).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep scrapes out of the app's stderr
+        pass
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """
+    Serve the metrics summary as JSON at http://host:port/metrics from a
+    daemon thread. Safe to call on every rerun; only the first call starts it.
+    """
+    global _metrics_server
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _metrics_server
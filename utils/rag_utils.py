@@ -1,52 +1,565 @@
 import os
+import re
 import sys
-from typing import List
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import math
+import time
+import logging
+import tempfile
+import threading
+import weakref
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from typing import Any, Iterable, Iterator, List, Optional
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 from config import config
 from models.embeddings import get_embedding_model
+from utils.vector_cache import get_vector_store_cache, compute_content_hash, make_cache_key
+from utils.index_store import get_index_store
+from utils.embedding_cache import get_embedding_cache, embedding_model_key
+from utils.ann_index import convert_vector_store_index, apply_search_params, restricted_search_params
+from utils.metrics import start_trace
+
+logger = logging.getLogger(__name__)
+
+class IngestionCancelled(Exception):
+    """Raised from a progress callback to stop an ingest in progress"""
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.,/&-][a-z0-9]+)*")
+
+# BM25 indexes keyed by the vector store they were built from
+_bm25_indexes = weakref.WeakKeyDictionary()
+_bm25_lock = threading.Lock()
+
+def _get_loader(file_path: str):
+    # Loaders and the text splitter are imported on first use: the PDF loader
+    # pulls in langchain's image parsers, which are slow to import
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader
+    if file_path.lower().endswith('.pdf'):
+        return PyPDFLoader(file_path)
+    elif file_path.lower().endswith('.txt'):
+        return TextLoader(file_path)
+    else:
+        raise ValueError(f"Unsupported file format: {file_path}")
+
+def _get_text_splitter():
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=config.CHUNK_SIZE,
+        chunk_overlap=config.CHUNK_OVERLAP
+    )
+
+def iter_document_chunks(file_path: str, on_page=None) -> Iterator[Document]:
+    """
+    Lazily load a document (PDF or TXT) page by page and yield its chunks.
+
+    Only the current page and its chunks are held at a time, so peak memory
+    no longer grows with the page count. Produces the same chunks as
+    load_and_split_document, which splits each page separately too.
+    on_page, if given, is called with the number of pages parsed so far.
+    """
+    try:
+        loader = _get_loader(file_path)
+        text_splitter = _get_text_splitter()
+        for pages, page in enumerate(loader.lazy_load(), start=1):
+            if on_page:
+                on_page(pages)
+            yield from text_splitter.split_documents([page])
+
+    except IngestionCancelled:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error processing document: {str(e)}")
 
 def load_and_split_document(file_path: str) -> List[Document]:
     """
     Load a document (PDF or TXT) and split it into chunks.
     """
     try:
-        if file_path.lower().endswith('.pdf'):
-            loader = PyPDFLoader(file_path)
-        elif file_path.lower().endswith('.txt'):
-            loader = TextLoader(file_path)
-        else:
-            raise ValueError(f"Unsupported file format: {file_path}")
-            
+        loader = _get_loader(file_path)
         documents = loader.load()
         
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=config.CHUNK_SIZE,
-            chunk_overlap=config.CHUNK_OVERLAP
-        )
+        text_splitter = _get_text_splitter()
         
         chunks = text_splitter.split_documents(documents)
         return chunks
         
     except Exception as e:
         raise RuntimeError(f"Error processing document: {str(e)}")
-def create_vector_store(chunks: List[Document], embedding_provider="huggingface"):
+
+def _iter_batches(chunks: Iterable[Document], batch_size: int):
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _timed_iter(iterable, timings: dict, key: str):
+    """Yield from iterable, adding the time spent producing items to timings[key]"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[key] += time.perf_counter() - start
+        yield item
+
+def create_vector_store(chunks: Iterable[Document], embedding_provider="huggingface",
+                        batch_size=None, max_workers=None, on_progress=None, stats=None):
     """
     Create a FAISS vector store from document chunks.
+
+    Chunks are embedded in batches on a worker pool and added to the index as
+    each batch finishes. Only a bounded number of batches is in flight at once,
+    so chunks may be supplied lazily by a generator.
+
+    With EMBEDDING_CACHE_ENABLED, only chunks missing from the chunk embedding
+    cache are sent to the embedding model, and identical chunks are embedded once.
+
+    Args:
+        chunks (Iterable[Document]): Chunks to embed
+        embedding_provider (str): Provider passed to get_embedding_model
+        batch_size (int): Chunks per batch, defaults to config.INGEST_BATCH_SIZE
+        max_workers (int): Worker threads, defaults to config.INGEST_WORKERS
+        on_progress (callable): Called with the number of chunks embedded so far
+        stats (dict): If given, updated with throughput and per-stage timings
+
+    Returns:
+        FAISS: The vector store
     """
     try:
         embeddings = get_embedding_model(provider=embedding_provider)
-        vector_store = FAISS.from_documents(chunks, embeddings)
+        batch_size = batch_size or config.INGEST_BATCH_SIZE
+        max_workers = max_workers or config.INGEST_WORKERS
+
+        # parse covers loading and splitting when chunks come from a generator;
+        # embed is summed over workers, so it can exceed wall-clock time
+        timings = {"parse": 0.0, "embed": 0.0, "index_add": 0.0, "index_build": 0.0}
+        timings_lock = threading.Lock()
+        embedding_cache = get_embedding_cache() if config.EMBEDDING_CACHE_ENABLED else None
+        model_key = embedding_model_key(embedding_provider, embeddings)
+        cache_counts = {"hits": 0, "deduplicated": 0, "embedded": 0}
+
+        def embed_batch(batch):
+            start = time.perf_counter()
+            texts = [doc.page_content for doc in batch]
+            if embedding_cache is not None:
+                vectors, counts = embedding_cache.embed_documents(embeddings, model_key, texts)
+            else:
+                vectors, counts = embeddings.embed_documents(texts), {"embedded": len(texts)}
+            with timings_lock:
+                timings["embed"] += time.perf_counter() - start
+                for name, count in counts.items():
+                    cache_counts[name] += count
+            return batch, vectors
+
+        vector_store = None
+        embedded = 0
+
+        def add_batch(batch, vectors):
+            nonlocal vector_store, embedded
+            start = time.perf_counter()
+            text_embeddings = [(doc.page_content, vector) for doc, vector in zip(batch, vectors)]
+            metadatas = [doc.metadata for doc in batch]
+            if vector_store is None:
+                vector_store = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas)
+            else:
+                vector_store.add_embeddings(text_embeddings, metadatas=metadatas)
+            timings["index_add"] += time.perf_counter() - start
+            embedded += len(batch)
+            if on_progress:
+                on_progress(embedded)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = set()
+            for batch in _iter_batches(_timed_iter(chunks, timings, "parse"), batch_size):
+                pending.add(pool.submit(embed_batch, batch))
+                # Bound the batches held in memory
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        add_batch(*future.result())
+            for future in as_completed(pending):
+                add_batch(*future.result())
+
+        if vector_store is None:
+            raise ValueError("No text could be extracted from the document")
+        build_start = time.perf_counter()
+        convert_vector_store_index(vector_store)
+        timings["index_build"] = time.perf_counter() - build_start
+
+        elapsed = time.perf_counter() - start
+        ingest_stats = {
+            "chunks": embedded,
+            "seconds": elapsed,
+            "chunks_per_sec": embedded / elapsed if elapsed > 0 else 0.0,
+            "batch_size": batch_size,
+            "workers": max_workers,
+            "embedded_chunks": cache_counts["embedded"],
+            "embedding_cache_hits": cache_counts["hits"],
+            "deduplicated_chunks": cache_counts["deduplicated"],
+            "embedding_cache_hit_rate": 1 - cache_counts["embedded"] / embedded if embedded else 0.0,
+            **{f"{name}_seconds": seconds for name, seconds in timings.items()},
+        }
+        if stats is not None:
+            stats.update(ingest_stats)
+        logger.info("Indexed %d chunks in %.2fs (%.1f chunks/sec, %d embedded, %d from cache, %d duplicates)",
+                    embedded, elapsed, ingest_stats["chunks_per_sec"],
+                    cache_counts["embedded"], cache_counts["hits"], cache_counts["deduplicated"])
         return vector_store
+    except IngestionCancelled:
+        raise
     except Exception as e:
         raise RuntimeError(f"Error creating vector store: {str(e)}")
 
-def get_retriever(vector_store, k=3):
+def load_vector_store(content_hash: str, trace=None):
+    """
+    Return an already processed document's vector store from the in-memory
+    cache or the persistent index store, without the original file.
+
+    Returns:
+        tuple: (vector_store, source) with source 'memory' or 'disk', or
+            (None, None) if the document was never processed with the
+            current settings
+    """
+    trace = trace or start_trace("load")
+    cache = get_vector_store_cache()
+    cache_key = make_cache_key(content_hash)
+
+    with trace.stage("cache_lookup"):
+        vector_store = cache.get(cache_key)
+    if vector_store is not None:
+        return vector_store, "memory"
+
+    with trace.stage("index_store_load"):
+        vector_store = get_index_store().load(content_hash, get_embedding_model())
+    if vector_store is None:
+        return None, None
+    # Apply the current nprobe/efSearch settings rather than the saved ones
+    apply_search_params(vector_store.index)
+    if config.RETRIEVAL_MODE == "hybrid":
+        with trace.stage("bm25_build"):
+            get_bm25_index(vector_store)
+    cache.put(cache_key, vector_store)
+    return vector_store, "disk"
+
+def get_or_create_vector_store(data: bytes, file_name: str, content_hash: str = None,
+                               on_page=None, on_progress=None, stats=None):
     """
-    Get a retriever from the vector store.
+    Return the vector store for an uploaded document, reusing the in-memory
+    cache or the persistent index store before parsing and embedding it.
+
+    Args:
+        data (bytes): Raw content of the uploaded file
+        file_name (str): Original file name, used to pick the loader
+        content_hash (str): Precomputed compute_content_hash(data), if available
+        on_page (callable): Called with the number of pages parsed so far
+        on_progress (callable): Called with the number of chunks embedded so far
+        stats (dict): If given, updated with ingest stats when the document is built
+
+    Returns:
+        tuple: (vector_store, source) where source is 'memory', 'disk' or 'built'
+    """
+    trace = start_trace("ingest")
+    trace.set(file_name=file_name, bytes=len(data))
+    try:
+        with trace.stage("hash"):
+            content_hash = content_hash or compute_content_hash(data)
+        vector_store, source = load_vector_store(content_hash, trace)
+        if vector_store is not None:
+            trace.set(source=source, cache_hit=True)
+            return vector_store, source
+
+        cache = get_vector_store_cache()
+        cache_key = make_cache_key(content_hash)
+        index_store = get_index_store()
+
+        # Loaders need a path, so write the upload to a temporary file
+        suffix = os.path.splitext(file_name)[1].lower()
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            f.write(data)
+            file_path = f.name
+        ingest_stats = {}
+        try:
+            if config.STREAMING_INGEST:
+                chunks = iter_document_chunks(file_path, on_page=on_page)
+            else:
+                with trace.stage("parse"):
+                    chunks = load_and_split_document(file_path)
+            vector_store = create_vector_store(chunks, on_progress=on_progress, stats=ingest_stats)
+        finally:
+            os.remove(file_path)
+        for name in ("parse", "embed", "index_add", "index_build"):
+            trace.add_stage(name, ingest_stats.get(f"{name}_seconds", 0.0))
+        trace.set(source="built", cache_hit=False, chunks=ingest_stats.get("chunks"),
+                  chunks_per_sec=ingest_stats.get("chunks_per_sec"),
+                  embedded_chunks=ingest_stats.get("embedded_chunks"),
+                  embedding_cache_hit_rate=ingest_stats.get("embedding_cache_hit_rate"))
+        if stats is not None:
+            stats.update(ingest_stats)
+
+        with trace.stage("index_store_save"):
+            index_store.save(content_hash, vector_store, source_name=file_name)
+        if config.RETRIEVAL_MODE == "hybrid":
+            # Build the sparse index alongside the dense one at ingest time
+            with trace.stage("bm25_build"):
+                get_bm25_index(vector_store)
+        cache.put(cache_key, vector_store)
+        return vector_store, "built"
+    finally:
+        trace.finish()
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokenizer for BM25 that keeps figures, tickers and clause
+    numbers ("12.5", "10-k", "3.2.1") as single tokens.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+    Sparse BM25 inverted index over the chunks of a FAISS vector store.
+
+    Positions match the FAISS index, so results can be fused with dense
+    search directly. Postings keep raw term frequencies, so another index can
+    be appended (extend) or chunks removed (remove) without re-tokenizing the
+    rest; BM25 weights are computed per query term and cached until the next
+    change.
+    """
+
+    def __init__(self, texts: List[str] = (), k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        # term -> list of (positions, term frequencies) array pairs
+        self.postings = {}
+        self._weights = {}
+        self._length_norm = None
+        if texts:
+            self._append_texts(texts)
+
+    @property
+    def size(self) -> int:
+        return len(self.doc_lengths)
+
+    def _changed(self):
+        self._weights.clear()
+        self._length_norm = None
+
+    def _append_texts(self, texts: List[str]):
+        offset = self.size
+        doc_terms = [tokenize(text) for text in texts]
+        postings = {}
+        for position, terms in enumerate(doc_terms, start=offset):
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(position)
+                postings[term][1].append(tf)
+        for term, (positions, tfs) in postings.items():
+            self.postings.setdefault(term, []).append(
+                (np.array(positions, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            )
+        lengths = np.array([len(terms) for terms in doc_terms], dtype=np.float32)
+        self.doc_lengths = np.concatenate([self.doc_lengths, lengths])
+        self._changed()
+
+    def extend(self, other: "BM25Index"):
+        """
+        Append another index's chunks after this one's, as when a document's
+        vectors are appended to a corpus store.
+        """
+        offset = self.size
+        for term, parts in other.postings.items():
+            self.postings.setdefault(term, []).extend((positions + offset, tfs) for positions, tfs in parts)
+        self.doc_lengths = np.concatenate([self.doc_lengths, other.doc_lengths])
+        self._changed()
+
+    def remove(self, positions: List[int]):
+        """
+        Remove chunks and shift later positions down, matching FAISS.delete.
+        """
+        keep = np.ones(self.size, dtype=bool)
+        keep[np.asarray(positions, dtype=np.int64)] = False
+        new_positions = np.cumsum(keep) - 1
+        for term in list(self.postings):
+            parts = []
+            for term_positions, tfs in self.postings[term]:
+                kept = keep[term_positions]
+                if kept.any():
+                    parts.append((new_positions[term_positions[kept]], tfs[kept]))
+            if parts:
+                self.postings[term] = parts
+            else:
+                del self.postings[term]
+        self.doc_lengths = self.doc_lengths[keep]
+        self._changed()
+
+    def _term_weights(self, term):
+        weights = self._weights.get(term)
+        if weights is None:
+            parts = self.postings.get(term)
+            if not parts:
+                return None
+            if self._length_norm is None:
+                avg_length = float(self.doc_lengths.mean()) if self.size else 0.0
+                self._length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / (avg_length or 1.0))
+            positions = np.concatenate([part[0] for part in parts])
+            tfs = np.concatenate([part[1] for part in parts])
+            idf = math.log(1 + (self.size - len(positions) + 0.5) / (len(positions) + 0.5))
+            weights = (positions, (idf * tfs * (self.k1 + 1) / (tfs + self._length_norm[positions])).astype(np.float32))
+            self._weights[term] = weights
+        return weights
+
+    def search(self, query: str, k: int, positions=None) -> List[int]:
+        """
+        Return the positions of the top-k chunks for query, best first,
+        optionally only among the given positions.
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            weights = self._term_weights(term)
+            if weights is not None:
+                scores[weights[0]] += weights[1]
+        if positions is not None:
+            allowed = np.zeros(self.size, dtype=bool)
+            allowed[positions] = True
+            scores[~allowed] = 0.0
+        matched = np.flatnonzero(scores)
+        if len(matched) == 0:
+            return []
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k)[:k]]
+        return matched[np.argsort(-scores[matched])].tolist()
+
+def _store_texts(vector_store) -> List[str]:
+    docstore_ids = vector_store.index_to_docstore_id
+    return [vector_store.docstore.search(docstore_ids[i]).page_content for i in range(len(docstore_ids))]
+
+def get_bm25_index(vector_store) -> BM25Index:
+    """
+    Return the BM25 index for a vector store, building it on first use.
+    Indexes are cached per vector store and rebuilt if its size changes.
+    """
+    with _bm25_lock:
+        bm25 = _bm25_indexes.get(vector_store)
+        if bm25 is None or bm25.size != len(vector_store.index_to_docstore_id):
+            bm25 = BM25Index(_store_texts(vector_store))
+            _bm25_indexes[vector_store] = bm25
+        return bm25
+
+def extend_bm25_index(vector_store, document_bm25: BM25Index):
+    """
+    Append a document's BM25 postings to a store's index after the
+    document's vectors were appended to the store. Falls back to a rebuild on
+    next use if the store's index is missing or out of step.
+    """
+    with _bm25_lock:
+        bm25 = _bm25_indexes.get(vector_store)
+        expected = len(vector_store.index_to_docstore_id) - document_bm25.size
+        if bm25 is None and expected == 0:
+            bm25 = _bm25_indexes[vector_store] = BM25Index()
+        if bm25 is None or bm25.size != expected:
+            _bm25_indexes.pop(vector_store, None)
+            return
+        bm25.extend(document_bm25)
+
+def remove_from_bm25_index(vector_store, positions: List[int]):
+    """
+    Remove deleted chunks from a store's BM25 index, compacting positions the
+    way FAISS.delete does.
+    """
+    with _bm25_lock:
+        bm25 = _bm25_indexes.get(vector_store)
+        if bm25 is not None:
+            bm25.remove(positions)
+
+def _document_positions(vector_store, document_ids) -> np.ndarray:
+    """Index positions of the chunks belonging to the given documents"""
+    allowed = set(document_ids)
+    docstore = vector_store.docstore
+    return np.array([position for position, docstore_id in vector_store.index_to_docstore_id.items()
+                     if docstore.search(docstore_id).metadata.get("document_id") in allowed], dtype=np.int64)
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing dense FAISS similarity and BM25 keyword ranks with
+    weighted reciprocal rank fusion; with bm25 set to None it ranks by dense
+    similarity only. If document_ids is set, both rankings are restricted to
+    chunks from those documents before ranking, so a small document isn't
+    crowded out of the candidates by a large one.
+    """
+
+    vector_store: Any
+    bm25: Any = None
+    k: int = 3
+    fetch_k: int = 20
+    vector_weight: float = 1.0
+    bm25_weight: float = 1.0
+    rrf_k: int = 60
+    document_ids: Optional[List[str]] = None
+
+    def _dense_positions(self, query: str, allowed=None) -> List[int]:
+        vector = np.array([self.vector_store._embed_query(query)], dtype=np.float32)
+        if self.vector_store._normalize_L2:
+            faiss.normalize_L2(vector)
+        index = self.vector_store.index
+        if allowed is None:
+            _, indices = index.search(vector, self.fetch_k)
+        else:
+            _, indices = index.search(vector, self.fetch_k, params=restricted_search_params(index, allowed))
+        return [int(i) for i in indices[0] if i != -1]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        allowed = None
+        if self.document_ids:
+            allowed = _document_positions(self.vector_store, self.document_ids)
+            if len(allowed) == 0:
+                return []
+        scores = {}
+        rankings = [(self._dense_positions(query, allowed), self.vector_weight)]
+        if self.bm25 is not None:
+            rankings.append((self.bm25.search(query, self.fetch_k, allowed), self.bm25_weight))
+        for positions, weight in rankings:
+            for rank, position in enumerate(positions):
+                scores[position] = scores.get(position, 0.0) + weight / (self.rrf_k + rank + 1)
+
+        docstore_ids = self.vector_store.index_to_docstore_id
+        best = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [self.vector_store.docstore.search(docstore_ids[position]) for position in best]
+
+def get_retriever(vector_store, k=None, document_ids=None):
+    """
+    Get a retriever from the vector store. Uses hybrid BM25 + vector
+    retrieval unless config.RETRIEVAL_MODE is 'vector'.
+
+    Args:
+        vector_store (FAISS): The vector store
+        k (int): Chunks to return, defaults to config.RETRIEVAL_K
+        document_ids (list): Optionally restrict results to these documents
     """
-    return vector_store.as_retriever(search_kwargs={"k": k})
+    k = k or config.RETRIEVAL_K
+    if config.RETRIEVAL_MODE == "vector" and not document_ids:
+        return vector_store.as_retriever(search_kwargs={"k": k})
+    return HybridRetriever(
+        vector_store=vector_store,
+        bm25=get_bm25_index(vector_store) if config.RETRIEVAL_MODE == "hybrid" else None,
+        k=k,
+        fetch_k=max(config.RETRIEVAL_FETCH_K, k),
+        vector_weight=config.HYBRID_VECTOR_WEIGHT,
+        bm25_weight=config.HYBRID_BM25_WEIGHT,
+        rrf_k=config.HYBRID_RRF_K,
+        document_ids=document_ids,
+    )
@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+from models.embeddings import get_embedding_model
+
+def make_response_scope(provider, model_name, response_mode, system_prompt, document_hash=""):
+    """
+    Build the scope a cached answer is valid for. Answers are only reused for
+    the same provider/model, response mode, system prompt and source document
+    (or data source, for chat and web search).
+    """
+    parts = [provider, model_name or "", response_mode, system_prompt, document_hash or ""]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+class SemanticResponseCache:
+    """
+    Response cache keyed on query embeddings, backed by a local SQLite file.
+
+    A lookup embeds the query with the shared embedding model and returns the
+    stored answer of the most similar earlier query in the same scope, if its
+    cosine similarity clears the threshold. Entries expire after a TTL and the
+    least recently used ones are evicted beyond max_entries.
+    """
+
+    def __init__(self, db_path, similarity_threshold, ttl_seconds, max_entries, embedding_provider="huggingface"):
+        self.db_path = db_path
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.embedding_provider = embedding_provider
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " scope TEXT NOT NULL,"
+            " query TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_scope ON responses (scope)")
+        self._conn.commit()
+
+    def embed_query(self, query):
+        """
+        Return the normalized query embedding used for lookups, so callers can
+        embed once for both lookup and store.
+        """
+        vector = np.asarray(get_embedding_model(self.embedding_provider).embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, query, scope, query_embedding=None):
+        """
+        Return the cached response for a similar query in scope, or None.
+        """
+        vector = query_embedding if query_embedding is not None else self.embed_query(query)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            rows = self._conn.execute(
+                "SELECT id, embedding, response FROM responses WHERE scope = ?", (scope,)
+            ).fetchall()
+
+            best_id, best_response, best_score = None, None, -1.0
+            if rows:
+                matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                best_id, best_response, best_score = rows[best][0], rows[best][2], float(scores[best])
+
+            if best_id is not None and best_score >= self.similarity_threshold:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE id = ?", (now, best_id))
+                self._conn.commit()
+                self.hits += 1
+                return best_response
+
+            self._conn.commit()
+            self.misses += 1
+            return None
+
+    def store(self, query, scope, response, query_embedding=None):
+        """
+        Cache a response for query in scope, evicting least recently used
+        entries beyond max_entries.
+        """
+        vector = query_embedding if query_embedding is not None else self.embed_query(query)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO responses (scope, query, embedding, response, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, query, vector.astype(np.float32).tobytes(), response, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE id IN ("
+                " SELECT id FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> SemanticResponseCache:
+    """
+    Return the process-wide response cache, creating it on first use.
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = SemanticResponseCache(
+                db_path=config.RESPONSE_CACHE_PATH,
+                similarity_threshold=config.RESPONSE_CACHE_THRESHOLD,
+                ttl_seconds=config.RESPONSE_CACHE_TTL_SECONDS,
+                max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+            )
+        return _response_cache
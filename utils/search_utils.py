@@ -1,15 +1,240 @@
-from langchain_community.tools import DuckDuckGoSearchRun
+import os
+import re
+import sys
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List
 from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
 
-def perform_web_search(query: str) -> str:
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+
+NO_RESULTS = "No good DuckDuckGo Search Result was found"
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "what", "who", "whom", "which", "when",
+    "where", "why", "how", "do", "does", "did", "of", "in", "on", "for", "to", "and", "or",
+    "about", "me", "tell", "can", "you", "please", "i", "my", "with", "by", "be", "it",
+}
+
+class DuckDuckGoBackend:
+    """
+    Search backend using DuckDuckGo. The API wrapper is created once and reused.
+    """
+
+    def __init__(self, max_results=5):
+        self.max_results = max_results
+        self._wrapper = DuckDuckGoSearchAPIWrapper(max_results=max_results)
+
+    def search(self, query: str) -> List[Dict[str, str]]:
+        return self._wrapper.results(query, max_results=self.max_results)
+
+class StaticSearchBackend:
+    """
+    Local stand-in backend returning canned results, for tests and offline runs.
+
+    Args:
+        results (dict): Maps normalized queries to lists of result dicts with
+            'title', 'snippet' and 'link' keys; unknown queries get default
+        default (list): Results for queries not in results
+        delay (float): Seconds to sleep per query, to simulate network latency
+    """
+
+    def __init__(self, results=None, default=None, delay=0.0):
+        self.results = results or {}
+        self.default = default or []
+        self.delay = delay
+        self.calls = 0
+
+    def search(self, query: str) -> List[Dict[str, str]]:
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return list(self.results.get(normalize_query(query), self.default))
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query for cache lookups: lowercase, collapse whitespace and
+    strip surrounding punctuation.
+    """
+    return re.sub(r"\s+", " ", query.lower()).strip(" \t?!.,;:")
+
+def expand_query(query: str, max_queries: int) -> List[str]:
+    """
+    Return up to max_queries variants of query: the original, a keyword-only
+    form and a form asking for recent results.
+    """
+    variants = [query]
+    keywords = " ".join(w for w in re.findall(r"[\w.$%&-]+", query) if w.lower() not in STOPWORDS)
+    if keywords:
+        variants.append(keywords)
+    variants.append(f"{keywords or query} latest")
+
+    unique = []
+    seen = set()
+    for variant in variants:
+        key = normalize_query(variant)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(variant)
+    return unique[:max(1, max_queries)]
+
+class SearchResultCache:
+    """
+    Thread-safe TTL cache of search results keyed by normalized query.
+    """
+
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query, results):
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_backend = None
+_backend_lock = threading.Lock()
+_search_cache = SearchResultCache(config.SEARCH_CACHE_TTL_SECONDS, config.SEARCH_CACHE_MAX_ENTRIES)
+_search_pool = ThreadPoolExecutor(max_workers=config.SEARCH_MAX_WORKERS, thread_name_prefix="web-search")
+
+def get_search_backend():
+    """
+    Return the process-wide search backend, creating the DuckDuckGo one on first use.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = DuckDuckGoBackend(max_results=config.SEARCH_MAX_RESULTS)
+        return _backend
+
+def set_search_backend(backend):
+    """
+    Replace the search backend (e.g. with a StaticSearchBackend) and clear cached results.
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    _search_cache.clear()
+
+def get_search_cache() -> SearchResultCache:
+    return _search_cache
+
+def search_results(query: str) -> List[Dict[str, str]]:
+    """
+    Return structured results for one query, served from the TTL cache when possible.
+    """
+    results = _search_cache.get(query)
+    if results is None:
+        results = get_search_backend().search(query)
+        _search_cache.put(query, results)
+    return results
+
+def _merge_results(result_lists, max_results):
+    # Interleave the result lists so every reformulation contributes its top
+    # hits, dropping duplicates by link (or snippet when there is no link).
+    merged = []
+    seen = set()
+    for rank in range(max(len(results) for results in result_lists)):
+        for results in result_lists:
+            if rank >= len(results):
+                continue
+            result = results[rank]
+            key = result.get("link") or normalize_query(result.get("snippet", ""))
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(result)
+    return merged[:max_results]
+
+def multi_query_search(queries: List[str], deadline=None, max_results=None) -> List[Dict[str, str]]:
+    """
+    Run several queries concurrently and merge their deduplicated results.
+
+    Queries still running when the deadline passes are ignored; failures of
+    individual queries are skipped unless every query fails.
+    """
+    deadline = deadline if deadline is not None else config.SEARCH_DEADLINE_SECONDS
+    max_results = max_results or config.SEARCH_MAX_RESULTS * 2
+    futures = [_search_pool.submit(search_results, query) for query in queries]
+    done, _ = wait(futures, timeout=deadline)
+
+    result_lists = []
+    errors = []
+    # Keep the original query order so its results rank first
+    for future in futures:
+        if future not in done:
+            continue
+        try:
+            result_lists.append(future.result())
+        except Exception as e:
+            errors.append(e)
+
+    if not result_lists:
+        if errors:
+            raise errors[0]
+        raise TimeoutError(f"No search results within {deadline}s")
+    if not any(result_lists):
+        return []
+    return _merge_results(result_lists, max_results)
+
+def format_search_results(results: List[Dict[str, str]]) -> str:
+    """
+    Format search results as context text for the LLM.
+    """
+    if not results:
+        return NO_RESULTS
+    lines = []
+    for result in results:
+        title = result.get("title", "")
+        snippet = result.get("snippet", "")
+        link = result.get("link", "")
+        line = f"{title}: {snippet}" if title else snippet
+        if link:
+            line += f" ({link})"
+        lines.append(line)
+    return "\n".join(lines)
+
+def perform_web_search(query: str, max_queries=None) -> str:
     """
     Perform a web search using DuckDuckGo.
+
+    With max_queries > 1 (default config.SEARCH_MAX_QUERIES), reformulations
+    of the query run concurrently and their results are merged.
     """
     try:
-        wrapper = DuckDuckGoSearchAPIWrapper(max_results=5)
-        search = DuckDuckGoSearchRun(api_wrapper=wrapper)
-        results = search.invoke(query)
-        return results
+        max_queries = max_queries or config.SEARCH_MAX_QUERIES
+        if max_queries > 1:
+            results = multi_query_search(expand_query(query, max_queries))
+        else:
+            results = search_results(query)
+        return format_search_results(results)
     except Exception as e:
         return f"Error performing web search: {str(e)}"
-
@@ -0,0 +1,25 @@
+from functools import lru_cache
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    # Loaded on first use: the encoding file is read (or downloaded) on load
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken is optional (it ships with langchain-openai); fall back to an estimate
+        return None
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    Count tokens in text. Uses the cl100k_base encoding when tiktoken is
+    available, which is close enough for budgeting across providers, and
+    roughly four characters per token otherwise.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
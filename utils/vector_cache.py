@@ -0,0 +1,102 @@
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config import config
+
+def compute_content_hash(data: bytes) -> str:
+    """
+    Return the SHA-256 hex digest of an uploaded file's raw bytes.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def make_cache_key(content_hash: str) -> str:
+    """
+    Build the cache key for a document from its content hash and the
+    settings that determine how it is chunked and embedded.
+    """
+    settings = (
+        f"{config.CHUNK_SIZE}:{config.CHUNK_OVERLAP}:{config.EMBEDDING_MODEL}:"
+        f"{config.EMBEDDING_NORMALIZE}:{config.FAISS_INDEX_TYPE}"
+    )
+    return f"{content_hash}:{hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]}"
+
+def estimate_vector_store_size(vector_store) -> int:
+    """
+    Roughly estimate the memory used by a FAISS vector store in bytes:
+    float32 vectors plus the text held in its docstore.
+    """
+    size = 0
+    index = getattr(vector_store, "index", None)
+    if index is not None:
+        size += index.ntotal * index.d * 4
+    docstore = getattr(vector_store, "docstore", None)
+    for doc in getattr(docstore, "_dict", {}).values():
+        size += len(doc.page_content.encode("utf-8"))
+        size += len(str(doc.metadata))
+    return size
+
+class VectorStoreCache:
+    """
+    Thread-safe LRU cache of processed vector stores bounded by a memory budget.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached vector store for key, or None, marking it as recently used.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, vector_store):
+        """
+        Store a vector store under key and evict least recently used entries
+        until the cache fits its memory budget again.
+        """
+        size = estimate_vector_store_size(vector_store)
+        with self._lock:
+            if key in self._entries:
+                self._current_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                # Larger than the whole budget; never cache it.
+                return
+            self._entries[key] = (vector_store, size)
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._current_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    @property
+    def current_bytes(self) -> int:
+        return self._current_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+# Module-level instance so the cache survives Streamlit reruns and is shared by
+# every session in the process.
+_vector_store_cache = VectorStoreCache(max_bytes=config.VECTOR_CACHE_MAX_MB * 1024 * 1024)
+
+def get_vector_store_cache() -> VectorStoreCache:
+    """
+    Return the process-wide vector store cache.
+    """
+    return _vector_store_cache